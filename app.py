@@ -1,14 +1,6 @@
 import gradio as gr
 import logging
 
-# Import UI creation functions from the ui directory
-from src.ui.character_ui import create_character_ui
-from src.ui.scenario_ui import create_scenario_ui
-from src.ui.dataset_ui import create_dataset_ui
-from src.ui.generation_ui import create_generation_ui
-from src.ui.prompt_ui import create_prompt_ui
-
-
 # Configure basic logging
 logging.basicConfig(
     level=logging.INFO,
@@ -120,6 +112,17 @@ css = """
 
 def main():
     """Main function to launch the Gradio app."""
+    # Imported here rather than at module level: spawned worker processes
+    # (sharded export) re-import this module as __mp_main__, and the services
+    # behind the UI open the database and run migrations on import.
+    from src.ui.character_ui import create_character_ui
+    from src.ui.scenario_ui import create_scenario_ui
+    from src.ui.dataset_ui import create_dataset_ui
+    from src.ui.generation_ui import create_generation_ui
+    from src.ui.prompt_ui import create_prompt_ui
+    from src.services import generation_worker
+    from src.utils import client_pool
+
     logger.info("启动角色LLM数据集生成器...")
 
     with gr.Blocks(
@@ -155,8 +158,16 @@ def main():
     # Use queue() for handling multiple users or long-running tasks
     demo.queue()
 
+    # Start the background generation worker and resume unfinished jobs
+    worker = generation_worker.get_worker()
+
     # Launch the app
-    demo.launch(server_name="0.0.0.0", server_port=7860, show_api=False)
+    try:
+        demo.launch(server_name="0.0.0.0", server_port=7860, show_api=False)
+    finally:
+        # Stop the generation worker and close pooled LLM HTTP clients on shutdown
+        worker.stop()
+        client_pool.close_all()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+"""
+Benchmark concurrent corpus writes against the SQLite engine profiles.
+
+Writer threads insert corpus rows in small transactions, the way auto-commit
+generation does, while reader threads keep browsing the dataset. Each profile
+runs against a fresh temporary database.
+
+Usage:
+    python benchmarks/db_concurrency.py [--writers 4] [--readers 4] [--seconds 10]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from src.database.database_manager import (  # noqa: E402
+    ENGINE_PROFILES,
+    create_db_engine,
+)
+from src.models.data_models import Base, Character, Corpus, Dataset  # noqa: E402
+
+ROWS_PER_TRANSACTION = 10
+DIALOGUE = [
+    {"role": "user", "content": "今天天气怎么样？" * 5},
+    {"role": "assistant", "content": "今天阳光明媚，适合出去走走。" * 5},
+]
+
+
+def run_profile(profile_name: str, writers: int, readers: int, seconds: float) -> dict:
+    profile = ENGINE_PROFILES[profile_name]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url = f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        write_engine = create_db_engine(db_url, profile)
+        read_engine = create_db_engine(db_url, profile, read_only=True)
+        Base.metadata.create_all(write_engine)
+
+        WriteSession = sessionmaker(bind=write_engine)
+        ReadSession = sessionmaker(bind=read_engine)
+        with WriteSession() as session:
+            character = Character(name="bench")
+            dataset = Dataset(name="bench", character=character)
+            session.add(dataset)
+            session.commit()
+            dataset_id = dataset.id
+
+        counters = {"rows": 0, "reads": 0, "lock_errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def writer():
+            rows = [
+                {"dataset_id": dataset_id, "dialogue": DIALOGUE}
+                for _ in range(ROWS_PER_TRANSACTION)
+            ]
+            while time.perf_counter() < deadline:
+                try:
+                    with WriteSession() as session:
+                        session.execute(insert(Corpus), rows)
+                        session.commit()
+                    with lock:
+                        counters["rows"] += ROWS_PER_TRANSACTION
+                except OperationalError:
+                    with lock:
+                        counters["lock_errors"] += 1
+
+        def reader():
+            while time.perf_counter() < deadline:
+                try:
+                    with ReadSession() as session:
+                        session.query(func.count(Corpus.id)).filter(
+                            Corpus.dataset_id == dataset_id
+                        ).scalar()
+                        session.query(Corpus).filter(
+                            Corpus.dataset_id == dataset_id
+                        ).order_by(Corpus.id.desc()).limit(50).all()
+                    with lock:
+                        counters["reads"] += 1
+                except OperationalError:
+                    with lock:
+                        counters["lock_errors"] += 1
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        threads += [threading.Thread(target=reader) for _ in range(readers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        write_engine.dispose()
+        read_engine.dispose()
+
+    return {
+        "profile": profile_name,
+        "rows_per_second": counters["rows"] / elapsed,
+        "reads_per_second": counters["reads"] / elapsed,
+        "lock_errors": counters["lock_errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument(
+        "--profiles", nargs="+", default=["legacy", "wal_durable", "wal"]
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{args.writers} 个写线程（每个事务 {ROWS_PER_TRANSACTION} 行），"
+        f"{args.readers} 个读线程，每个配置档运行 {args.seconds} 秒"
+    )
+    print(f"{'配置档':<12}{'写入行/秒':>12}{'读取次数/秒':>14}{'锁错误':>8}")
+    for profile_name in args.profiles:
+        result = run_profile(profile_name, args.writers, args.readers, args.seconds)
+        print(
+            f"{result['profile']:<12}{result['rows_per_second']:>12.0f}"
+            f"{result['reads_per_second']:>14.0f}{result['lock_errors']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,112 @@
 import logging
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import bindparam, create_engine, event, inspect, literal, text
+from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.orm import sessionmaker, scoped_session
 from src.models.data_models import Base  # Import Base from data_models
+from src.database.migrations import run_migrations
 
 # Import all models here so that Base knows about them
-from src.models.data_models import Character, ApiConfig, Scenario, Dataset, Corpus
+from src.models.data_models import (
+    Character,
+    ApiConfig,
+    Scenario,
+    Dataset,
+    Corpus,
+    CorpusMinHash,
+    DatasetStats,
+    DedupBatchStats,
+    DialogueTurn,
+    ExportCheckpoint,
+    GenerationJob,
+    GenerationTask,
+)
 
 logger = logging.getLogger(__name__)
 
+# SQLite 引擎配置档，通过环境变量 DB_ENGINE_PROFILE 选择。
+# - wal: WAL 日志 + synchronous=NORMAL，读写互不阻塞，适合本地磁盘（默认）
+# - wal_durable: 同上，但 synchronous=FULL，断电时也不会丢失最近提交的事务
+# - legacy: 原来的回滚日志模式，用于不支持 WAL 的文件系统（如网络存储）
+ENGINE_PROFILES = {
+    "wal": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            # 负值表示以 KiB 为单位，即 64MB 页缓存
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+            "busy_timeout": 30000,
+        },
+        "write_pool_size": 2,
+        "write_max_overflow": 3,
+        "read_pool_size": 8,
+        "read_max_overflow": 8,
+    },
+    "wal_durable": {
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "FULL",
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+            "busy_timeout": 30000,
+        },
+        "write_pool_size": 2,
+        "write_max_overflow": 3,
+        "read_pool_size": 8,
+        "read_max_overflow": 8,
+    },
+    "legacy": {
+        "pragmas": {},
+        "write_pool_size": 5,
+        "write_max_overflow": 10,
+        "read_pool_size": 5,
+        "read_max_overflow": 10,
+    },
+}
+DEFAULT_ENGINE_PROFILE = "wal"
+
+
+def get_engine_profile(name: str = None) -> dict:
+    """获取引擎配置档，未指定时读取环境变量 DB_ENGINE_PROFILE"""
+    name = name or os.getenv("DB_ENGINE_PROFILE", DEFAULT_ENGINE_PROFILE)
+    if name not in ENGINE_PROFILES:
+        logger.warning(
+            f"未知的数据库引擎配置档 '{name}'，使用 {DEFAULT_ENGINE_PROFILE}"
+        )
+        name = DEFAULT_ENGINE_PROFILE
+    return ENGINE_PROFILES[name]
+
+
+def create_db_engine(db_url: str, profile: dict, read_only: bool = False):
+    """
+    按配置档创建引擎，并在每个新连接上设置 PRAGMA。
+    read_only 为 True 时连接启用 query_only，并使用较大的读连接池。
+    """
+    prefix = "read" if read_only else "write"
+    engine = create_engine(
+        db_url,
+        connect_args={"check_same_thread": False},
+        pool_size=profile[f"{prefix}_pool_size"],
+        max_overflow=profile[f"{prefix}_max_overflow"],
+    )
+    pragmas = dict(profile["pragmas"])
+    if read_only:
+        pragmas["query_only"] = "ON"
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return engine
+
 
 class DatabaseManager:
     _instance = None
@@ -25,10 +124,17 @@ class DatabaseManager:
         db_url = f"sqlite:///{db_path}"
         logger.info(f"数据库管理器初始化... 数据库路径: {db_url}")
 
-        self.engine = create_engine(db_url, connect_args={"check_same_thread": False})
+        profile = get_engine_profile()
+        # 写引擎用于所有会修改数据的操作；只读查询使用独立的读连接池，
+        # 在 WAL 模式下读取不会被写入阻塞，也不会占用写连接
+        self.engine = create_db_engine(db_url, profile)
+        self.read_engine = create_db_engine(db_url, profile, read_only=True)
         self.session_factory = sessionmaker(
             autocommit=False, autoflush=False, bind=self.engine
         )
+        self.read_session_factory = sessionmaker(
+            autocommit=False, autoflush=False, bind=self.read_engine
+        )
         self.Session = scoped_session(self.session_factory)
 
         self.create_tables()
@@ -40,14 +146,92 @@ class DatabaseManager:
             logger.info("创建数据库表结构...")
             # This will create tables for all models that inherit from Base
             Base.metadata.create_all(self.engine)
+            self._add_missing_columns()
+            run_migrations(self.engine)
             logger.info("数据库表结构创建完成")
         except Exception as e:
             logger.error(f"创建数据库表失败: {e}", exc_info=True)
 
+    def _add_missing_columns(self):
+        """Add columns that exist on the models but not yet in the database.
+
+        create_all() never alters existing tables, so columns introduced after a
+        database was first created are added here with ALTER TABLE. Existing
+        rows receive the column's default instead of NULL.
+        """
+        inspector = inspect(self.engine)
+        with self.engine.begin() as conn:
+            for table in Base.metadata.sorted_tables:
+                if not inspector.has_table(table.name):
+                    continue
+                existing = {c["name"] for c in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name in existing:
+                        continue
+                    column_type = column.type.compile(dialect=self.engine.dialect)
+                    default_sql = self._column_default_sql(column)
+                    ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                    if default_sql is not None:
+                        ddl += f" DEFAULT {default_sql}"
+                    logger.info(f"为表 {table.name} 添加新列: {column.name}")
+                    conn.execute(text(ddl))
+                    if default_sql is None:
+                        self._backfill_column_default(conn, table, column)
+
+    def _column_default_sql(self, column):
+        """
+        列默认值的 SQL 常量，可直接写入 ADD COLUMN ... DEFAULT；
+        没有默认值或默认值不是常量（函数、可调用对象）时返回 None。
+        """
+        server_default = column.server_default
+        if server_default is not None and hasattr(server_default, "arg"):
+            arg = server_default.arg
+            if isinstance(arg, str):
+                return self._literal_sql(arg, column.type)
+            if not isinstance(arg, FunctionElement):
+                return str(arg.compile(dialect=self.engine.dialect))
+        elif column.default is not None and column.default.is_scalar:
+            return self._literal_sql(column.default.arg, column.type)
+        return None
+
+    def _literal_sql(self, value, column_type) -> str:
+        return str(
+            literal(value, column_type).compile(
+                dialect=self.engine.dialect, compile_kwargs={"literal_binds": True}
+            )
+        )
+
+    def _backfill_column_default(self, conn, table, column):
+        """
+        SQLite 的 ADD COLUMN 不接受非常量默认值，新增列后为已有行写入默认值：
+        服务端函数（如 func.now()）在 UPDATE 中求值，可调用的默认值调用一次后写入，
+        之后插入的行由 ORM 调用该可调用对象。
+        """
+        update = f'UPDATE "{table.name}" SET "{column.name}" = '
+        server_default = column.server_default
+        if server_default is not None and hasattr(server_default, "arg"):
+            expression = server_default.arg.compile(dialect=self.engine.dialect)
+            conn.execute(text(update + str(expression)))
+            logger.warning(
+                f"表 {table.name} 的新列 {column.name} 的默认值不是常量，"
+                "已为现有行写入；SQLite 无法为已有表补上该默认值，之后插入的行需自行赋值"
+            )
+        elif column.default is not None and column.default.is_callable:
+            value = column.default.arg(None)
+            conn.execute(
+                text(update + ":value").bindparams(
+                    bindparam("value", value, type_=column.type)
+                )
+            )
+
     def get_session(self):
         """Get a new database session."""
         return self.Session()
 
+    def get_read_session(self):
+        """Get a new session bound to the read-only connection pool."""
+        return self.read_session_factory()
+
     def close_session(self):
         """Close the current database session."""
         self.Session.remove()
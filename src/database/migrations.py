@@ -0,0 +1,288 @@
+"""
+Schema migrations for existing databases.
+
+Base.metadata.create_all() creates missing tables but never changes existing
+ones. Each migration below runs once, in version order, and is recorded in the
+schema_migrations table. Migrations receive an Alembic Operations object, so
+they are written like regular Alembic revisions, and they must also work on a
+fresh database where create_all() has already created the current schema.
+
+A migration may also have a data backfill. It runs after the schema change in
+keyset-ordered batches; each batch is its own transaction and records the last
+processed id in migration_progress, so the SQLite write lock is released
+between batches and an interrupted run resumes where it stopped. Schema
+functions must therefore be idempotent (e.g. if_not_exists=True).
+"""
+
+import logging
+from typing import Callable, Optional
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    insert,
+    select,
+    text,
+)
+from sqlalchemy.sql import func
+
+from src.utils.dialogue_turns import (
+    content_hash,
+    dialogue_metrics,
+    dialogue_turn_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+# 回填数据时每批处理的语料条数
+BACKFILL_BATCH_SIZE = 1000
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+# 进行中的数据回填已处理到的最大语料ID，回填完成后删除
+migration_progress = Table(
+    "migration_progress",
+    migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("last_id", Integer, nullable=False),
+    Column(
+        "updated_at",
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+    ),
+)
+
+
+def _add_query_indexes(op: Operations):
+    """为数据集视图、场景反查和按角色查找场景添加复合索引"""
+    op.create_index(
+        "ix_corpus_dataset_created",
+        "corpus",
+        ["dataset_id", "created_at"],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_corpus_scenarios_scenario",
+        "corpus_scenarios",
+        ["scenario_id", "corpus_id"],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_scenarios_character_name",
+        "scenarios",
+        ["character_id", "name"],
+        if_not_exists=True,
+    )
+    # 更新统计信息，让查询规划器选择新索引
+    op.execute("ANALYZE")
+
+
+def _normalize_dialogue_turns(op: Operations):
+    """为消息条数与字符数添加索引，数据由 _backfill_dialogue_turns 回填"""
+    op.create_index(
+        "ix_corpus_dataset_turns",
+        "corpus",
+        ["dataset_id", "turn_count"],
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_corpus_dataset_chars",
+        "corpus",
+        ["dataset_id", "char_count"],
+        if_not_exists=True,
+    )
+
+
+def _backfill_dialogue_turns(conn, last_id: int) -> Optional[int]:
+    """
+    把 last_id 之后一批语料的对话拆分到 dialogue_turns，并回填 turn_count / char_count。
+    在 Python 中解析：每条对话只解析一次，拆分规则与写入语料时完全相同。
+    """
+    rows = conn.execute(
+        text(
+            "SELECT id, dialogue FROM corpus "
+            "WHERE id > :last_id AND turn_count IS NULL ORDER BY id LIMIT :limit"
+        ),
+        {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+    ).all()
+    if not rows:
+        return None
+    turn_rows = []
+    counts = []
+    for corpus_id, raw_dialogue in rows:
+        turn_rows.extend(dialogue_turn_rows(corpus_id, raw_dialogue))
+        turn_count, char_count = dialogue_metrics(raw_dialogue)
+        counts.append(
+            {"id": corpus_id, "turn_count": turn_count, "char_count": char_count}
+        )
+    if turn_rows:
+        conn.execute(
+            text(
+                "INSERT OR IGNORE INTO dialogue_turns (corpus_id, idx, role, content) "
+                "VALUES (:corpus_id, :idx, :role, :content)"
+            ),
+            turn_rows,
+        )
+    conn.execute(
+        text(
+            "UPDATE corpus SET turn_count = :turn_count, char_count = :char_count "
+            "WHERE id = :id"
+        ),
+        counts,
+    )
+    return rows[-1][0]
+
+
+def _add_content_hash(op: Operations):
+    """创建 (dataset_id, content_hash) 唯一索引，数据由 _backfill_content_hash 回填"""
+    op.create_index(
+        "ux_corpus_dataset_hash",
+        "corpus",
+        ["dataset_id", "content_hash"],
+        unique=True,
+        if_not_exists=True,
+    )
+
+
+def _backfill_content_hash(conn, last_id: int) -> Optional[int]:
+    """
+    回填 last_id 之后一批语料的内容哈希。
+    按ID顺序回填，同一数据集中内容重复的语料只有最早的一条能写入哈希
+    （UPDATE OR IGNORE 跳过违反唯一索引的行），其余的保持 NULL 不做删除，
+    可在数据集界面中查找并清理。无法解析的对话没有哈希。
+    """
+    rows = conn.execute(
+        text(
+            "SELECT id, dialogue FROM corpus "
+            "WHERE id > :last_id AND content_hash IS NULL ORDER BY id LIMIT :limit"
+        ),
+        {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE},
+    ).all()
+    if not rows:
+        return None
+    hashes = []
+    for corpus_id, raw_dialogue in rows:
+        row_hash = content_hash(raw_dialogue)
+        if row_hash is not None:
+            hashes.append({"id": corpus_id, "content_hash": row_hash})
+    if hashes:
+        conn.execute(
+            text(
+                "UPDATE OR IGNORE corpus SET content_hash = :content_hash "
+                "WHERE id = :id"
+            ),
+            hashes,
+        )
+    return rows[-1][0]
+
+
+def _add_task_saved_count(op: Operations):
+    """
+    saved_count 列由 _add_missing_columns 添加；此前已入库的请求没有记录实际写入的
+    条数，按其对话数量回填
+    """
+    op.execute(
+        "UPDATE generation_tasks SET saved_count = conversation_count "
+        "WHERE saved = 1 AND (saved_count IS NULL OR saved_count = 0)"
+    )
+
+
+# (版本号, 名称, 结构变更函数, 数据回填函数或None)，按版本号顺序执行。
+# 回填函数 backfill(conn, last_id) 处理 last_id 之后的一批数据，
+# 返回本批最后的ID，没有剩余数据时返回 None
+MIGRATIONS = [
+    (1, "add_query_indexes", _add_query_indexes, None),
+    (
+        2,
+        "normalize_dialogue_turns",
+        _normalize_dialogue_turns,
+        _backfill_dialogue_turns,
+    ),
+    (3, "add_content_hash", _add_content_hash, _backfill_content_hash),
+    (4, "add_task_saved_count", _add_task_saved_count, None),
+]
+
+
+def get_applied_versions(engine) -> set:
+    with engine.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _run_backfill(
+    engine, version: int, name: str, backfill: Callable[..., Optional[int]]
+):
+    """逐批执行回填，每批与进度记录在同一个事务中提交，中断后从记录的位置继续"""
+    with engine.connect() as conn:
+        last_id = conn.execute(
+            select(migration_progress.c.last_id).where(
+                migration_progress.c.version == version
+            )
+        ).scalar()
+    if last_id:
+        logger.info(f"迁移 {version} ({name}) 从语料ID {last_id} 之后继续回填")
+    last_id = last_id or 0
+    batches = 0
+    while True:
+        with engine.begin() as conn:
+            next_id = backfill(conn, last_id)
+            if next_id is None:
+                break
+            conn.execute(
+                text(
+                    "INSERT INTO migration_progress (version, last_id) "
+                    "VALUES (:version, :last_id) "
+                    "ON CONFLICT (version) DO UPDATE SET last_id = excluded.last_id, "
+                    "updated_at = CURRENT_TIMESTAMP"
+                ),
+                {"version": version, "last_id": next_id},
+            )
+        last_id = next_id
+        batches += 1
+        if batches % 50 == 0:
+            logger.info(f"迁移 {version} ({name}) 回填进度: 语料ID {last_id}")
+
+
+def run_migrations(engine) -> list:
+    """执行所有尚未应用的迁移，返回本次应用的版本号"""
+    migration_metadata.create_all(engine, checkfirst=True)
+    applied = get_applied_versions(engine)
+
+    newly_applied = []
+    for version, name, upgrade, backfill in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"执行数据库迁移 {version}: {name}")
+        with engine.begin() as conn:
+            upgrade(Operations(MigrationContext.configure(conn)))
+        if backfill:
+            _run_backfill(engine, version, name, backfill)
+        with engine.begin() as conn:
+            if backfill:
+                # 回填改变了数据分布，更新统计信息让查询规划器选择合适的索引
+                conn.execute(text("ANALYZE"))
+                conn.execute(
+                    migration_progress.delete().where(
+                        migration_progress.c.version == version
+                    )
+                )
+            conn.execute(insert(schema_migrations).values(version=version, name=name))
+        newly_applied.append(version)
+
+    if newly_applied:
+        logger.info(f"数据库迁移完成，已应用版本: {newly_applied}")
+    return newly_applied
@@ -8,8 +8,11 @@ from sqlalchemy import (
     ForeignKey,
     Table,
     JSON,
+    LargeBinary,
     Float,
+    Boolean,
     UniqueConstraint,
+    Index,
 )
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
@@ -54,6 +57,7 @@ class Scenario(Base):
 
     __table_args__ = (
         UniqueConstraint("name", "character_id", name="_character_scenario_uc"),
+        Index("ix_scenarios_character_name", "character_id", "name"),
     )
 
     def __repr__(self):
@@ -74,6 +78,10 @@ class ApiConfig(Base):
     frequency_penalty = Column(Float, default=0.0)
     presence_penalty = Column(Float, default=0.0)
 
+    # Rate limits shared by all generation jobs using this config (0 = unlimited)
+    rpm_limit = Column(Integer, default=0)
+    tpm_limit = Column(Integer, default=0)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     def __repr__(self):
@@ -109,6 +117,22 @@ class Dataset(Base):
     corpus_entries = relationship(
         "Corpus", back_populates="dataset", cascade="all, delete-orphan"
     )
+    export_checkpoints = relationship(
+        "ExportCheckpoint", back_populates="dataset", cascade="all, delete-orphan"
+    )
+    stats = relationship(
+        "DatasetStats",
+        back_populates="dataset",
+        uselist=False,
+        cascade="all, delete-orphan",
+    )
+    dedup_stats = relationship(
+        "DedupBatchStats", back_populates="dataset", cascade="all, delete-orphan"
+    )
+
+    # Incremented whenever corpus rows of the dataset are inserted or deleted
+    # (see stats_service.apply_stats_delta); does not touch updated_at
+    corpus_version = Column(Integer, nullable=False, default=0)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -123,6 +147,8 @@ corpus_scenarios_association = Table(
     Base.metadata,
     Column("corpus_id", Integer, ForeignKey("corpus.id"), primary_key=True),
     Column("scenario_id", Integer, ForeignKey("scenarios.id"), primary_key=True),
+    # Reverse lookup: corpus entries linked to a scenario
+    Index("ix_corpus_scenarios_scenario", "scenario_id", "corpus_id"),
 )
 
 
@@ -140,8 +166,213 @@ class Corpus(Base):
     scenarios = relationship(
         "Scenario", secondary=corpus_scenarios_association, backref="corpus_entries"
     )
+    turns = relationship(
+        "DialogueTurn",
+        back_populates="corpus",
+        cascade="all, delete-orphan",
+        order_by="DialogueTurn.idx",
+    )
+
+    # Materialized from dialogue: number of entries in "dialogues" and the
+    # total characters of their string contents
+    turn_count = Column(Integer)
+    char_count = Column(Integer)
+    # Hash of the normalized dialogue messages; NULL for rows that could not be
+    # hashed and for duplicates kept from before deduplication existed
+    content_hash = Column(String)
 
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # Dataset views filter on dataset_id and order by created_at
+        Index("ix_corpus_dataset_created", "dataset_id", "created_at"),
+        # Length filters within a dataset
+        Index("ix_corpus_dataset_turns", "dataset_id", "turn_count"),
+        Index("ix_corpus_dataset_chars", "dataset_id", "char_count"),
+        # Exact duplicates are rejected per dataset at insert time
+        Index("ux_corpus_dataset_hash", "dataset_id", "content_hash", unique=True),
+    )
+
     def __repr__(self):
         return f"<Corpus(id={self.id}, dataset_id={self.dataset_id})>"
+
+
+class DialogueTurn(Base):
+    """One message of a corpus dialogue, normalized out of Corpus.dialogue."""
+
+    __tablename__ = "dialogue_turns"
+
+    corpus_id = Column(Integer, ForeignKey("corpus.id"), primary_key=True)
+    # Position of the message in dialogue["dialogues"]
+    idx = Column(Integer, primary_key=True)
+    role = Column(String)
+    content = Column(Text)
+
+    corpus = relationship("Corpus", back_populates="turns")
+
+    def __repr__(self):
+        return f"<DialogueTurn(corpus_id={self.corpus_id}, idx={self.idx}, role='{self.role}')>"
+
+
+class CorpusMinHash(Base):
+    """MinHash signature of a corpus entry's assistant turns, for near-duplicate search."""
+
+    __tablename__ = "corpus_minhash"
+
+    corpus_id = Column(Integer, ForeignKey("corpus.id"), primary_key=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), nullable=False, index=True)
+    # NUM_PERM little-endian uint32 values; NULL when the assistant text is
+    # shorter than one shingle
+    signature = Column(LargeBinary)
+
+    def __repr__(self):
+        return (
+            f"<CorpusMinHash(corpus_id={self.corpus_id}, dataset_id={self.dataset_id})>"
+        )
+
+
+class DatasetStats(Base):
+    """Corpus statistics of a dataset, kept up to date by the corpus write paths."""
+
+    __tablename__ = "dataset_stats"
+
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), primary_key=True)
+    total_count = Column(Integer, nullable=False, default=0)
+    # Total characters of all dialogue turn contents
+    total_chars = Column(Integer, nullable=False, default=0)
+    # {scenario_id: corpus count}
+    scenario_counts = Column(JSON, nullable=False, default=dict)
+    # {dialogue round count: corpus count}
+    turn_histogram = Column(JSON, nullable=False, default=dict)
+
+    dataset = relationship("Dataset", back_populates="stats")
+
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    def __repr__(self):
+        return f"<DatasetStats(dataset_id={self.dataset_id}, total_count={self.total_count})>"
+
+
+class DedupBatchStats(Base):
+    """Per generation batch counts of submitted, inserted and duplicate corpus."""
+
+    __tablename__ = "dedup_batch_stats"
+
+    id = Column(Integer, primary_key=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), nullable=False)
+    # dialogue["batch_id"]; "" for corpus saved without a batch
+    batch_id = Column(String, nullable=False, default="")
+    submitted_count = Column(Integer, nullable=False, default=0)
+    inserted_count = Column(Integer, nullable=False, default=0)
+    # Duplicates of another entry in the same write
+    batch_duplicate_count = Column(Integer, nullable=False, default=0)
+    # Duplicates of corpus already stored in the dataset
+    existing_duplicate_count = Column(Integer, nullable=False, default=0)
+
+    dataset = relationship("Dataset", back_populates="dedup_stats")
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+    __table_args__ = (
+        UniqueConstraint("dataset_id", "batch_id", name="_dataset_batch_uc"),
+    )
+
+    def __repr__(self):
+        return f"<DedupBatchStats(dataset_id={self.dataset_id}, batch_id='{self.batch_id}', inserted_count={self.inserted_count})>"
+
+
+class ExportCheckpoint(Base):
+    """Position of the last corpus row written by an incremental export."""
+
+    __tablename__ = "export_checkpoints"
+
+    id = Column(Integer, primary_key=True)
+    dataset_id = Column(Integer, ForeignKey("datasets.id"), nullable=False)
+    # e.g. "training.jsonl.gz"; each format keeps its own parts and checkpoint
+    export_format = Column(String, nullable=False)
+    last_corpus_id = Column(Integer)
+    # corpus.created_at exactly as stored, compared as text like the keyset cursor
+    last_created_at = Column(String)
+    part_count = Column(Integer, default=0)
+    total_rows = Column(Integer, default=0)
+
+    dataset = relationship("Dataset", back_populates="export_checkpoints")
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint(
+            "dataset_id", "export_format", name="_dataset_export_format_uc"
+        ),
+    )
+
+    def __repr__(self):
+        return f"<ExportCheckpoint(dataset_id={self.dataset_id}, export_format='{self.export_format}', last_corpus_id={self.last_corpus_id})>"
+
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String, nullable=False, index=True)
+    dataset_name = Column(String, nullable=False)
+    api_config_name = Column(String, nullable=False)
+    model_name = Column(String, nullable=False)
+    prompt = Column(Text, nullable=False)
+    # Generation parameters (num_to_generate, temperature, max_tokens, ...)
+    params = Column(JSON, nullable=False)
+    total_requests = Column(Integer, nullable=False)
+    auto_commit = Column(Boolean, default=False)
+    status = Column(String, nullable=False, default="pending")
+    error = Column(Text)
+
+    tasks = relationship(
+        "GenerationTask",
+        back_populates="job",
+        cascade="all, delete-orphan",
+        order_by="GenerationTask.request_index",
+    )
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True))
+
+    def __repr__(self):
+        return f"<GenerationJob(id={self.id}, batch_id='{self.batch_id}', status='{self.status}')>"
+
+
+class GenerationTask(Base):
+    __tablename__ = "generation_tasks"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("generation_jobs.id"), nullable=False)
+    request_index = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, default=0)
+    # Conversations returned by the LLM for this request
+    output = Column(JSON)
+    conversation_count = Column(Integer, default=0)
+    # Whether the output has been written to the corpus table
+    saved = Column(Boolean, default=False)
+    # Corpus rows actually inserted from the output; conversations skipped as
+    # duplicates are not counted
+    saved_count = Column(Integer, default=0)
+    error = Column(Text)
+
+    job = relationship("GenerationJob", back_populates="tasks")
+
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        UniqueConstraint("job_id", "request_index", name="_job_request_index_uc"),
+    )
+
+    def __repr__(self):
+        return f"<GenerationTask(id={self.id}, job_id={self.job_id}, request_index={self.request_index}, status='{self.status}')>"
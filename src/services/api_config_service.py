@@ -7,7 +7,7 @@ import logging
 from contextlib import contextmanager
 from src.database.database_manager import DatabaseManager
 from src.models.data_models import ApiConfig
-from openai import OpenAI
+from src.utils import client_pool
 from google import genai
 
 
@@ -37,6 +37,8 @@ def save_api_config(
     top_p: float = 1.0,
     frequency_penalty: float = 0.0,
     presence_penalty: float = 0.0,
+    rpm_limit: int = 0,
+    tpm_limit: int = 0,
 ):
     """Saves or updates an API configuration."""
     if not name or not api_type or not api_key:
@@ -60,6 +62,8 @@ def save_api_config(
             config.top_p = top_p
             config.frequency_penalty = frequency_penalty
             config.presence_penalty = presence_penalty
+            config.rpm_limit = int(rpm_limit or 0)
+            config.tpm_limit = int(tpm_limit or 0)
         else:
             # Create new config
             logger.info(f"正在创建新的API配置: {name}")
@@ -71,6 +75,8 @@ def save_api_config(
                 top_p=top_p,
                 frequency_penalty=frequency_penalty,
                 presence_penalty=presence_penalty,
+                rpm_limit=int(rpm_limit or 0),
+                tpm_limit=int(tpm_limit or 0),
             )
             session.add(config)
 
@@ -100,6 +106,8 @@ def get_all_api_configs():
                 "top_p": c.top_p,
                 "frequency_penalty": c.frequency_penalty,
                 "presence_penalty": c.presence_penalty,
+                "rpm_limit": c.rpm_limit or 0,
+                "tpm_limit": c.tpm_limit or 0,
             }
             for c in configs
         ]
@@ -129,6 +137,8 @@ def get_api_config_by_name(name: str):
             "top_p": config.top_p,
             "frequency_penalty": config.frequency_penalty,
             "presence_penalty": config.presence_penalty,
+            "rpm_limit": config.rpm_limit or 0,
+            "tpm_limit": config.tpm_limit or 0,
         }
     finally:
         session.close()
@@ -171,9 +181,7 @@ def get_available_models(api_config_name: str) -> list[str]:
     try:
         if api_type == "OpenAI":
             logger.info(f"正在从 {base_url}-{api_key} 获取模型列表...")
-            client = OpenAI(
-                api_key=api_key.strip(), base_url=base_url.strip() if base_url else None
-            )
+            client = client_pool.get_sync_client(api_key, base_url)
             models = client.models.list()
             model_ids = [model.id for model in models.data]
             # Filter for common chat models and sort them
@@ -2,6 +2,7 @@ import logging
 from contextlib import contextmanager
 from src.database.database_manager import DatabaseManager
 from src.models.data_models import Character
+from src.utils import prompt_cache
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +69,7 @@ def get_character_by_name(name: str):
         return None
 
 
+@prompt_cache.invalidates(prompt_cache.SOURCE_CHARACTER, "id")
 def save_character(id: int = None, **kwargs):
     """创建或更新角色卡"""
     with session_scope() as session:
@@ -104,9 +106,11 @@ def delete_character_by_name(name: str):
     """通过名称删除角色卡"""
     with session_scope() as session:
         character = session.query(Character).filter_by(name=name).first()
-        if character:
-            logger.info(f"正在删除角色: {name}")
-            session.delete(character)
-            return True
-        logger.warning(f"尝试删除一个不存在的角色: {name}")
-        return False
+        if not character:
+            logger.warning(f"尝试删除一个不存在的角色: {name}")
+            return False
+        logger.info(f"正在删除角色: {name}")
+        character_id = character.id
+        session.delete(character)
+    prompt_cache.invalidate(prompt_cache.SOURCE_CHARACTER, character_id)
+    return True
@@ -0,0 +1,250 @@
+"""
+Corpus export helpers shared by dataset_service and the sharded export workers.
+
+Sharded exports run export_shard() in spawned worker processes, which import
+this module from scratch. Importing it must stay free of side effects: it
+does not create a DatabaseManager or import other services (their
+module-level managers would build the write engine and run create_all and
+the migrations against the live database). Workers only open the read-only
+engine built from the task's db_url.
+"""
+
+import hashlib
+import json
+import os
+
+from sqlalchemy import String, func, select, tuple_, type_coerce
+from sqlalchemy.orm import sessionmaker
+
+from src.database.database_manager import create_db_engine, get_engine_profile
+from src.models.data_models import Corpus, Scenario, corpus_scenarios_association
+from src.utils import export_writers
+
+# 导出时每批从数据库游标读取的语料条数
+EXPORT_FETCH_SIZE = 1000
+# 分组拼接场景名称时使用的分隔符，不会出现在场景名称中
+_SCENARIO_NAME_SEPARATOR = "\x1f"
+# 分片导出的数据划分，按固定顺序分配哈希区间
+EXPORT_SPLITS = ("train", "val", "test")
+# 划分比例的哈希精度
+_SPLIT_RESOLUTION = 1_000_000
+
+
+def scenario_lists_by_corpus(session, corpus_ids) -> dict:
+    """一次分组查询取出一批语料的场景名称，返回 {corpus_id: [场景名称, ...]}"""
+    if not corpus_ids:
+        return {}
+    rows = (
+        session.query(
+            corpus_scenarios_association.c.corpus_id,
+            func.group_concat(Scenario.name, _SCENARIO_NAME_SEPARATOR),
+        )
+        .join(Scenario, Scenario.id == corpus_scenarios_association.c.scenario_id)
+        .filter(corpus_scenarios_association.c.corpus_id.in_(corpus_ids))
+        .group_by(corpus_scenarios_association.c.corpus_id)
+        .all()
+    )
+    return {
+        corpus_id: names.split(_SCENARIO_NAME_SEPARATOR) for corpus_id, names in rows
+    }
+
+
+def iter_export_batches(
+    session, dataset_id: int, id_range: tuple = None, after: tuple = None
+):
+    """
+    按 (created_at, id) 顺序流式读取数据集的语料，每次产出一批
+    [(id, created_at, dialogue, 场景名称列表), ...]。
+
+    使用 yield_per 逐批从游标读取，只查询需要的列而不加载ORM对象，
+    每批的场景名称通过一次分组查询取得，内存占用与数据集大小无关。
+    id_range 为 (起始ID, 结束ID) 时只按 id 顺序读取该范围（含两端）内的语料，
+    沿 dataset_id 索引做范围扫描。after 为 (created_at 原始文本, id) 时只读取其后的语料。
+    """
+    query = (
+        select(Corpus.id, Corpus.created_at, Corpus.dialogue)
+        .where(Corpus.dataset_id == dataset_id)
+        .execution_options(yield_per=EXPORT_FETCH_SIZE)
+    )
+    if id_range:
+        query = query.where(Corpus.id.between(*id_range)).order_by(Corpus.id.asc())
+    else:
+        query = query.order_by(Corpus.created_at.asc(), Corpus.id.asc())
+    if after:
+        query = query.where(
+            tuple_(type_coerce(Corpus.created_at, String), Corpus.id) > tuple_(*after)
+        )
+    result = session.execute(query)
+    for partition in result.partitions():
+        scenarios = scenario_lists_by_corpus(session, [row.id for row in partition])
+        yield [
+            (corpus_id, created_at, dialogue, scenarios.get(corpus_id, []))
+            for corpus_id, created_at, dialogue in partition
+        ]
+
+
+def to_full_export_entry(
+    corpus_id, created_at, dialogue_data, scenarios, dataset_name
+) -> dict:
+    """构建完整格式的导出记录"""
+    jsonl_entry = {
+        "id": corpus_id,
+        "dataset_name": dataset_name,
+        "created_at": created_at.isoformat() if created_at else None,
+        "scenarios": scenarios,
+    }
+
+    if isinstance(dialogue_data, dict):
+        # 如果是结构化数据，直接使用
+        jsonl_entry.update(
+            {
+                "conversations": dialogue_data.get("dialogues", []),
+                "turn_count": dialogue_data.get("turn_count", 0),
+                "batch_id": dialogue_data.get("batch_id", ""),
+                "scenario_labels": dialogue_data.get("scenario_labels", []),
+            }
+        )
+    else:
+        # 如果是其他格式，尝试解析
+        try:
+            parsed_dialogue = json.loads(str(dialogue_data))
+            jsonl_entry["conversations"] = parsed_dialogue.get("dialogues", [])
+            jsonl_entry["turn_count"] = len(parsed_dialogue.get("dialogues", [])) // 2
+        except (json.JSONDecodeError, ValueError, TypeError, AttributeError):
+            # 如果解析失败，将原始数据存储为字符串
+            jsonl_entry["raw_dialogue"] = str(dialogue_data)
+            jsonl_entry["conversations"] = []
+            jsonl_entry["turn_count"] = 0
+    return jsonl_entry
+
+
+def to_training_entry(
+    corpus_id, dialogue_data, scenarios, dataset_name, character_name
+):
+    """构建标准训练格式的导出记录，没有完整对话时返回 None"""
+    # 提取对话内容
+    messages = []
+    if isinstance(dialogue_data, dict) and "dialogues" in dialogue_data:
+        for turn in dialogue_data["dialogues"]:
+            role = turn.get("role", "user")
+            content = turn.get("content", "")
+            if content.strip():  # 只添加非空内容
+                messages.append({"role": role, "content": content})
+
+    # 至少要有一轮完整对话
+    if len(messages) < 2:
+        return None
+    return {
+        "messages": messages,
+        "metadata": {
+            "dataset": dataset_name,
+            "character": character_name,
+            "scenarios": scenarios,
+            "corpus_id": corpus_id,
+        },
+    }
+
+
+def stable_bucket(corpus_id: int) -> int:
+    """语料ID的稳定哈希（56位），不随进程或Python版本变化，决定语料的数据划分"""
+    digest = hashlib.blake2b(str(corpus_id).encode(), digest_size=7).digest()
+    return int.from_bytes(digest, "big")
+
+
+def split_for_bucket(bucket: int, val_ratio: float, test_ratio: float) -> str:
+    """按哈希值把语料分配到 train / val / test，与分片数无关"""
+    fraction = bucket % _SPLIT_RESOLUTION / _SPLIT_RESOLUTION
+    if fraction < 1 - val_ratio - test_ratio:
+        return "train"
+    if fraction < 1 - test_ratio:
+        return "val"
+    return "test"
+
+
+def sha256_file(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _open_shard_writer(filepath: str, output_format: str, compression: str):
+    if output_format == "parquet":
+        return export_writers.TrainingParquetWriter(filepath)
+    return export_writers.open_jsonl_writer(filepath, compression)
+
+
+def export_shard(task: dict) -> list:
+    """
+    在子进程中导出一个分片：为每个数据划分写一个文件，返回各文件的清单条目。
+    子进程使用自己的只读引擎，不复用父进程的连接池；id_range 为 None 的空分片
+    只写出空文件。
+    """
+    engine = create_db_engine(task["db_url"], get_engine_profile(), read_only=True)
+    session = sessionmaker(bind=engine)()
+    shard_index, num_shards = task["shard_index"], task["num_shards"]
+    id_range = task["id_range"]
+    paths = {
+        split: os.path.join(
+            split,
+            f"shard-{shard_index:05d}-of-{num_shards:05d}{task['extension']}",
+        )
+        for split in EXPORT_SPLITS
+    }
+    counts = dict.fromkeys(EXPORT_SPLITS, 0)
+    writers = {}
+    try:
+        for split, path in paths.items():
+            writers[split] = _open_shard_writer(
+                os.path.join(task["output_dir"], path),
+                task["output_format"],
+                task["compression"],
+            )
+        batches = (
+            iter_export_batches(session, task["dataset_id"], id_range=id_range)
+            if id_range
+            else ()
+        )
+        for batch in batches:
+            for corpus_id, _, dialogue_data, scenarios in batch:
+                training_entry = to_training_entry(
+                    corpus_id,
+                    dialogue_data,
+                    scenarios,
+                    task["dataset_name"],
+                    task["character_name"],
+                )
+                if not training_entry:
+                    continue
+                split = split_for_bucket(
+                    stable_bucket(corpus_id), task["val_ratio"], task["test_ratio"]
+                )
+                if task["output_format"] == "parquet":
+                    writers[split].write(training_entry)
+                else:
+                    writers[split].write(
+                        json.dumps(training_entry, ensure_ascii=False) + "\n"
+                    )
+                counts[split] += 1
+    finally:
+        for writer in writers.values():
+            writer.close()
+        session.close()
+        engine.dispose()
+
+    files = []
+    for split, path in paths.items():
+        full_path = os.path.join(task["output_dir"], path)
+        files.append(
+            {
+                "path": path,
+                "split": split,
+                "shard": shard_index,
+                "id_range": list(id_range) if id_range else None,
+                "count": counts[split],
+                "bytes": os.path.getsize(full_path),
+                "sha256": sha256_file(full_path),
+            }
+        )
+    return files
@@ -3,9 +3,39 @@ Service layer for handling dataset-related business logic.
 """
 
 from src.database.database_manager import DatabaseManager
-from src.models.data_models import Dataset, Character, Scenario, Corpus
+from src.models.data_models import (
+    Dataset,
+    Character,
+    Scenario,
+    Corpus,
+    CorpusMinHash,
+    DedupBatchStats,
+    DialogueTurn,
+    ExportCheckpoint,
+    corpus_scenarios_association,
+    dataset_scenarios_association,
+)
+from src.services import (
+    corpus_export,
+    diversity_service,
+    near_duplicate_service,
+    stats_service,
+    validation_service,
+)
+from src.utils import dialogue_turns, export_writers, prompt_cache, text_embeddings
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func
+from sqlalchemy import (
+    String,
+    delete,
+    func,
+    insert,
+    select,
+    tuple_,
+    type_coerce,
+)
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 import logging
 import json
 import os
@@ -17,11 +47,17 @@ db_manager = DatabaseManager()
 logger = logging.getLogger(__name__)
 
 EXPORT_DIR = "export"
+# 增量导出的分片保存在该子目录中，全量导出清理目录时会保留
+INCREMENTAL_EXPORT_DIRNAME = "incremental"
+# 语料浏览每页显示的条数
+CORPUS_PAGE_SIZE = 20
+# 按ID集合删除语料时每条语句包含的ID数量（低于SQLite绑定参数上限）
+DELETE_CHUNK_SIZE = 500
 
 
 def get_all_datasets_for_display():
     """Fetches all datasets for display in a dropdown."""
-    session = db_manager.get_session()
+    session = db_manager.get_read_session()
     try:
         datasets = session.query(Dataset).order_by(Dataset.name).all()
         return [{"id": d.id, "name": d.name} for d in datasets]
@@ -29,6 +65,7 @@ def get_all_datasets_for_display():
         session.close()
 
 
+@prompt_cache.invalidates(prompt_cache.SOURCE_DATASET, "dataset_id")
 def create_or_update_dataset(
     dataset_id, name, description, character_name, scenario_names
 ):
@@ -54,9 +91,14 @@ def create_or_update_dataset(
         if not character:
             raise ValueError(f"未找到角色 '{character_name}'。")
 
-        # Get scenario objects
+        # Get scenario objects (scenario names are only unique per character)
         scenarios = (
-            session.query(Scenario).filter(Scenario.name.in_(scenario_names)).all()
+            session.query(Scenario)
+            .filter(
+                Scenario.character_id == character.id,
+                Scenario.name.in_(scenario_names),
+            )
+            .all()
         )
 
         if dataset_id:
@@ -89,7 +131,7 @@ def create_or_update_dataset(
 
 def get_dataset_details(dataset_name):
     """Fetches the details of a single dataset by its name."""
-    session = db_manager.get_session()
+    session = db_manager.get_read_session()
     try:
         dataset = (
             session.query(Dataset)
@@ -120,7 +162,7 @@ def get_dataset_details_by_id(dataset_id):
     """Fetches the details of a single dataset by its ID."""
     if not dataset_id:
         return None
-    session = db_manager.get_session()
+    session = db_manager.get_read_session()
     try:
         dataset = (
             session.query(Dataset)
@@ -147,6 +189,58 @@ def get_dataset_details_by_id(dataset_id):
         session.close()
 
 
+def get_prompt_source_versions(dataset_name):
+    """
+    Returns the ids and versions of the sources a generation prompt is
+    rendered from, or None if the dataset does not exist.
+
+    The version of a dataset, character or scenario is its updated_at, or
+    created_at if it was never updated. Two small indexed queries, no ORM
+    objects are loaded.
+    """
+    session = db_manager.get_read_session()
+    try:
+        dataset = (
+            session.query(
+                Dataset.id,
+                Dataset.character_id,
+                func.coalesce(Dataset.updated_at, Dataset.created_at),
+                func.coalesce(Character.updated_at, Character.created_at),
+            )
+            .outerjoin(Character, Character.id == Dataset.character_id)
+            .filter(Dataset.name == dataset_name)
+            .first()
+        )
+        if not dataset:
+            return None
+        dataset_id, character_id, dataset_version, character_version = dataset
+
+        scenario_versions = (
+            session.query(
+                Scenario.id, func.coalesce(Scenario.updated_at, Scenario.created_at)
+            )
+            .join(
+                dataset_scenarios_association,
+                dataset_scenarios_association.c.scenario_id == Scenario.id,
+            )
+            .filter(dataset_scenarios_association.c.dataset_id == dataset_id)
+            .order_by(Scenario.id)
+            .all()
+        )
+        return {
+            "dataset_id": dataset_id,
+            "character_id": character_id,
+            "versions": (
+                dataset_version,
+                character_version,
+                tuple(tuple(row) for row in scenario_versions),
+            ),
+        }
+    finally:
+        session.close()
+
+
+@prompt_cache.invalidates(prompt_cache.SOURCE_DATASET, "dataset_id")
 def delete_dataset(dataset_id):
     """Deletes a dataset and its associated corpus entries."""
     if not dataset_id:
@@ -155,8 +249,15 @@ def delete_dataset(dataset_id):
     session = db_manager.get_session()
     try:
         dataset = session.query(Dataset).filter(Dataset.id == dataset_id).one()
+        # 语料及其对话消息用集合删除语句清理，不逐条加载ORM对象
+        corpus_ids = list(
+            session.scalars(select(Corpus.id).where(Corpus.dataset_id == dataset_id))
+        )
+        _delete_corpus_ids(session, corpus_ids)
         session.delete(dataset)
         session.commit()
+        # SQLite 可能复用已删除数据集的ID，向量索引随数据集一起删除
+        diversity_service.remove_index(dataset_id)
         return True
     except Exception as e:
         session.rollback()
@@ -167,74 +268,206 @@ def delete_dataset(dataset_id):
         session.close()
 
 
-def get_corpus_by_dataset(dataset_id, scenario_filter_names=None):
+def _scenario_names_by_corpus(session, corpus_ids) -> dict:
+    """一次分组查询取出一批语料的场景名称，返回 {corpus_id: "场景1, 场景2"}"""
+    if not corpus_ids:
+        return {}
+    rows = (
+        session.query(
+            corpus_scenarios_association.c.corpus_id,
+            func.group_concat(Scenario.name, ", "),
+        )
+        .join(Scenario, Scenario.id == corpus_scenarios_association.c.scenario_id)
+        .filter(corpus_scenarios_association.c.corpus_id.in_(corpus_ids))
+        .group_by(corpus_scenarios_association.c.corpus_id)
+        .all()
+    )
+    return {corpus_id: names for corpus_id, names in rows}
+
+
+def get_corpus_page(
+    dataset_id,
+    scenario_filter_names=None,
+    cursor=None,
+    direction: str = "next",
+    page_size: int = CORPUS_PAGE_SIZE,
+    min_chars: int = None,
+    max_chars: int = None,
+) -> dict:
     """
-    Fetches corpus entries for a given dataset, optionally filtered by scenarios.
-    Returns a list of dictionaries, each representing a corpus entry.
+    Fetches one page of corpus entries, newest first, using keyset pagination.
+
+    The cursor is the (created_at, id) pair of a row on the current page:
+    direction "next" returns the rows after it (older), "prev" the rows before
+    it (newer). Only one page of rows is read, so the cost does not grow with
+    the dataset size. min_chars/max_chars filter on the materialized
+    Corpus.char_count (max_chars is exclusive).
+
+    Returns a dict with "items" and the "first_cursor"/"last_cursor" of the
+    page, plus "has_prev"/"has_next".
     """
+    empty = {
+        "items": [],
+        "first_cursor": None,
+        "last_cursor": None,
+        "has_prev": False,
+        "has_next": False,
+    }
     if not dataset_id:
-        return []
+        return empty
 
-    session = db_manager.get_session()
+    session = db_manager.get_read_session()
     try:
-        query = (
-            session.query(Corpus)
-            .filter(Corpus.dataset_id == dataset_id)
-            .options(joinedload(Corpus.scenarios))
+        # 以数据库中存储的原始文本比较 created_at，避免与绑定参数的格式不一致
+        created_at = type_coerce(Corpus.created_at, String)
+        query = session.query(Corpus.id, created_at, Corpus.dialogue).filter(
+            Corpus.dataset_id == dataset_id
         )
 
         if scenario_filter_names:
-            query = query.join(Corpus.scenarios).filter(
-                Scenario.name.in_(scenario_filter_names)
+            character_id = (
+                select(Dataset.character_id)
+                .where(Dataset.id == dataset_id)
+                .scalar_subquery()
             )
-
-        corpus_entries = query.order_by(Corpus.created_at.desc()).all()
-
-        result = []
-        for entry in corpus_entries:
-            result.append(
-                {
-                    "dialogue": entry.dialogue,
-                    "scenarios": ", ".join([s.name for s in entry.scenarios]),
-                }
+            scenario_ids = select(Scenario.id).where(
+                Scenario.character_id == character_id,
+                Scenario.name.in_(scenario_filter_names),
             )
-        return result
+            query = query.filter(
+                Corpus.id.in_(
+                    select(corpus_scenarios_association.c.corpus_id).where(
+                        corpus_scenarios_association.c.scenario_id.in_(scenario_ids)
+                    )
+                )
+            )
+        if min_chars is not None:
+            query = query.filter(Corpus.char_count >= min_chars)
+        if max_chars is not None:
+            query = query.filter(Corpus.char_count < max_chars)
+
+        forward = direction != "prev"
+        if cursor:
+            cursor_key = tuple_(created_at, Corpus.id)
+            cursor_value = tuple_(cursor[0], cursor[1])
+            query = query.filter(
+                cursor_key < cursor_value if forward else cursor_key > cursor_value
+            )
+        if forward:
+            query = query.order_by(created_at.desc(), Corpus.id.desc())
+        else:
+            query = query.order_by(created_at.asc(), Corpus.id.asc())
+
+        # 多取一行用于判断该方向上是否还有更多数据
+        rows = query.limit(page_size + 1).all()
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return empty
+
+        scenario_names = _scenario_names_by_corpus(session, [r.id for r in rows])
+        items = [
+            {
+                "id": corpus_id,
+                "dialogue": dialogue,
+                "scenarios": scenario_names.get(corpus_id, ""),
+                "created_at": created,
+            }
+            for corpus_id, created, dialogue in rows
+        ]
+        return {
+            "items": items,
+            "first_cursor": [rows[0][1], rows[0][0]],
+            "last_cursor": [rows[-1][1], rows[-1][0]],
+            "has_prev": (has_more if not forward else cursor is not None),
+            "has_next": (has_more if forward else cursor is not None),
+        }
     finally:
         session.close()
 
 
 def get_dataset_stats(dataset_id):
     """
-    Calculates statistics for a given dataset.
-    - Total number of corpus entries.
+    Returns the materialized statistics for a given dataset.
+    - Total number of corpus entries and total dialogue characters.
     - Count of corpus entries per scenario.
+    - Histogram of dialogue round counts.
+
+    Datasets without a stats row yet (e.g. created before the stats table
+    existed) are rebuilt once on first access.
     """
     if not dataset_id:
-        return {"total_corpus_count": 0, "scenario_counts": {}}
+        return {
+            "total_corpus_count": 0,
+            "total_chars": 0,
+            "scenario_counts": {},
+            "turn_histogram": {},
+        }
 
-    session = db_manager.get_session()
-    try:
-        # Get total count
-        num_to_generate = (
-            session.query(Corpus).filter(Corpus.dataset_id == dataset_id).count()
-        )
+    stats = stats_service.get_stats(dataset_id)
+    if stats is None:
+        stats_service.rebuild_dataset_stats(dataset_id)
+        stats = stats_service.get_stats(dataset_id)
+    return stats
 
-        # Get count per scenario
-        # This requires a join and group by
-        scenario_counts_query = (
-            session.query(Scenario.name, func.count(Corpus.id))
-            .join(Corpus.scenarios)
-            .filter(Corpus.dataset_id == dataset_id)
-            .group_by(Scenario.name)
-            .all()
-        )
 
-        scenario_counts = {name: count for name, count in scenario_counts_query}
+def rebuild_dataset_stats(dataset_id: int = None) -> int:
+    """从语料表重建数据集统计（为None时重建所有数据集），用于修复统计偏差"""
+    return stats_service.rebuild_dataset_stats(dataset_id)
 
-        return {
-            "total_corpus_count": num_to_generate,
-            "scenario_counts": scenario_counts,
-        }
+
+def get_dataset_role_stats(dataset_id: int) -> dict:
+    """按角色汇总数据集的消息条数与字符数，返回 {role: {"turns": int, "chars": int}}"""
+    if not dataset_id:
+        return {}
+    return stats_service.get_role_stats(dataset_id)
+
+
+_DEDUP_COUNT_KEYS = ("submitted", "inserted", "batch_duplicates", "existing_duplicates")
+
+
+def get_dedup_report(dataset_id: int) -> dict:
+    """
+    Returns the write-time deduplication counts of a dataset per generation batch.
+
+    Each batch entry has the submitted, inserted and duplicate counts (split
+    into duplicates within the same write and duplicates of stored corpus)
+    and the duplicate hit rate; "totals" sums all batches. Batches are
+    ordered by their last write, newest first.
+    """
+    report = {"batches": [], "totals": None}
+    if not dataset_id:
+        return report
+
+    session = db_manager.get_read_session()
+    try:
+        rows = (
+            session.query(DedupBatchStats)
+            .filter(DedupBatchStats.dataset_id == dataset_id)
+            .order_by(DedupBatchStats.updated_at.desc(), DedupBatchStats.id.desc())
+            .all()
+        )
+        totals = defaultdict(int)
+        for row in rows:
+            entry = {
+                "batch_id": row.batch_id,
+                "submitted": row.submitted_count,
+                "inserted": row.inserted_count,
+                "batch_duplicates": row.batch_duplicate_count,
+                "existing_duplicates": row.existing_duplicate_count,
+                "updated_at": row.updated_at,
+            }
+            for key in _DEDUP_COUNT_KEYS:
+                totals[key] += entry[key]
+            report["batches"].append(entry)
+        for entry in [*report["batches"], totals]:
+            duplicates = entry["batch_duplicates"] + entry["existing_duplicates"]
+            submitted = entry["submitted"]
+            entry["hit_rate"] = duplicates / submitted if submitted else 0.0
+        report["totals"] = dict(totals)
+        return report
     finally:
         session.close()
 
@@ -255,26 +488,37 @@ def delete_corpus_by_scenarios(dataset_id: int, scenario_names: list[str]) -> in
 
     session = db_manager.get_session()
     try:
-        # Find scenarios to get their IDs
-        scenarios = (
-            session.query(Scenario).filter(Scenario.name.in_(scenario_names)).all()
+        # Find scenarios of the dataset's character to get their IDs
+        character_id = (
+            select(Dataset.character_id)
+            .where(Dataset.id == dataset_id)
+            .scalar_subquery()
         )
-        if not scenarios:
+        scenario_ids = [
+            scenario_id
+            for (scenario_id,) in session.query(Scenario.id).filter(
+                Scenario.character_id == character_id,
+                Scenario.name.in_(scenario_names),
+            )
+        ]
+        if not scenario_ids:
             return 0
 
         # Find all corpus entries linked to these scenarios within the dataset
-        corpus_to_delete = (
-            session.query(Corpus)
-            .filter(Corpus.dataset_id == dataset_id)
-            .join(Corpus.scenarios)
-            .filter(Scenario.name.in_(scenario_names))
-            .all()
-        )
+        corpus_ids = [
+            corpus_id
+            for (corpus_id,) in session.query(Corpus.id).filter(
+                Corpus.dataset_id == dataset_id,
+                Corpus.id.in_(
+                    select(corpus_scenarios_association.c.corpus_id).where(
+                        corpus_scenarios_association.c.scenario_id.in_(scenario_ids)
+                    )
+                ),
+            )
+        ]
 
-        deleted_count = len(corpus_to_delete)
+        deleted_count = len(_delete_corpus_ids(session, corpus_ids))
         if deleted_count > 0:
-            for corpus_entry in corpus_to_delete:
-                session.delete(corpus_entry)
             session.commit()
             logger.info(
                 f"Deleted {deleted_count} corpus entries from dataset {dataset_id} "
@@ -293,6 +537,237 @@ def delete_corpus_by_scenarios(dataset_id: int, scenario_names: list[str]) -> in
         session.close()
 
 
+def _delete_corpus_ids(session, corpus_ids: list) -> list:
+    """
+    按ID分批删除语料及其场景关联、对话消息和签名，返回实际删除的语料ID，由调用方提交事务。
+
+    使用集合删除语句而不是逐个加载ORM对象，关联表、dialogue_turns 与 corpus_minhash
+    需要显式先行清理。
+    数据集统计在同一事务中同步扣减。
+    """
+    deleted_ids = []
+    stats_delta = stats_service.StatsDelta()
+    for start in range(0, len(corpus_ids), DELETE_CHUNK_SIZE):
+        chunk = corpus_ids[start : start + DELETE_CHUNK_SIZE]
+        rows = session.execute(
+            select(
+                Corpus.id, Corpus.dataset_id, Corpus.turn_count, Corpus.char_count
+            ).where(Corpus.id.in_(chunk))
+        ).all()
+        if not rows:
+            continue
+        existing = [row[0] for row in rows]
+        scenario_ids = defaultdict(list)
+        for corpus_id, scenario_id in session.execute(
+            select(
+                corpus_scenarios_association.c.corpus_id,
+                corpus_scenarios_association.c.scenario_id,
+            ).where(corpus_scenarios_association.c.corpus_id.in_(existing))
+        ):
+            scenario_ids[corpus_id].append(scenario_id)
+        for corpus_id, corpus_dataset_id, turn_count, char_count in rows:
+            stats_delta.add(
+                corpus_dataset_id,
+                turn_count,
+                char_count,
+                scenario_ids[corpus_id],
+                sign=-1,
+            )
+
+        session.execute(
+            delete(DialogueTurn).where(DialogueTurn.corpus_id.in_(existing))
+        )
+        session.execute(
+            delete(CorpusMinHash).where(CorpusMinHash.corpus_id.in_(existing))
+        )
+        session.execute(
+            delete(corpus_scenarios_association).where(
+                corpus_scenarios_association.c.corpus_id.in_(existing)
+            )
+        )
+        session.execute(
+            delete(Corpus).where(Corpus.id.in_(existing)),
+            execution_options={"synchronize_session": False},
+        )
+        deleted_ids.extend(existing)
+
+    if stats_delta:
+        stats_service.apply_stats_delta(session, stats_delta)
+    return deleted_ids
+
+
+def _resolve_scenario_ids(session, dataset, scenario_names) -> dict:
+    """
+    一次性查询场景名称到ID的映射。
+    场景名称只在同一角色下唯一，因此优先限定为数据集绑定角色的场景。
+    """
+    if not scenario_names:
+        return {}
+    query = session.query(Scenario.name, Scenario.id).filter(
+        Scenario.name.in_(scenario_names)
+    )
+    if dataset.character_id:
+        query = query.filter(Scenario.character_id == dataset.character_id)
+    return {name: scenario_id for name, scenario_id in query.all()}
+
+
+def _bulk_insert_corpus(session, dataset, entries: list) -> list:
+    """
+    在当前事务中批量写入语料、拆分后的对话消息、MinHash 签名及其场景关联，不提交事务。
+
+    Args:
+        session: 数据库会话
+        dataset: 目标数据集对象
+        entries: (dialogue_data, scenario_names) 元组列表
+
+    Returns:
+        按输入顺序排列的新语料ID列表，因内容重复而跳过的条目为 None
+    """
+    if not entries:
+        return []
+
+    all_scenario_names = set()
+    for _, scenario_names in entries:
+        all_scenario_names.update(scenario_names or [])
+    scenario_ids = _resolve_scenario_ids(session, dataset, all_scenario_names)
+
+    rows = []
+    seen_hashes = set()
+    for dialogue_data, _ in entries:
+        content_hash = dialogue_turns.content_hash(dialogue_data)
+        # 同一次写入中内容重复的对话只保留第一条
+        if content_hash is not None and content_hash in seen_hashes:
+            rows.append(None)
+            continue
+        seen_hashes.add(content_hash)
+        turn_count, char_count = dialogue_turns.dialogue_metrics(dialogue_data)
+        rows.append(
+            {
+                "dialogue": dialogue_data,
+                "dataset_id": dataset.id,
+                "turn_count": turn_count,
+                "char_count": char_count,
+                "content_hash": content_hash,
+            }
+        )
+    corpus_ids = _insert_corpus_rows(session, rows)
+
+    turn_rows = []
+    signature_rows = []
+    association_rows = []
+    stats_delta = stats_service.StatsDelta()
+    for corpus_id, row, (dialogue_data, scenario_names) in zip(
+        corpus_ids, rows, entries
+    ):
+        if corpus_id is None:
+            continue
+        turn_rows.extend(dialogue_turns.dialogue_turn_rows(corpus_id, dialogue_data))
+        signature_rows.append(
+            near_duplicate_service.signature_row(corpus_id, dataset.id, dialogue_data)
+        )
+        linked_ids = [
+            scenario_ids[scenario_name]
+            for scenario_name in dict.fromkeys(scenario_names or [])
+            if scenario_name in scenario_ids
+        ]
+        association_rows.extend(
+            {"corpus_id": corpus_id, "scenario_id": scenario_id}
+            for scenario_id in linked_ids
+        )
+        stats_delta.add(dataset.id, row["turn_count"], row["char_count"], linked_ids)
+    if turn_rows:
+        session.execute(insert(DialogueTurn), turn_rows)
+    if signature_rows:
+        session.execute(insert(CorpusMinHash), signature_rows)
+    if association_rows:
+        session.execute(insert(corpus_scenarios_association), association_rows)
+    if stats_delta:
+        stats_service.apply_stats_delta(session, stats_delta)
+    _record_dedup_stats(session, dataset.id, entries, rows, corpus_ids)
+
+    return corpus_ids
+
+
+def _insert_corpus_rows(session, rows: list) -> list:
+    """
+    写入语料行，返回与 rows 对齐的新语料ID列表。
+
+    有内容哈希的行使用 INSERT OR IGNORE，与数据集中已有语料重复的行由唯一索引
+    (dataset_id, content_hash) 跳过；这些行以及 rows 中的 None 对应位置为 None。
+    """
+    hashed = [row for row in rows if row is not None and row["content_hash"]]
+    unhashed = [row for row in rows if row is not None and not row["content_hash"]]
+
+    ids_by_hash = {}
+    if hashed:
+        ids_by_hash = dict(
+            session.execute(
+                insert(Corpus)
+                .prefix_with("OR IGNORE")
+                .returning(Corpus.content_hash, Corpus.id),
+                hashed,
+            ).all()
+        )
+    unhashed_ids = iter(
+        session.scalars(
+            insert(Corpus).returning(Corpus.id, sort_by_parameter_order=True),
+            unhashed,
+        ).all()
+        if unhashed
+        else []
+    )
+
+    corpus_ids = []
+    for row in rows:
+        if row is None:
+            corpus_ids.append(None)
+        elif row["content_hash"]:
+            corpus_ids.append(ids_by_hash.get(row["content_hash"]))
+        else:
+            corpus_ids.append(next(unhashed_ids))
+    return corpus_ids
+
+
+def _record_dedup_stats(session, dataset_id: int, entries, rows, corpus_ids):
+    """按 batch_id 累加本次写入的提交数、入库数与两类重复数，不提交事务"""
+    counts = defaultdict(lambda: [0, 0, 0, 0])
+    for (dialogue_data, _), row, corpus_id in zip(entries, rows, corpus_ids):
+        batch_id = (
+            dialogue_data.get("batch_id") if isinstance(dialogue_data, dict) else None
+        )
+        batch_counts = counts[batch_id or ""]
+        batch_counts[0] += 1
+        if corpus_id is not None:
+            batch_counts[1] += 1
+        elif row is None:
+            batch_counts[2] += 1
+        else:
+            batch_counts[3] += 1
+
+    for batch_id, (submitted, inserted, batch_dups, existing_dups) in counts.items():
+        stats = (
+            session.query(DedupBatchStats)
+            .filter_by(dataset_id=dataset_id, batch_id=batch_id)
+            .first()
+        )
+        if stats is None:
+            stats = DedupBatchStats(
+                dataset_id=dataset_id,
+                batch_id=batch_id,
+                submitted_count=0,
+                inserted_count=0,
+                batch_duplicate_count=0,
+                existing_duplicate_count=0,
+            )
+            session.add(stats)
+        stats.submitted_count += submitted
+        stats.inserted_count += inserted
+        stats.batch_duplicate_count += batch_dups
+        stats.existing_duplicate_count += existing_dups
+    # 会话不自动 flush，同一事务中再次写入同一批次时需要能查到这些行
+    session.flush()
+
+
 def save_corpus_to_dataset(
     dataset_name: str, dialogue_data: dict, scenario_names: list
 ) -> int:
@@ -305,7 +780,7 @@ def save_corpus_to_dataset(
         scenario_names: 关联的场景标签名称列表
 
     Returns:
-        保存的语料ID
+        保存的语料ID，与数据集已有语料内容重复而跳过时为 None
     """
     session = db_manager.get_session()
     try:
@@ -314,21 +789,16 @@ def save_corpus_to_dataset(
         if not dataset:
             raise ValueError(f"数据集 '{dataset_name}' 不存在")
 
-        # 获取场景对象
-        scenarios = []
-        if scenario_names:
-            scenarios = (
-                session.query(Scenario).filter(Scenario.name.in_(scenario_names)).all()
-            )
-
-        # 创建语料条目
-        corpus = Corpus(dialogue=dialogue_data, dataset=dataset, scenarios=scenarios)
-
-        session.add(corpus)
+        corpus_id = _bulk_insert_corpus(
+            session, dataset, [(dialogue_data, scenario_names)]
+        )[0]
         session.commit()
 
-        logger.info(f"成功保存语料到数据集 '{dataset_name}'，ID: {corpus.id}")
-        return corpus.id
+        if corpus_id is None:
+            logger.info(f"数据集 '{dataset_name}' 中已有相同内容的语料，已跳过")
+        else:
+            logger.info(f"成功保存语料到数据集 '{dataset_name}'，ID: {corpus_id}")
+        return corpus_id
 
     except Exception as e:
         session.rollback()
@@ -338,70 +808,61 @@ def save_corpus_to_dataset(
         session.close()
 
 
-def batch_save_corpus_to_dataset(dataset_name: str, conversations: list) -> int:
+def add_corpus_records(session, dataset_name: str, conversations: list) -> int:
     """
-    批量保存语料到指定数据集
+    在调用方的事务中批量写入语料，不提交事务。
+
+    数据集和场景只查询一次，语料与场景关联通过批量INSERT写入。
+    与数据集已有语料或同批其他对话内容重复的对话会被跳过。
 
     Args:
+        session: 数据库会话
         dataset_name: 目标数据集名称
         conversations: 对话列表，每个元素包含对话数据和场景信息
 
     Returns:
-        成功保存的语料数量
+        写入的语料数量（不含跳过的重复对话）
     """
-    session = db_manager.get_session()
-    saved_count = 0
-
-    try:
-        # 获取数据集
-        dataset = session.query(Dataset).filter(Dataset.name == dataset_name).first()
-        if not dataset:
-            raise ValueError(f"数据集 '{dataset_name}' 不存在")
-
-        # 获取所有可能的场景
-        all_scenario_names = set()
-        for conv in conversations:
-            all_scenario_names.update(conv.get("scenarios", []))
-
-        scenarios_dict = {}
-        if all_scenario_names:
-            scenarios = (
-                session.query(Scenario)
-                .filter(Scenario.name.in_(all_scenario_names))
-                .all()
-            )
-            scenarios_dict = {s.name: s for s in scenarios}
-
-        # 批量创建语料条目
-        for conversation in conversations:
-            try:
-                # 转换对话格式
-                dialogue_data = {
-                    "scenario_labels": conversation.get("scenarios", []),
-                    "dialogues": conversation.get("dialogues", []),
-                    "turn_count": len(conversation.get("dialogues", [])) // 2,
-                    "batch_id": conversation.get("batch_id"),
-                    "generation_time": conversation.get("generation_time"),
-                }
+    dataset = session.query(Dataset).filter(Dataset.name == dataset_name).first()
+    if not dataset:
+        raise ValueError(f"数据集 '{dataset_name}' 不存在")
+
+    entries = []
+    for conversation in conversations:
+        try:
+            # 转换对话格式
+            dialogues = conversation.get("dialogues", [])
+            dialogue_data = {
+                "scenario_labels": conversation.get("scenarios", []),
+                "dialogues": dialogues,
+                "turn_count": len(dialogues) // 2,
+                "batch_id": conversation.get("batch_id"),
+                "generation_time": conversation.get("generation_time"),
+            }
+            entries.append((dialogue_data, conversation.get("scenarios", [])))
+        except Exception as e:
+            logger.error(f"保存单条语料失败: {e}")
+            continue
+
+    corpus_ids = _bulk_insert_corpus(session, dataset, entries)
+    return sum(1 for corpus_id in corpus_ids if corpus_id is not None)
 
-                # 获取相关场景
-                conv_scenarios = []
-                for scenario_name in conversation.get("scenarios", []):
-                    if scenario_name in scenarios_dict:
-                        conv_scenarios.append(scenarios_dict[scenario_name])
 
-                # 创建语料条目
-                corpus = Corpus(
-                    dialogue=dialogue_data, dataset=dataset, scenarios=conv_scenarios
-                )
+def batch_save_corpus_to_dataset(dataset_name: str, conversations: list) -> int:
+    """
+    批量保存语料到指定数据集，所有语料在同一个事务中写入
 
-                session.add(corpus)
-                saved_count += 1
+    Args:
+        dataset_name: 目标数据集名称
+        conversations: 对话列表，每个元素包含对话数据和场景信息
 
-            except Exception as e:
-                logger.error(f"保存单条语料失败: {e}")
-                continue
+    Returns:
+        成功保存的语料数量
+    """
+    session = db_manager.get_session()
 
+    try:
+        saved_count = add_corpus_records(session, dataset_name, conversations)
         session.commit()
         logger.info(
             f"批量保存完成，成功保存 {saved_count}/{len(conversations)} 条语料到数据集 '{dataset_name}'"
@@ -430,7 +891,7 @@ def get_corpus_preview_data(dataset_id: int, limit: int = 50) -> list:
     if not dataset_id:
         return []
 
-    session = db_manager.get_session()
+    session = db_manager.get_read_session()
     try:
         corpus_entries = (
             session.query(Corpus)
@@ -485,203 +946,539 @@ def get_corpus_preview_data(dataset_id: int, limit: int = 50) -> list:
         session.close()
 
 
-def _prepare_export_dir():
-    """Prepares the export directory by cleaning and recreating it."""
-    try:
-        if os.path.exists(EXPORT_DIR):
-            for file in os.listdir(EXPORT_DIR):
-                file_path = os.path.join(EXPORT_DIR, file)
-                try:
-                    if os.path.isfile(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    logger.error(f"删除文件 {file_path} 失败: {e}")
-        else:
-            os.makedirs(EXPORT_DIR, exist_ok=True)
-        logger.info(f"Export directory '{EXPORT_DIR}' prepared.")
-    except Exception as e:
-        logger.error(f"Failed to prepare export directory: {e}")
-        raise
+def _new_export_dir(prefix: str, dataset_name: str) -> str:
+    """Creates a fresh timestamped directory for one export.
+
+    Earlier exports are left untouched, so a download that is still in
+    progress never loses its file to a newer export.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_dir = os.path.join(EXPORT_DIR, f"{prefix}_{dataset_name}_{timestamp}")
+    export_dir, suffix = base_dir, 1
+    while True:
+        try:
+            os.makedirs(export_dir)
+        except FileExistsError:
+            # 同一秒内的重复导出
+            suffix += 1
+            export_dir = f"{base_dir}_{suffix}"
+            continue
+        logger.info(f"Export directory '{export_dir}' created.")
+        return export_dir
+
+
+def _load_export_dataset(session, dataset_id: int) -> Dataset:
+    """取出要导出的数据集（含角色），数据集不存在或没有语料时抛出 ValueError"""
+    if not dataset_id:
+        raise ValueError("数据集ID不能为空")
+
+    dataset = (
+        session.query(Dataset)
+        .options(joinedload(Dataset.character))
+        .filter(Dataset.id == dataset_id)
+        .first()
+    )
+    if not dataset:
+        raise ValueError(f"未找到ID为 {dataset_id} 的数据集")
+
+    has_corpus = session.query(
+        session.query(Corpus.id).filter(Corpus.dataset_id == dataset_id).exists()
+    ).scalar()
+    if not has_corpus:
+        raise ValueError("该数据集没有语料数据")
+    return dataset
+
+
+def _export_filepath(prefix: str, dataset: Dataset, extension: str) -> str:
+    export_dir = _new_export_dir(prefix, dataset.name)
+    return os.path.join(export_dir, os.path.basename(export_dir) + extension)
+
+
+def _iter_training_entries(session, dataset: Dataset):
+    """逐条产出数据集中有有效对话的标准训练格式记录"""
+    character_name = dataset.character.name if dataset.character else None
+    for batch in corpus_export.iter_export_batches(session, dataset.id):
+        for corpus_id, _, dialogue_data, scenarios in batch:
+            training_entry = corpus_export.to_training_entry(
+                corpus_id, dialogue_data, scenarios, dataset.name, character_name
+            )
+            if training_entry:
+                yield training_entry
 
 
-def export_dataset_corpus_to_jsonl(dataset_id: int) -> str:
+def export_dataset_corpus_to_jsonl(
+    dataset_id: int, compression: str = export_writers.COMPRESSION_NONE
+) -> str:
     """
     导出数据集的所有语料为JSONL格式文件
 
     Args:
         dataset_id: 数据集ID
+        compression: none / gzip / zstd
 
     Returns:
         生成的JSONL文件路径
     """
-    if not dataset_id:
-        raise ValueError("数据集ID不能为空")
-
-    session = db_manager.get_session()
+    session = db_manager.get_read_session()
     try:
-        # 获取数据集信息
-        dataset = session.query(Dataset).filter(Dataset.id == dataset_id).first()
-        if not dataset:
-            raise ValueError(f"未找到ID为 {dataset_id} 的数据集")
+        dataset = _load_export_dataset(session, dataset_id)
+        filepath = _export_filepath(
+            "corpus", dataset, export_writers.JSONL_EXTENSIONS[compression]
+        )
 
-        # 获取所有语料
-        corpus_entries = (
-            session.query(Corpus)
-            .filter(Corpus.dataset_id == dataset_id)
-            .options(joinedload(Corpus.scenarios))
-            .order_by(Corpus.created_at.asc())
-            .all()
+        # 逐批读取并写入JSONL文件（每行一个JSON对象）
+        exported = 0
+        with export_writers.open_jsonl_writer(filepath, compression) as f:
+            for batch in corpus_export.iter_export_batches(session, dataset_id):
+                f.writelines(
+                    json.dumps(
+                        corpus_export.to_full_export_entry(*row, dataset.name),
+                        ensure_ascii=False,
+                    )
+                    + "\n"
+                    for row in batch
+                )
+                exported += len(batch)
+
+        logger.info(f"成功导出 {exported} 条语料到文件: {filepath}")
+        return filepath
+
+    except Exception as e:
+        logger.error(f"导出语料库失败: {e}")
+        raise e
+    finally:
+        session.close()
+
+
+def export_dataset_corpus_to_standard_format(
+    dataset_id: int, compression: str = export_writers.COMPRESSION_NONE
+) -> str:
+    """
+    导出数据集的语料为标准训练格式的JSONL文件
+    每行包含 {"messages": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]}
+
+    Args:
+        dataset_id: 数据集ID
+        compression: none / gzip / zstd
+
+    Returns:
+        生成的JSONL文件路径
+    """
+    session = db_manager.get_read_session()
+    try:
+        dataset = _load_export_dataset(session, dataset_id)
+        filepath = _export_filepath(
+            "training", dataset, export_writers.JSONL_EXTENSIONS[compression]
         )
 
-        if not corpus_entries:
-            raise ValueError("该数据集没有语料数据")
+        exported = 0
+        with export_writers.open_jsonl_writer(filepath, compression) as f:
+            for training_entry in _iter_training_entries(session, dataset):
+                f.write(json.dumps(training_entry, ensure_ascii=False) + "\n")
+                exported += 1
 
-        _prepare_export_dir()
+        logger.info(f"成功导出 {exported} 条标准训练格式语料到文件: {filepath}")
+        return filepath
 
-        # 生成文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"corpus_{dataset.name}_{timestamp}.jsonl"
-        filepath = os.path.join(EXPORT_DIR, filename)
+    except Exception as e:
+        logger.error(f"导出标准训练格式失败: {e}")
+        raise e
+    finally:
+        session.close()
 
-        # 生成JSONL内容
-        with open(filepath, "w", encoding="utf-8") as f:
-            for entry in corpus_entries:
-                # 构建标准的对话格式
-                jsonl_entry = {
-                    "id": entry.id,
-                    "dataset_name": dataset.name,
-                    "created_at": (
-                        entry.created_at.isoformat() if entry.created_at else None
-                    ),
-                    "scenarios": [s.name for s in entry.scenarios],
-                }
 
-                # 处理对话数据
-                dialogue_data = entry.dialogue
-                if isinstance(dialogue_data, dict):
-                    # 如果是结构化数据，直接使用
-                    jsonl_entry.update(
-                        {
-                            "conversations": dialogue_data.get("dialogues", []),
-                            "turn_count": dialogue_data.get("turn_count", 0),
-                            "batch_id": dialogue_data.get("batch_id", ""),
-                            "scenario_labels": dialogue_data.get("scenario_labels", []),
-                        }
-                    )
-                else:
-                    # 如果是其他格式，尝试解析
-                    try:
-                        parsed_dialogue = json.loads(str(dialogue_data))
-                        jsonl_entry["conversations"] = parsed_dialogue.get(
-                            "dialogues", []
-                        )
-                        jsonl_entry["turn_count"] = (
-                            len(parsed_dialogue.get("dialogues", [])) // 2
-                        )
-                    except (json.JSONDecodeError, ValueError, TypeError):
-                        # 如果解析失败，将原始数据存储为字符串
-                        jsonl_entry["raw_dialogue"] = str(dialogue_data)
-                        jsonl_entry["conversations"] = []
-                        jsonl_entry["turn_count"] = 0
+def export_dataset_corpus_to_parquet(dataset_id: int) -> str:
+    """
+    导出数据集的语料为标准训练格式的Parquet文件（需要 pyarrow）
+    列: messages, dataset, character, scenarios, corpus_id
 
-                # 写入JSONL文件（每行一个JSON对象）
-                f.write(json.dumps(jsonl_entry, ensure_ascii=False) + "\n")
+    Args:
+        dataset_id: 数据集ID
 
-        logger.info(f"成功导出 {len(corpus_entries)} 条语料到文件: {filepath}")
+    Returns:
+        生成的Parquet文件路径
+    """
+    session = db_manager.get_read_session()
+    try:
+        dataset = _load_export_dataset(session, dataset_id)
+        filepath = _export_filepath("training", dataset, ".parquet")
+
+        with export_writers.TrainingParquetWriter(filepath) as writer:
+            for training_entry in _iter_training_entries(session, dataset):
+                writer.write(training_entry)
+
+        logger.info(f"成功导出 {writer.row_count} 条语料到Parquet文件: {filepath}")
         return filepath
 
     except Exception as e:
-        logger.error(f"导出语料库失败: {e}")
+        logger.error(f"导出Parquet失败: {e}")
         raise e
     finally:
         session.close()
 
 
-def export_dataset_corpus_to_standard_format(dataset_id: int) -> str:
+def _shard_id_ranges(session, dataset_id: int, num_shards: int) -> list:
     """
-    导出数据集的语料为标准训练格式的JSONL文件
-    每行包含 {"messages": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]}
+    沿 dataset_id 索引按 id 做一次键集遍历，把数据集的语料切成 num_shards 段
+    条数相近的连续ID区间，返回 [(起始ID, 结束ID) 或 None, ...]；
+    语料少于分片数时末尾的分片为 None。
+    """
+    total = (
+        session.query(func.count(Corpus.id))
+        .filter(Corpus.dataset_id == dataset_id)
+        .scalar()
+    )
+    shard_size = -(-total // num_shards)
+    ranges = []
+    last_id = 0
+    for _ in range(num_shards):
+        window = (
+            select(Corpus.id)
+            .where(Corpus.dataset_id == dataset_id, Corpus.id > last_id)
+            .order_by(Corpus.id)
+            .limit(shard_size)
+            .subquery()
+        )
+        low, high = session.execute(
+            select(func.min(window.c.id), func.max(window.c.id))
+        ).one()
+        if low is None:
+            ranges.append(None)
+            continue
+        ranges.append((low, high))
+        last_id = high
+    return ranges
+
+
+def export_dataset_corpus_sharded(
+    dataset_id: int,
+    num_shards: int = 8,
+    val_ratio: float = 0.05,
+    test_ratio: float = 0.05,
+    output_format: str = "jsonl",
+    compression: str = export_writers.COMPRESSION_NONE,
+    max_workers: int = None,
+) -> str:
+    """
+    以标准训练格式分片导出数据集，并划分 train / val / test。
+
+    父进程沿ID做一次键集遍历，把语料切成条数相近的连续ID区间，每个分片只做
+    一次范围扫描；数据划分由语料ID的稳定哈希决定，同一条语料每次导出都落在
+    同一划分。各分片在 spawn 进程池中并行写出（fork 会复制 Gradio 和生成任务
+    的线程状态），目录结构为 {split}/shard-00000-of-00008.jsonl，
+    manifest.json 记录每个文件的ID区间、条数、大小和 sha256。
+    每次导出写入新的带时间戳的目录，不会清理以往的导出。
 
     Args:
         dataset_id: 数据集ID
+        num_shards: 分片数
+        val_ratio: 验证集比例
+        test_ratio: 测试集比例
+        output_format: jsonl / parquet
+        compression: jsonl 的压缩格式 none / gzip / zstd
+        max_workers: 进程数，默认为 min(分片数, CPU核数)
 
     Returns:
-        生成的JSONL文件路径
+        manifest.json 的路径
     """
-    if not dataset_id:
-        raise ValueError("数据集ID不能为空")
+    num_shards = int(num_shards)
+    if num_shards < 1:
+        raise ValueError("分片数必须大于0")
+    if val_ratio < 0 or test_ratio < 0 or val_ratio + test_ratio >= 1:
+        raise ValueError("验证集和测试集比例必须非负，且总和小于1")
+    if output_format == "parquet":
+        extension = ".parquet"
+    elif output_format == "jsonl":
+        extension = export_writers.JSONL_EXTENSIONS[compression]
+    else:
+        raise ValueError(f"不支持的导出格式: {output_format}")
+
+    session = db_manager.get_read_session()
+    try:
+        dataset = _load_export_dataset(session, dataset_id)
+        dataset_name = dataset.name
+        character_name = dataset.character.name if dataset.character else None
+        id_ranges = _shard_id_ranges(session, dataset_id, num_shards)
+    finally:
+        session.close()
+
+    output_dir = _new_export_dir("sharded", dataset_name)
+    for split in corpus_export.EXPORT_SPLITS:
+        os.makedirs(os.path.join(output_dir, split), exist_ok=True)
+
+    base_task = {
+        "db_url": db_manager.read_engine.url.render_as_string(hide_password=False),
+        "dataset_id": dataset_id,
+        "dataset_name": dataset_name,
+        "character_name": character_name,
+        "num_shards": num_shards,
+        "val_ratio": val_ratio,
+        "test_ratio": test_ratio,
+        "output_dir": output_dir,
+        "output_format": output_format,
+        "compression": compression,
+        "extension": extension,
+    }
+    tasks = [
+        dict(base_task, shard_index=i, id_range=id_range)
+        for i, id_range in enumerate(id_ranges)
+    ]
+    max_workers = max_workers or min(num_shards, os.cpu_count() or 1)
 
-    session = db_manager.get_session()
     try:
-        # 获取数据集信息
-        dataset = (
-            session.query(Dataset)
-            .options(joinedload(Dataset.character))
-            .filter(Dataset.id == dataset_id)
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=get_context("spawn")
+        ) as executor:
+            files = [
+                f
+                for shard in executor.map(corpus_export.export_shard, tasks)
+                for f in shard
+            ]
+    except Exception as e:
+        logger.error(f"分片导出失败: {e}")
+        raise
+
+    manifest = {
+        "dataset": dataset_name,
+        "character": character_name,
+        "created_at": datetime.now().isoformat(),
+        "format": output_format,
+        "compression": compression if output_format == "jsonl" else None,
+        "num_shards": num_shards,
+        "sharding": "contiguous id ranges",
+        "hash": "blake2b-56(corpus_id)",
+        "split_ratios": {
+            "train": 1 - val_ratio - test_ratio,
+            "val": val_ratio,
+            "test": test_ratio,
+        },
+        "counts": {
+            split: sum(f["count"] for f in files if f["split"] == split)
+            for split in corpus_export.EXPORT_SPLITS
+        },
+        "files": files,
+    }
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    logger.info(
+        f"分片导出完成: {num_shards} 个分片，{max_workers} 个进程，"
+        f"数量 {manifest['counts']}，清单: {manifest_path}"
+    )
+    return manifest_path
+
+
+def _incremental_export_dir(dataset_id: int, export_format: str) -> str:
+    return os.path.join(
+        EXPORT_DIR, INCREMENTAL_EXPORT_DIRNAME, f"dataset_{dataset_id}", export_format
+    )
+
+
+def _write_json_atomic(filepath: str, data: dict):
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, filepath)
+
+
+def export_dataset_corpus_incremental(
+    dataset_id: int,
+    kind: str = "training",
+    output_format: str = "jsonl",
+    compression: str = export_writers.COMPRESSION_NONE,
+) -> dict:
+    """
+    增量导出：只把上次导出之后新增的语料写成一个新的分片文件。
+
+    每个数据集和导出格式各有一个检查点，记录最后导出语料的 (created_at, id)。
+    分片保存在 export/incremental/dataset_{id}/{格式}/part-00001.jsonl 等文件中，
+    manifest.json 记录每个分片的条数、ID范围和 sha256。已导出后被删除的语料
+    不会从旧分片中移除，需要时可用 reset_incremental_export() 重新开始。
+
+    Args:
+        dataset_id: 数据集ID
+        kind: full（完整格式）/ training（标准训练格式）
+        output_format: jsonl / parquet（仅训练格式）
+        compression: jsonl 的压缩格式 none / gzip / zstd
+
+    Returns:
+        {"part_path": 新分片路径（没有新增语料时为 None）, "manifest_path": 清单路径,
+         "rows": 本次导出条数, "total_rows": 累计导出条数}
+    """
+    if kind not in ("full", "training"):
+        raise ValueError(f"不支持的导出类型: {kind}")
+    if output_format == "parquet":
+        if kind != "training":
+            raise ValueError("Parquet 仅支持训练格式")
+        extension = ".parquet"
+    else:
+        extension = export_writers.JSONL_EXTENSIONS[compression]
+    export_format = f"{kind}{extension}"
+
+    read_session = db_manager.get_read_session()
+    try:
+        dataset = _load_export_dataset(read_session, dataset_id)
+        dataset_name = dataset.name
+        character_name = dataset.character.name if dataset.character else None
+        checkpoint = (
+            read_session.query(ExportCheckpoint)
+            .filter_by(dataset_id=dataset_id, export_format=export_format)
             .first()
         )
-        if not dataset:
-            raise ValueError(f"未找到ID为 {dataset_id} 的数据集")
+        after = None
+        part_number = 1
+        if checkpoint and checkpoint.last_corpus_id is not None:
+            after = (checkpoint.last_created_at, checkpoint.last_corpus_id)
+            part_number = checkpoint.part_count + 1
+
+        export_dir = _incremental_export_dir(dataset_id, export_format)
+        os.makedirs(export_dir, exist_ok=True)
+        manifest_path = os.path.join(export_dir, "manifest.json")
+        part_name = f"part-{part_number:05d}{extension}"
+        part_path = os.path.join(export_dir, part_name)
+        # 先写临时文件，完成后再替换，中断的导出不会留下不完整的分片
+        tmp_path = part_path + ".tmp"
+
+        rows = 0
+        first_id = last_id = None
+        if output_format == "parquet":
+            writer = export_writers.TrainingParquetWriter(tmp_path)
+        else:
+            writer = export_writers.open_jsonl_writer(tmp_path, compression)
+        try:
+            for batch in corpus_export.iter_export_batches(
+                read_session, dataset_id, after=after
+            ):
+                for row in batch:
+                    corpus_id, _, dialogue_data, scenarios = row
+                    # 检查点跨过所有已读取的语料，包括训练格式中被跳过的
+                    first_id = corpus_id if first_id is None else first_id
+                    last_id = corpus_id
+                    if kind == "full":
+                        entry = corpus_export.to_full_export_entry(*row, dataset_name)
+                    else:
+                        entry = corpus_export.to_training_entry(
+                            corpus_id,
+                            dialogue_data,
+                            scenarios,
+                            dataset_name,
+                            character_name,
+                        )
+                    if not entry:
+                        continue
+                    if output_format == "parquet":
+                        writer.write(entry)
+                    else:
+                        writer.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    rows += 1
+        finally:
+            writer.close()
+
+        total_rows = checkpoint.total_rows if checkpoint else 0
+        if last_id is None:
+            os.unlink(tmp_path)
+            logger.info(f"数据集 {dataset_name} 没有新增语料，跳过增量导出")
+            return {
+                "part_path": None,
+                "manifest_path": manifest_path,
+                "rows": 0,
+                "total_rows": total_rows,
+            }
+        os.replace(tmp_path, part_path)
+
+        # 检查点保存数据库中的原始时间文本，与游标比较方式一致
+        last_created_at = read_session.execute(
+            select(type_coerce(Corpus.created_at, String)).where(Corpus.id == last_id)
+        ).scalar()
+    finally:
+        read_session.close()
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    else:
+        manifest = {
+            "dataset": dataset_name,
+            "dataset_id": dataset_id,
+            "export_format": export_format,
+            "parts": [],
+        }
+    # 重新导出同一分片号时（上次写完文件但检查点未保存）覆盖旧记录
+    manifest["parts"] = [p for p in manifest["parts"] if p["path"] != part_name]
+    manifest["parts"].append(
+        {
+            "path": part_name,
+            "rows": rows,
+            "first_corpus_id": first_id,
+            "last_corpus_id": last_id,
+            "last_created_at": last_created_at,
+            "bytes": os.path.getsize(part_path),
+            "sha256": corpus_export.sha256_file(part_path),
+            "exported_at": datetime.now().isoformat(),
+        }
+    )
+    total_rows += rows
+    manifest["total_rows"] = total_rows
+    _write_json_atomic(manifest_path, manifest)
 
-        # 获取所有语料
-        corpus_entries = (
-            session.query(Corpus)
-            .filter(Corpus.dataset_id == dataset_id)
-            .options(joinedload(Corpus.scenarios))
-            .order_by(Corpus.created_at.asc())
-            .all()
+    session = db_manager.get_session()
+    try:
+        checkpoint = (
+            session.query(ExportCheckpoint)
+            .filter_by(dataset_id=dataset_id, export_format=export_format)
+            .first()
         )
+        if not checkpoint:
+            checkpoint = ExportCheckpoint(
+                dataset_id=dataset_id, export_format=export_format
+            )
+            session.add(checkpoint)
+        checkpoint.last_corpus_id = last_id
+        checkpoint.last_created_at = last_created_at
+        checkpoint.part_count = part_number
+        checkpoint.total_rows = total_rows
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"保存导出检查点失败: {e}")
+        raise
+    finally:
+        session.close()
+
+    logger.info(f"增量导出 {rows} 条语料到 {part_path}，累计 {total_rows} 条")
+    return {
+        "part_path": part_path,
+        "manifest_path": manifest_path,
+        "rows": rows,
+        "total_rows": total_rows,
+    }
 
-        if not corpus_entries:
-            raise ValueError("该数据集没有语料数据")
-
-        _prepare_export_dir()
-
-        # 生成文件名
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"training_{dataset.name}_{timestamp}.jsonl"
-        filepath = os.path.join(EXPORT_DIR, filename)
-
-        # 生成标准训练格式的JSONL内容
-        with open(filepath, "w", encoding="utf-8") as f:
-            for entry in corpus_entries:
-                dialogue_data = entry.dialogue
-
-                # 提取对话内容
-                messages = []
-                if isinstance(dialogue_data, dict) and "dialogues" in dialogue_data:
-                    for turn in dialogue_data["dialogues"]:
-                        role = turn.get("role", "user")
-                        content = turn.get("content", "")
-                        if content.strip():  # 只添加非空内容
-                            messages.append({"role": role, "content": content})
-
-                # 只有当有有效对话时才写入文件
-                if messages and len(messages) >= 2:  # 至少要有一轮完整对话
-                    training_entry = {
-                        "messages": messages,
-                        "metadata": {
-                            "dataset": dataset.name,
-                            "character": (
-                                dataset.character.name if dataset.character else None
-                            ),
-                            "scenarios": [s.name for s in entry.scenarios],
-                            "corpus_id": entry.id,
-                        },
-                    }
-                    f.write(json.dumps(training_entry, ensure_ascii=False) + "\n")
-
-        logger.info(f"成功导出标准训练格式文件: {filepath}")
-        return filepath
 
+def reset_incremental_export(dataset_id: int) -> int:
+    """删除数据集的所有增量导出检查点和分片文件，返回删除的检查点数量"""
+    session = db_manager.get_session()
+    try:
+        deleted = (
+            session.query(ExportCheckpoint)
+            .filter(ExportCheckpoint.dataset_id == dataset_id)
+            .delete(synchronize_session=False)
+        )
+        session.commit()
     except Exception as e:
-        logger.error(f"导出标准训练格式失败: {e}")
-        raise e
+        session.rollback()
+        logger.error(f"重置增量导出失败: {e}")
+        raise
     finally:
         session.close()
 
+    dataset_dir = os.path.join(
+        EXPORT_DIR, INCREMENTAL_EXPORT_DIRNAME, f"dataset_{dataset_id}"
+    )
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    logger.info(f"已重置数据集 {dataset_id} 的增量导出（{deleted} 个检查点）")
+    return deleted
+
 
 # TODO: Implement dataset service functions here.
 # - get_dataset_stats(dataset_id)
@@ -707,117 +1504,11 @@ def detect_invalid_corpus_data(dataset_id: int = None) -> dict:
                 }
             ]
         }
-    """
-    session = db_manager.get_session()
-    try:
-        # 构建查询
-        query = session.query(Corpus).options(joinedload(Corpus.dataset))
-        if dataset_id:
-            query = query.filter(Corpus.dataset_id == dataset_id)
-
-        corpus_entries = query.all()
-
-        invalid_entries = []
-        total_checked = len(corpus_entries)
-
-        for entry in corpus_entries:
-            issues = []
-            dialogue_sample = ""
-
-            try:
-                dialogue_data = entry.dialogue
-
-                # 检查dialogue_data是否为字典
-                if not isinstance(dialogue_data, dict):
-                    issues.append("dialogue字段不是字典类型")
-                    dialogue_sample = str(dialogue_data)[:100] + "..."
-                    invalid_entries.append(
-                        {
-                            "corpus_id": entry.id,
-                            "dataset_name": (
-                                entry.dataset.name if entry.dataset else "未知"
-                            ),
-                            "issues": issues,
-                            "dialogue_sample": dialogue_sample,
-                        }
-                    )
-                    continue
-
-                # 检查是否包含dialogues字段
-                if "dialogues" not in dialogue_data:
-                    issues.append("缺少dialogues字段")
-                else:
-                    dialogues = dialogue_data["dialogues"]
 
-                    # 检查dialogues是否为列表
-                    if not isinstance(dialogues, list):
-                        issues.append("dialogues字段不是列表类型")
-                    else:
-                        # 检查每个对话回合
-                        for i, turn in enumerate(dialogues):
-                            if not isinstance(turn, dict):
-                                issues.append(f"第{i+1}轮对话不是字典类型")
-                                continue
-
-                            # 检查role字段
-                            role = turn.get("role")
-                            if not role or not isinstance(role, str):
-                                issues.append(f"第{i+1}轮对话缺少有效的role字段")
-
-                            # 检查content字段
-                            content = turn.get("content")
-                            if content is None:
-                                issues.append(f"第{i+1}轮对话缺少content字段")
-                            elif isinstance(content, dict):
-                                issues.append(
-                                    f"第{i+1}轮对话的content是字典类型而非字符串"
-                                )
-                            elif not isinstance(content, str):
-                                issues.append(
-                                    f"第{i+1}轮对话的content不是字符串类型：{type(content)}"
-                                )
-
-                # 如果发现问题，记录这个条目
-                if issues:
-                    # 生成问题数据样本
-                    if isinstance(dialogue_data, dict) and "dialogues" in dialogue_data:
-                        sample_turns = dialogue_data["dialogues"][:2]  # 只取前两轮
-                        dialogue_sample = (
-                            json.dumps(sample_turns, ensure_ascii=False)[:200] + "..."
-                        )
-                    else:
-                        dialogue_sample = str(dialogue_data)[:100] + "..."
-
-                    invalid_entries.append(
-                        {
-                            "corpus_id": entry.id,
-                            "dataset_name": (
-                                entry.dataset.name if entry.dataset else "未知"
-                            ),
-                            "issues": issues,
-                            "dialogue_sample": dialogue_sample,
-                        }
-                    )
-
-            except Exception as e:
-                issues.append(f"数据解析异常: {str(e)}")
-                invalid_entries.append(
-                    {
-                        "corpus_id": entry.id,
-                        "dataset_name": entry.dataset.name if entry.dataset else "未知",
-                        "issues": issues,
-                        "dialogue_sample": str(entry.dialogue)[:100] + "...",
-                    }
-                )
-
-        logger.info(
-            f"检测完成：总共检查 {total_checked} 条语料，发现 {len(invalid_entries)} 条不合规范数据"
-        )
-
-        return {"total_checked": total_checked, "invalid_entries": invalid_entries}
-
-    finally:
-        session.close()
+    结构检查在 SQLite 中完成，只有可疑的语料会被逐批取回详细检查；
+    语料未变化时直接返回缓存的上次检测结果。
+    """
+    return validation_service.validate_corpus(dataset_id)
 
 
 def clean_invalid_corpus_data(dataset_id: int = None, dry_run: bool = True) -> dict:
@@ -837,7 +1528,7 @@ def clean_invalid_corpus_data(dataset_id: int = None, dry_run: bool = True) -> d
             "deleted_corpus_ids": [int]
         }
     """
-    # 首先检测不合规范的数据
+    # 首先检测不合规范的数据（语料未变化时复用上次的检测结果）
     detection_result = detect_invalid_corpus_data(dataset_id)
     invalid_entries = detection_result["invalid_entries"]
 
@@ -863,25 +1554,16 @@ def clean_invalid_corpus_data(dataset_id: int = None, dry_run: bool = True) -> d
 
     # 执行删除操作
     session = db_manager.get_session()
-    deleted_corpus_ids = []
-    deleted_count = 0
 
     try:
-        corpus_ids_to_delete = [entry["corpus_id"] for entry in invalid_entries]
+        # 检测结果可能来自缓存，删除前重新检查，已被替换或修正的语料不删除
+        corpus_ids_to_delete = validation_service.find_suspect_ids(
+            [entry["corpus_id"] for entry in invalid_entries]
+        )
 
-        # 批量删除
-        for corpus_id in corpus_ids_to_delete:
-            try:
-                corpus_entry = (
-                    session.query(Corpus).filter(Corpus.id == corpus_id).first()
-                )
-                if corpus_entry:
-                    session.delete(corpus_entry)
-                    deleted_corpus_ids.append(corpus_id)
-                    deleted_count += 1
-            except Exception as e:
-                logger.error(f"删除语料ID {corpus_id} 时出错: {e}")
-                continue
+        # 分批按ID集合删除，关联表与语料在同一事务中清理
+        deleted_corpus_ids = _delete_corpus_ids(session, corpus_ids_to_delete)
+        deleted_count = len(deleted_corpus_ids)
 
         session.commit()
         logger.info(f"成功删除 {deleted_count} 条不合规范的语料数据")
@@ -899,3 +1581,178 @@ def clean_invalid_corpus_data(dataset_id: int = None, dry_run: bool = True) -> d
         raise e
     finally:
         session.close()
+
+
+def find_near_duplicate_corpus(dataset_id: int, threshold: float = None) -> dict:
+    """
+    查找数据集中 assistant 回复高度相似的语料簇（MinHash + LSH），
+    结果格式见 near_duplicate_service.find_near_duplicates
+    """
+    if not dataset_id:
+        return {"total_checked": 0, "duplicate_count": 0, "clusters": []}
+    return near_duplicate_service.find_near_duplicates(dataset_id, threshold)
+
+
+def prune_near_duplicate_corpus(dataset_id: int, threshold: float = None) -> dict:
+    """
+    删除近似重复的语料，每个簇只保留最早写入的一条
+
+    Returns:
+        {"cluster_count": int, "deleted_count": int, "deleted_corpus_ids": [int]}
+    """
+    result = find_near_duplicate_corpus(dataset_id, threshold)
+    # 只删除与保留条目本身足够相似的语料，经传递并入簇的其余语料保留
+    corpus_ids_to_delete = [
+        corpus_id
+        for cluster in result["clusters"]
+        for corpus_id in cluster["duplicate_ids"]
+    ]
+    if not corpus_ids_to_delete:
+        return {"cluster_count": 0, "deleted_count": 0, "deleted_corpus_ids": []}
+
+    session = db_manager.get_session()
+    try:
+        deleted_corpus_ids = _delete_corpus_ids(session, corpus_ids_to_delete)
+        session.commit()
+        logger.info(
+            f"数据集 {dataset_id}: 删除 {len(deleted_corpus_ids)} 条近似重复语料，"
+            f"涉及 {len(result['clusters'])} 个簇"
+        )
+        return {
+            "cluster_count": len(result["clusters"]),
+            "deleted_count": len(deleted_corpus_ids),
+            "deleted_corpus_ids": deleted_corpus_ids,
+        }
+    except Exception as e:
+        session.rollback()
+        logger.error(f"删除近似重复语料失败: {e}")
+        raise
+    finally:
+        session.close()
+
+
+def find_exact_duplicate_corpus(dataset_id: int) -> dict:
+    """
+    查找去重功能上线之前写入、内容与数据集中另一条语料完全相同的语料。
+    这些语料的 content_hash 为 NULL（唯一索引只允许最早的一条持有哈希），
+    按ID分批重新计算哈希，与持有该哈希的语料比对。
+
+    Returns:
+        {"total_checked": int, "duplicate_count": int,
+         "duplicates": [{"corpus_id": int, "keep_id": int}, ...]}
+    """
+    if not dataset_id:
+        return {"total_checked": 0, "duplicate_count": 0, "duplicates": []}
+
+    total_checked = 0
+    duplicates = []
+    last_id = 0
+    session = db_manager.get_read_session()
+    try:
+        while True:
+            rows = session.execute(
+                select(Corpus.id, Corpus.dialogue)
+                .where(
+                    Corpus.dataset_id == dataset_id,
+                    Corpus.content_hash.is_(None),
+                    Corpus.id > last_id,
+                )
+                .order_by(Corpus.id)
+                .limit(DELETE_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            total_checked += len(rows)
+            hashes = {
+                corpus_id: dialogue_turns.content_hash(dialogue)
+                for corpus_id, dialogue in rows
+            }
+            holders = dict(
+                session.execute(
+                    select(Corpus.content_hash, Corpus.id).where(
+                        Corpus.dataset_id == dataset_id,
+                        Corpus.content_hash.in_(
+                            [h for h in set(hashes.values()) if h is not None]
+                        ),
+                    )
+                ).all()
+            )
+            duplicates += [
+                {"corpus_id": corpus_id, "keep_id": holders[row_hash]}
+                for corpus_id, row_hash in hashes.items()
+                if row_hash in holders
+            ]
+    finally:
+        session.close()
+    return {
+        "total_checked": total_checked,
+        "duplicate_count": len(duplicates),
+        "duplicates": duplicates,
+    }
+
+
+def prune_exact_duplicate_corpus(dataset_id: int) -> dict:
+    """
+    删除 find_exact_duplicate_corpus 找到的重复语料，保留持有内容哈希的那一条
+
+    Returns:
+        {"deleted_count": int, "deleted_corpus_ids": [int]}
+    """
+    result = find_exact_duplicate_corpus(dataset_id)
+    corpus_ids_to_delete = [d["corpus_id"] for d in result["duplicates"]]
+    if not corpus_ids_to_delete:
+        return {"deleted_count": 0, "deleted_corpus_ids": []}
+
+    session = db_manager.get_session()
+    try:
+        deleted_corpus_ids = _delete_corpus_ids(session, corpus_ids_to_delete)
+        session.commit()
+        logger.info(
+            f"数据集 {dataset_id}: 删除 {len(deleted_corpus_ids)} 条完全重复的历史语料"
+        )
+        return {
+            "deleted_count": len(deleted_corpus_ids),
+            "deleted_corpus_ids": deleted_corpus_ids,
+        }
+    except Exception as e:
+        session.rollback()
+        logger.error(f"删除重复语料失败: {e}")
+        raise
+    finally:
+        session.close()
+
+
+def build_diversity_index(dataset_id: int, use_local_model: bool = False) -> dict:
+    """
+    重新构建数据集的语义向量索引，返回索引元数据。
+    use_local_model 为 True 时使用本地 sentence-transformers 模型，否则使用哈希 TF-IDF
+    """
+    backend = (
+        text_embeddings.BACKEND_SENTENCE_TRANSFORMERS
+        if use_local_model
+        else text_embeddings.BACKEND_HASHING
+    )
+    return diversity_service.build_index(dataset_id, backend)
+
+
+def update_diversity_index(dataset_id: int) -> dict:
+    """把新增语料追加到数据集的语义向量索引，索引不存在时完整构建"""
+    return diversity_service.update_index(dataset_id)
+
+
+def get_diversity_index_info(dataset_id: int) -> dict:
+    """数据集语义向量索引的元数据，尚未构建时返回 None"""
+    if not dataset_id:
+        return None
+    return diversity_service.get_index_info(dataset_id)
+
+
+def find_similar_corpus(dataset_id: int, query_text: str, k: int = 5) -> list:
+    """在语义向量索引中查找与查询文本最相似的语料"""
+    return diversity_service.nearest_neighbors(dataset_id, query_text, k)
+
+
+def get_scenario_coverage(dataset_id: int) -> dict:
+    """各场景语料的话题多样性，结果格式见 diversity_service.scenario_coverage"""
+    return diversity_service.scenario_coverage(dataset_id)
@@ -0,0 +1,471 @@
+"""
+Semantic diversity index of a dataset's corpus.
+
+Each dataset has an offline embedding index under data/embeddings/dataset_<id>:
+vectors.f32 is a float32 matrix read through numpy.memmap, ids.i64 holds the
+corpus id of each row (ascending) and meta.json records the backend, the
+dimension and the last indexed corpus id. build_index() streams the corpus
+twice for the hashing backend (document frequencies, then vectors);
+update_index() appends rows written since, reusing the stored IDF, so a
+rebuild is only needed when the corpus has drifted a lot.
+
+On top of the index: nearest_neighbors() for a query text,
+scenario_coverage() scores how spread out each scenario's conversations are,
+and TopicSteering picks the most over-covered topics so the generator can
+ask later requests to avoid them.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import Text, select, type_coerce
+
+from src.database.database_manager import DatabaseManager
+from src.models.data_models import Corpus, Scenario, corpus_scenarios_association
+from src.utils import text_embeddings
+from src.utils.dialogue_turns import normalize_text
+
+logger = logging.getLogger(__name__)
+
+db_manager = DatabaseManager()
+
+EMBEDDINGS_DIR = os.path.join("data", "embeddings")
+# 构建索引时每批读取与向量化的语料条数
+INDEX_BATCH_SIZE = 1000
+# 相似度计算时每次从 memmap 读入的行数
+SCAN_CHUNK_ROWS = 65536
+# 估计话题密度时抽样的向量数
+DENSITY_SAMPLE_SIZE = 1000
+# 两个话题的相似度超过该值时视为同一话题，只选其一
+DISTINCT_TOPIC_SIMILARITY = 0.5
+# 引导生成时保留的本次运行最近生成的对话数
+STEERING_RECENT_SIZE = 200
+
+
+def _index_dir(dataset_id: int) -> str:
+    return os.path.join(EMBEDDINGS_DIR, f"dataset_{dataset_id}")
+
+
+def _write_meta(index_dir: str, meta: dict):
+    tmp_path = os.path.join(index_dir, "meta.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(index_dir, "meta.json"))
+
+
+def _read_meta(index_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _make_embedder(meta: dict, index_dir: str = None):
+    if meta["backend"] == text_embeddings.BACKEND_SENTENCE_TRANSFORMERS:
+        return text_embeddings.SentenceTransformerEmbedder(meta["model"])
+    idf = np.load(os.path.join(index_dir, "idf.npy")) if index_dir else None
+    return text_embeddings.HashingTfidfEmbedder(meta["dim"], idf)
+
+
+def _iter_corpus_texts(dataset_id: int, after_id: int = 0):
+    """按ID顺序分批读取语料，产出 [(corpus_id, 对话文本)]"""
+    session = db_manager.get_read_session()
+    try:
+        result = session.execute(
+            select(Corpus.id, type_coerce(Corpus.dialogue, Text))
+            .where(Corpus.dataset_id == dataset_id, Corpus.id > after_id)
+            .order_by(Corpus.id)
+            .execution_options(yield_per=INDEX_BATCH_SIZE)
+        )
+        for rows in result.partitions():
+            yield [
+                (corpus_id, text_embeddings.conversation_text(raw_dialogue))
+                for corpus_id, raw_dialogue in rows
+            ]
+    finally:
+        session.close()
+
+
+def _append_rows(index_dir: str, embedder, dataset_id: int, after_id: int) -> tuple:
+    """把 after_id 之后的语料向量追加到索引文件，返回 (追加行数, 最后的语料ID)"""
+    appended = 0
+    last_id = after_id
+    with open(os.path.join(index_dir, "vectors.f32"), "ab") as vectors_file, open(
+        os.path.join(index_dir, "ids.i64"), "ab"
+    ) as ids_file:
+        for batch in _iter_corpus_texts(dataset_id, after_id):
+            vectors = embedder.embed([text for _, text in batch])
+            vectors_file.write(vectors.astype(text_embeddings.VECTOR_DTYPE).tobytes())
+            ids_file.write(np.array([row[0] for row in batch], dtype="<i8").tobytes())
+            appended += len(batch)
+            last_id = batch[-1][0]
+    return appended, last_id
+
+
+def build_index(dataset_id: int, backend: str = None) -> dict:
+    """
+    重新构建数据集的向量索引，返回索引的元数据。
+    backend 为 None 时使用哈希 TF-IDF；新索引先写入临时目录，完成后替换旧索引。
+    """
+    backend = backend or text_embeddings.BACKEND_HASHING
+    index_dir = _index_dir(dataset_id)
+    tmp_dir = f"{index_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    if backend == text_embeddings.BACKEND_SENTENCE_TRANSFORMERS:
+        embedder = text_embeddings.SentenceTransformerEmbedder()
+        meta = {"backend": backend, "model": embedder.model_name, "dim": embedder.dim}
+    else:
+        # 第一遍统计文档频数得到 IDF，第二遍写入向量
+        counter = text_embeddings.HashingTfidfEmbedder()
+        document_counts = np.zeros(counter.dim, dtype=np.int64)
+        total_documents = 0
+        for batch in _iter_corpus_texts(dataset_id):
+            document_counts += counter.document_counts([text for _, text in batch])
+            total_documents += len(batch)
+        idf = counter.idf_from_counts(document_counts, total_documents)
+        np.save(os.path.join(tmp_dir, "idf.npy"), idf)
+        embedder = text_embeddings.HashingTfidfEmbedder(counter.dim, idf)
+        meta = {"backend": backend, "model": None, "dim": embedder.dim}
+
+    count, last_id = _append_rows(tmp_dir, embedder, dataset_id, 0)
+    meta.update(
+        {
+            "count": count,
+            "last_corpus_id": last_id,
+            "built_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat(),
+        }
+    )
+    _write_meta(tmp_dir, meta)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+    logger.info(f"数据集 {dataset_id}: 向量索引构建完成，共 {count} 条 ({backend})")
+    return meta
+
+
+def update_index(dataset_id: int) -> dict:
+    """把上次索引之后新增的语料追加到索引中，索引不存在时完整构建"""
+    index_dir = _index_dir(dataset_id)
+    meta = _read_meta(index_dir)
+    if meta is None:
+        return build_index(dataset_id)
+
+    # 上次追加中断时文件可能比元数据记录的更长，先截断到已记录的行数
+    os.truncate(
+        os.path.join(index_dir, "vectors.f32"),
+        meta["count"] * meta["dim"] * text_embeddings.VECTOR_DTYPE.itemsize,
+    )
+    os.truncate(os.path.join(index_dir, "ids.i64"), meta["count"] * 8)
+    appended, last_id = _append_rows(
+        index_dir,
+        _make_embedder(meta, index_dir),
+        dataset_id,
+        meta["last_corpus_id"],
+    )
+    if appended:
+        meta["count"] += appended
+        meta["last_corpus_id"] = last_id
+        meta["updated_at"] = datetime.now().isoformat()
+        _write_meta(index_dir, meta)
+        logger.info(f"数据集 {dataset_id}: 向量索引追加 {appended} 条")
+    return meta
+
+
+def remove_index(dataset_id: int):
+    """删除数据集的向量索引文件"""
+    shutil.rmtree(_index_dir(dataset_id), ignore_errors=True)
+
+
+def get_index_info(dataset_id: int) -> Optional[dict]:
+    """读取数据集向量索引的元数据，尚未构建时返回 None"""
+    return _read_meta(_index_dir(dataset_id))
+
+
+def _open_index(dataset_id: int):
+    """以 memmap 打开索引，返回 (meta, 语料ID数组, 向量矩阵)，尚未构建时返回 None"""
+    index_dir = _index_dir(dataset_id)
+    meta = _read_meta(index_dir)
+    if meta is None:
+        return None
+    count = meta["count"]
+    if not count:
+        empty = np.empty((0, meta["dim"]), dtype=text_embeddings.VECTOR_DTYPE)
+        return meta, np.empty(0, dtype=np.int64), empty
+    ids = np.memmap(
+        os.path.join(index_dir, "ids.i64"), dtype="<i8", mode="r", shape=(count,)
+    )
+    vectors = np.memmap(
+        os.path.join(index_dir, "vectors.f32"),
+        dtype=text_embeddings.VECTOR_DTYPE,
+        mode="r",
+        shape=(count, meta["dim"]),
+    )
+    return meta, ids, vectors
+
+
+def _require_index(dataset_id: int):
+    index = _open_index(dataset_id)
+    if index is None:
+        raise ValueError("数据集尚未构建向量索引，请先构建索引")
+    return index
+
+
+def _corpus_snippets(session, corpus_ids: List[int]) -> Dict[int, str]:
+    if not corpus_ids:
+        return {}
+    rows = session.execute(
+        select(Corpus.id, type_coerce(Corpus.dialogue, Text)).where(
+            Corpus.id.in_(corpus_ids)
+        )
+    )
+    return {
+        corpus_id: text_embeddings.conversation_snippet(raw_dialogue)
+        for corpus_id, raw_dialogue in rows
+    }
+
+
+def nearest_neighbors(dataset_id: int, query_text: str, k: int = 5) -> List[dict]:
+    """
+    查找与查询文本最相似的 k 条语料。
+
+    Returns:
+        [{"corpus_id": int, "score": float, "snippet": str}, ...]，按相似度降序；
+        索引构建后已删除的语料不会出现在结果中
+    """
+    meta, ids, vectors = _require_index(dataset_id)
+    if not len(ids):
+        return []
+    index_dir = _index_dir(dataset_id)
+    query = _make_embedder(meta, index_dir).embed([normalize_text(query_text)])[0]
+
+    # 多取一些候选，抵消已删除的语料
+    candidates = min(len(ids), k * 3)
+    best_scores = np.empty(0, dtype=np.float32)
+    best_rows = np.empty(0, dtype=np.int64)
+    for start in range(0, len(ids), SCAN_CHUNK_ROWS):
+        scores = np.asarray(vectors[start : start + SCAN_CHUNK_ROWS]) @ query
+        best_scores = np.concatenate([best_scores, scores])
+        best_rows = np.concatenate(
+            [best_rows, np.arange(start, start + len(scores), dtype=np.int64)]
+        )
+        if len(best_scores) > candidates:
+            top = np.argpartition(-best_scores, candidates - 1)[:candidates]
+            best_scores, best_rows = best_scores[top], best_rows[top]
+    order = np.argsort(-best_scores)
+    candidate_ids = [int(ids[row]) for row in best_rows[order]]
+
+    session = db_manager.get_read_session()
+    try:
+        snippets = _corpus_snippets(session, candidate_ids)
+    finally:
+        session.close()
+    return [
+        {"corpus_id": corpus_id, "score": float(score), "snippet": snippets[corpus_id]}
+        for corpus_id, score in zip(candidate_ids, best_scores[order])
+        if corpus_id in snippets
+    ][:k]
+
+
+def _diversity(vectors: np.ndarray, rows: np.ndarray) -> Optional[float]:
+    """
+    1 - 两两余弦相似度的平均值，由单位向量之和的模长直接算出，O(n) 而非 O(n²)。
+    空文本的零向量没有方向，对向量和没有贡献，也不计入 n。
+    """
+    n = 0
+    total = np.zeros(vectors.shape[1], dtype=np.float64)
+    for start in range(0, len(rows), SCAN_CHUNK_ROWS):
+        chunk = np.asarray(vectors[rows[start : start + SCAN_CHUNK_ROWS]])
+        total += chunk.sum(axis=0)
+        n += int(np.count_nonzero(np.einsum("ij,ij->i", chunk, chunk)))
+    if n < 2:
+        return None
+    mean_similarity = (float(total @ total) - n) / (n * (n - 1))
+    return 1.0 - mean_similarity
+
+
+def scenario_coverage(dataset_id: int) -> dict:
+    """
+    计算数据集与各场景语料的话题多样性。
+
+    diversity 为 1 减去两两余弦相似度的平均值：越接近 0 说明对话越集中在
+    相同的话题上，越大说明覆盖越分散。
+
+    Returns:
+        {"overall": {"count": int, "diversity": float},
+         "scenarios": [{"scenario": str, "count": int, "diversity": float}, ...]}
+        场景按多样性升序排列（覆盖最集中的在前）
+    """
+    meta, ids, vectors = _require_index(dataset_id)
+    ids = np.asarray(ids)
+
+    session = db_manager.get_read_session()
+    try:
+        rows = session.execute(
+            select(corpus_scenarios_association.c.corpus_id, Scenario.name)
+            .join(Scenario, Scenario.id == corpus_scenarios_association.c.scenario_id)
+            .join(Corpus, Corpus.id == corpus_scenarios_association.c.corpus_id)
+            .where(Corpus.dataset_id == dataset_id)
+        ).all()
+    finally:
+        session.close()
+
+    members = {}
+    for corpus_id, name in rows:
+        members.setdefault(name, []).append(corpus_id)
+
+    scenarios = []
+    for name, corpus_ids in members.items():
+        # 索引按语料ID升序保存，二分查找定位各语料的行；尚未索引的语料不计入
+        corpus_ids = np.array(corpus_ids, dtype=np.int64)
+        positions = np.searchsorted(ids, corpus_ids)
+        found = positions < len(ids)
+        positions, corpus_ids = positions[found], corpus_ids[found]
+        indexed = positions[ids[positions] == corpus_ids]
+        scenarios.append(
+            {
+                "scenario": name,
+                "count": len(indexed),
+                "diversity": _diversity(vectors, np.sort(indexed)),
+            }
+        )
+    scenarios.sort(key=lambda s: (s["diversity"] is None, s["diversity"] or 0.0))
+    return {
+        "overall": {
+            "count": len(ids),
+            "diversity": _diversity(vectors, np.arange(len(ids))),
+        },
+        "scenarios": scenarios,
+    }
+
+
+def _dense_distinct(candidates: np.ndarray, reference: np.ndarray, k: int) -> List[int]:
+    """按与参考集合的相似度之和（话题密度）从高到低选出 k 个互不相似的候选"""
+    if not len(candidates) or not k:
+        return []
+    density = (candidates @ reference.T).sum(axis=1)
+    picked = []
+    for i in np.argsort(-density):
+        if all(
+            float(candidates[i] @ candidates[j]) < DISTINCT_TOPIC_SIMILARITY
+            for j in picked
+        ):
+            picked.append(int(i))
+            if len(picked) == k:
+                break
+    return picked
+
+
+def _sample_rows(count: int, size: int) -> np.ndarray:
+    if count <= size:
+        return np.arange(count)
+    return np.sort(np.random.default_rng(0).choice(count, size, replace=False))
+
+
+class TopicSteering:
+    """
+    为生成请求挑选"应避免的话题"示例。
+
+    候选话题来自数据集索引中密度最高的对话，以及本次运行中新生成的对话；
+    每次请求前重新计算候选的密度，挑出最集中且彼此不同的 max_topics 个话题。
+    add() 可以在工作线程中调用，prompt_suffix() 在事件循环中调用。
+    """
+
+    def __init__(self, embedder, max_topics: int, reference=None, exemplars=None):
+        self.embedder = embedder
+        self.max_topics = max_topics
+        dim = embedder.dim
+        self._reference = (
+            reference
+            if reference is not None
+            else np.empty((0, dim), dtype=text_embeddings.VECTOR_DTYPE)
+        )
+        exemplars = exemplars or []
+        self._texts = [text for text, _ in exemplars]
+        self._vectors = (
+            np.stack([vector for _, vector in exemplars])
+            if exemplars
+            else np.empty((0, dim), dtype=text_embeddings.VECTOR_DTYPE)
+        )
+        self._recent_texts: List[str] = []
+        self._recent_vectors = np.empty((0, dim), dtype=text_embeddings.VECTOR_DTYPE)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_dataset(cls, dataset_id: int, max_topics: int) -> "TopicSteering":
+        """用数据集的向量索引初始化；索引尚未构建时只根据本次生成的对话引导"""
+        index = _open_index(dataset_id) if dataset_id else None
+        if index is None or not len(index[1]):
+            return cls(text_embeddings.HashingTfidfEmbedder(), max_topics)
+
+        meta, ids, vectors = index
+        embedder = _make_embedder(meta, _index_dir(dataset_id))
+        rows = _sample_rows(len(ids), DENSITY_SAMPLE_SIZE)
+        reference = np.asarray(vectors[rows])
+        picked = _dense_distinct(reference, reference, max_topics * 2)
+        picked_ids = [int(ids[rows[i]]) for i in picked]
+
+        session = db_manager.get_read_session()
+        try:
+            snippets = _corpus_snippets(session, picked_ids)
+        finally:
+            session.close()
+        exemplars = [
+            (snippets[corpus_id], reference[i])
+            for i, corpus_id in zip(picked, picked_ids)
+            if snippets.get(corpus_id)
+        ]
+        return cls(embedder, max_topics, reference, exemplars)
+
+    def add(self, conversations: List[dict]):
+        """把新生成的对话加入候选话题"""
+        texts = [
+            text_embeddings.conversation_snippet(conversation)
+            for conversation in conversations
+        ]
+        pairs = [
+            (snippet, text_embeddings.conversation_text(conversation))
+            for snippet, conversation in zip(texts, conversations)
+            if snippet
+        ]
+        if not pairs:
+            return
+        vectors = self.embedder.embed([text for _, text in pairs])
+        with self._lock:
+            self._recent_texts = (self._recent_texts + [s for s, _ in pairs])[
+                -STEERING_RECENT_SIZE:
+            ]
+            self._recent_vectors = np.concatenate([self._recent_vectors, vectors])[
+                -STEERING_RECENT_SIZE:
+            ]
+
+    def topics(self) -> List[str]:
+        """当前最集中的话题摘要"""
+        with self._lock:
+            texts = self._texts + self._recent_texts
+            candidates = np.concatenate([self._vectors, self._recent_vectors])
+            reference = np.concatenate([self._reference, self._recent_vectors])
+        return [
+            texts[i] for i in _dense_distinct(candidates, reference, self.max_topics)
+        ]
+
+    def prompt_suffix(self) -> str:
+        """追加到提示词末尾的避免话题说明，暂无候选话题时为空字符串"""
+        topics = self.topics()
+        if not topics:
+            return ""
+        lines = "\n".join(f"- {topic}" for topic in topics)
+        return (
+            "\n\n# 避免重复的话题\n"
+            "以下话题在数据集中已经出现过很多次，请生成与它们明显不同的新话题和对话：\n"
+            f"{lines}\n"
+        )
@@ -0,0 +1,351 @@
+"""
+Service for persistent generation jobs.
+
+A GenerationJob records everything needed to re-run a generation request, and
+owns one GenerationTask per LLM request. Task status, attempts and output are
+written as each request finishes, so an interrupted job can be resumed after a
+restart without re-sending requests that already succeeded.
+"""
+
+import logging
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import func, insert
+from src.database.database_manager import DatabaseManager
+from src.models.data_models import GenerationJob, GenerationTask
+from src.services import dataset_service
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+TASK_PENDING = "pending"
+TASK_RUNNING = "running"
+TASK_SUCCEEDED = "succeeded"
+TASK_FAILED = "failed"
+
+UNFINISHED_JOB_STATUSES = (JOB_PENDING, JOB_RUNNING)
+
+
+@contextmanager
+def session_scope():
+    """Provide a transactional scope around a series of operations."""
+    db_manager = DatabaseManager()
+    session = db_manager.get_session()
+    try:
+        yield session
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"数据库会话期间发生错误: {e}", exc_info=True)
+        raise
+    finally:
+        session.close()
+
+
+def _job_to_dict(job: GenerationJob, task_counts: dict = None) -> dict:
+    task_counts = task_counts or {}
+    return {
+        "id": job.id,
+        "batch_id": job.batch_id,
+        "dataset_name": job.dataset_name,
+        "api_config_name": job.api_config_name,
+        "model_name": job.model_name,
+        "prompt": job.prompt,
+        "params": job.params or {},
+        "total_requests": job.total_requests,
+        "auto_commit": bool(job.auto_commit),
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "succeeded_requests": task_counts.get(TASK_SUCCEEDED, 0),
+        "failed_requests": task_counts.get(TASK_FAILED, 0),
+        "pending_requests": task_counts.get(TASK_PENDING, 0)
+        + task_counts.get(TASK_RUNNING, 0),
+        "conversation_count": task_counts.get("conversations", 0),
+    }
+
+
+def _task_counts(session, job_id: int) -> dict:
+    """按状态统计请求数量，"conversations" 键为已生成的对话总数"""
+    rows = (
+        session.query(
+            GenerationTask.status,
+            func.count(GenerationTask.id),
+            func.coalesce(func.sum(GenerationTask.conversation_count), 0),
+        )
+        .filter(GenerationTask.job_id == job_id)
+        .group_by(GenerationTask.status)
+        .all()
+    )
+    counts = {status: count for status, count, _ in rows}
+    counts["conversations"] = sum(conversations for _, _, conversations in rows)
+    return counts
+
+
+def create_job(
+    dataset_name: str,
+    api_config_name: str,
+    model_name: str,
+    prompt: str,
+    params: dict,
+    total_requests: int,
+    auto_commit: bool = False,
+) -> int:
+    """创建生成任务及其全部请求记录，返回任务ID"""
+    if not prompt or not prompt.strip():
+        raise ValueError("提示词内容不能为空")
+    if total_requests < 1:
+        raise ValueError("总请求数量必须大于0")
+
+    with session_scope() as session:
+        job = GenerationJob(
+            batch_id=f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}",
+            dataset_name=dataset_name,
+            api_config_name=api_config_name,
+            model_name=model_name,
+            prompt=prompt,
+            params=params,
+            total_requests=total_requests,
+            auto_commit=auto_commit,
+            status=JOB_PENDING,
+            # 使用本地时间，与请求完成时间保持一致
+            created_at=datetime.now(),
+        )
+        session.add(job)
+        session.flush()
+        session.execute(
+            insert(GenerationTask),
+            [
+                {"job_id": job.id, "request_index": i, "status": TASK_PENDING}
+                for i in range(total_requests)
+            ],
+        )
+        logger.info(
+            f"已创建生成任务 {job.batch_id} (ID: {job.id})，共 {total_requests} 个请求"
+        )
+        return job.id
+
+
+def get_job(job_id: int) -> dict:
+    """获取生成任务详情及各状态的请求数量"""
+    with session_scope() as session:
+        job = session.query(GenerationJob).filter_by(id=job_id).first()
+        if not job:
+            return None
+        return _job_to_dict(job, _task_counts(session, job_id))
+
+
+def get_recent_jobs(limit: int = 20) -> list:
+    """获取最近创建的生成任务列表"""
+    with session_scope() as session:
+        jobs = (
+            session.query(GenerationJob)
+            .order_by(GenerationJob.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return [_job_to_dict(job, _task_counts(session, job.id)) for job in jobs]
+
+
+def get_unfinished_job_ids() -> list:
+    """获取尚未完成（等待中或运行中）的任务ID列表"""
+    with session_scope() as session:
+        rows = (
+            session.query(GenerationJob.id)
+            .filter(GenerationJob.status.in_(UNFINISHED_JOB_STATUSES))
+            .order_by(GenerationJob.id)
+            .all()
+        )
+        return [r[0] for r in rows]
+
+
+def start_job(job_id: int) -> tuple:
+    """
+    将任务标记为运行中，并返回 (任务详情, 待执行的请求序号列表)。
+    上次进程退出时仍处于运行中的请求会被重置为待执行。
+    """
+    with session_scope() as session:
+        job = session.query(GenerationJob).filter_by(id=job_id).first()
+        if not job:
+            raise ValueError(f"生成任务 {job_id} 不存在")
+
+        stale = (
+            session.query(GenerationTask)
+            .filter_by(job_id=job_id, status=TASK_RUNNING)
+            .update({"status": TASK_PENDING}, synchronize_session=False)
+        )
+        if stale:
+            logger.info(f"生成任务 {job.batch_id}: 重置 {stale} 个中断的请求")
+
+        job.status = JOB_RUNNING
+        pending = [
+            r[0]
+            for r in session.query(GenerationTask.request_index)
+            .filter_by(job_id=job_id, status=TASK_PENDING)
+            .order_by(GenerationTask.request_index)
+            .all()
+        ]
+        return _job_to_dict(job, _task_counts(session, job_id)), pending
+
+
+def mark_task_running(job_id: int, request_index: int):
+    """记录请求开始执行"""
+    with session_scope() as session:
+        session.query(GenerationTask).filter_by(
+            job_id=job_id, request_index=request_index
+        ).update(
+            {"status": TASK_RUNNING, "started_at": datetime.now()},
+            synchronize_session=False,
+        )
+
+
+def record_task_attempt(job_id: int, request_index: int):
+    """记录一次实际发出的API调用，重试也各计一次"""
+    with session_scope() as session:
+        session.query(GenerationTask).filter_by(
+            job_id=job_id, request_index=request_index
+        ).update(
+            {"attempts": GenerationTask.attempts + 1},
+            synchronize_session=False,
+        )
+
+
+def complete_task(
+    job_id: int,
+    request_index: int,
+    conversations: list,
+    records_to_commit: list = None,
+    dataset_name: str = None,
+):
+    """
+    记录请求成功及其输出。
+    提供 records_to_commit 时，语料写入与请求状态更新在同一个事务中完成，
+    这样恢复任务时既不会重复入库，也不会丢失已生成的语料。
+    """
+    with session_scope() as session:
+        saved = False
+        saved_count = 0
+        if records_to_commit is not None:
+            saved_count = dataset_service.add_corpus_records(
+                session, dataset_name, records_to_commit
+            )
+            saved = True
+        session.query(GenerationTask).filter_by(
+            job_id=job_id, request_index=request_index
+        ).update(
+            {
+                "status": TASK_SUCCEEDED,
+                "output": conversations,
+                "conversation_count": len(conversations),
+                "saved": saved,
+                "saved_count": saved_count,
+                "error": None,
+                "finished_at": datetime.now(),
+            },
+            synchronize_session=False,
+        )
+
+
+def fail_task(job_id: int, request_index: int, error: str):
+    """记录请求失败"""
+    with session_scope() as session:
+        session.query(GenerationTask).filter_by(
+            job_id=job_id, request_index=request_index
+        ).update(
+            {"status": TASK_FAILED, "error": error, "finished_at": datetime.now()},
+            synchronize_session=False,
+        )
+
+
+def finish_job(job_id: int, error: str = None) -> str:
+    """结束任务：所有请求都失败或出现任务级错误时标记为失败，否则标记为完成"""
+    with session_scope() as session:
+        job = session.query(GenerationJob).filter_by(id=job_id).first()
+        counts = _task_counts(session, job_id)
+        if error or (job.total_requests and not counts.get(TASK_SUCCEEDED)):
+            job.status = JOB_FAILED
+        else:
+            job.status = JOB_COMPLETED
+        job.error = error
+        job.finished_at = datetime.now()
+        return job.status
+
+
+def get_task_outputs(
+    job_id: int, unsaved_only: bool = False, latest_requests: int = None
+) -> list:
+    """
+    按请求顺序返回任务中成功请求的对话输出。
+    latest_requests 用于只读取最近完成的若干个请求（例如用于预览）。
+    """
+    with session_scope() as session:
+        query = session.query(GenerationTask.output).filter(
+            GenerationTask.job_id == job_id,
+            GenerationTask.status == TASK_SUCCEEDED,
+        )
+        if unsaved_only:
+            query = query.filter(GenerationTask.saved.isnot(True))
+        if latest_requests:
+            rows = (
+                query.order_by(GenerationTask.finished_at.desc())
+                .limit(latest_requests)
+                .all()
+            )
+            rows.reverse()
+        else:
+            rows = query.order_by(GenerationTask.request_index).all()
+        conversations = []
+        for (output,) in rows:
+            conversations.extend(output or [])
+        return conversations
+
+
+def get_saved_conversation_count(job_id: int) -> int:
+    """返回任务中实际入库的语料数量（不含去重跳过的对话）"""
+    with session_scope() as session:
+        return (
+            session.query(func.coalesce(func.sum(GenerationTask.saved_count), 0))
+            .filter(GenerationTask.job_id == job_id, GenerationTask.saved.is_(True))
+            .scalar()
+        )
+
+
+def save_unsaved_outputs(job_id: int, records_builder) -> int:
+    """
+    将任务中尚未入库的输出在一个事务中写入数据集，并标记为已入库。
+    records_builder 负责把对话列表转换为语料记录。
+    """
+    with session_scope() as session:
+        job = session.query(GenerationJob).filter_by(id=job_id).first()
+        if not job:
+            raise ValueError(f"生成任务 {job_id} 不存在")
+        tasks = (
+            session.query(GenerationTask)
+            .filter(
+                GenerationTask.job_id == job_id,
+                GenerationTask.status == TASK_SUCCEEDED,
+                GenerationTask.saved.isnot(True),
+            )
+            .order_by(GenerationTask.request_index)
+            .all()
+        )
+        saved_count = 0
+        for task in tasks:
+            # 逐个请求写入，记录每个请求实际入库的条数；同一事务中先写入的语料
+            # 也参与后续请求的去重
+            records = records_builder(task.output or [])
+            task.saved_count = (
+                dataset_service.add_corpus_records(session, job.dataset_name, records)
+                if records
+                else 0
+            )
+            task.saved = True
+            saved_count += task.saved_count
+        logger.info(f"生成任务 {job.batch_id}: 入库 {saved_count} 条语料")
+        return saved_count
@@ -0,0 +1,126 @@
+"""
+Background worker that executes persistent generation jobs.
+
+The worker owns one long-lived asyncio event loop running in a daemon thread.
+Jobs are submitted by id and run concurrently on that loop; on start-up the
+worker resumes every job left unfinished by a previous process.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from typing import Dict, Optional
+
+from src.services import generation_job_service, llm_service
+from src.utils import client_pool
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationWorker:
+    """在独立线程的事件循环中执行生成任务"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._futures: Dict[int, concurrent.futures.Future] = {}
+        self._progress: Dict[int, llm_service.JobProgress] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def start(self):
+        """启动后台事件循环，并恢复上次未完成的任务"""
+        with self._lock:
+            if self.is_running:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop, name="generation-worker", daemon=True
+            )
+            self._thread.start()
+            logger.info("生成任务后台执行器已启动")
+        self.resume_unfinished_jobs()
+
+    def resume_unfinished_jobs(self) -> list:
+        """恢复所有等待中或运行中的任务，返回被恢复的任务ID"""
+        job_ids = generation_job_service.get_unfinished_job_ids()
+        for job_id in job_ids:
+            logger.info(f"恢复未完成的生成任务: {job_id}")
+            self.submit(job_id)
+        return job_ids
+
+    def submit(self, job_id: int) -> concurrent.futures.Future:
+        """提交任务到后台事件循环；同一任务正在执行时返回已有的 Future"""
+        if not self.is_running:
+            self.start()
+        with self._lock:
+            future = self._futures.get(job_id)
+            if future is not None and not future.done():
+                return future
+            progress = llm_service.JobProgress(job_id=job_id)
+            self._progress[job_id] = progress
+            future = asyncio.run_coroutine_threadsafe(
+                llm_service.run_generation_job(job_id, progress), self._loop
+            )
+            self._futures[job_id] = future
+            future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+            return future
+
+    def _on_done(self, job_id: int, future: concurrent.futures.Future):
+        with self._lock:
+            if self._futures.get(job_id) is future:
+                del self._futures[job_id]
+        if not future.cancelled() and future.exception():
+            logger.error(f"生成任务 {job_id} 异常结束: {future.exception()}")
+
+    def get_future(self, job_id: int) -> Optional[concurrent.futures.Future]:
+        with self._lock:
+            return self._futures.get(job_id)
+
+    def get_progress(self, job_id: int) -> Optional[llm_service.JobProgress]:
+        """获取任务最近一次运行的实时进度"""
+        with self._lock:
+            return self._progress.get(job_id)
+
+    def stop(self, timeout: float = 10):
+        """停止后台事件循环。未完成的请求会在下次启动时恢复执行。"""
+        with self._lock:
+            if not self.is_running:
+                return
+            loop, thread = self._loop, self._thread
+            futures = list(self._futures.values())
+
+        for future in futures:
+            future.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(
+                client_pool.close_loop_clients(), loop
+            ).result(timeout=timeout)
+        except Exception as e:
+            logger.warning(f"关闭后台执行器的客户端失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=timeout)
+        loop.close()
+        logger.info("生成任务后台执行器已停止")
+
+
+_worker: Optional[GenerationWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_worker() -> GenerationWorker:
+    """获取进程内唯一的后台执行器，首次调用时启动它"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = GenerationWorker()
+    _worker.start()
+    return _worker
@@ -2,18 +2,40 @@ import logging
 import json
 import asyncio
 import aiohttp
+import inspect
+import time
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 from string import Template
 from openai import OpenAI, AsyncOpenAI
 from google import genai
 from pydantic import BaseModel, Field
-from src.services import dataset_service, character_service, api_config_service
+from src.services import (
+    dataset_service,
+    character_service,
+    api_config_service,
+    diversity_service,
+    generation_job_service,
+)
+from src.utils import (
+    client_pool,
+    json_extractor,
+    json_stream,
+    prompt_cache,
+    rate_limiter,
+    retry_policy,
+)
+from src.utils.retry_policy import MalformedOutputError
 import os
 import glob
 
 logger = logging.getLogger(__name__)
 
+# 自动入库模式下，批次中保留用于预览的最近对话数量
+AUTO_COMMIT_PREVIEW_SIZE = 20
+# 实时进度中滚动预览的最近对话数量
+PROGRESS_PREVIEW_SIZE = 10
+
 
 # Pydantic models for structured output
 class DialogueTurn(BaseModel):
@@ -47,10 +69,75 @@ class GenerationBatch(BaseModel):
     completed: int = 0
     failed: int = 0
     results: List[Dict[str, Any]] = []
+    # 自动入库模式：results 只保留写入失败、尚未入库的对话，preview 保留最近生成的对话
+    auto_commit: bool = False
+    saved: int = 0
+    preview: List[Dict[str, Any]] = []
     start_time: datetime
     end_time: Optional[datetime] = None
 
 
+class JobProgress(BaseModel):
+    """
+    生成任务的实时进度。
+    由后台事件循环在每个请求结束时更新，UI线程只读取，用于展示进度、速度和预计剩余时间。
+    """
+
+    job_id: int
+    total_requests: int = 0
+    completed_requests: int = 0
+    failed_requests: int = 0
+    conversations: int = 0
+    # 本次运行中完成的请求数和消耗的token数，用于计算速度（恢复的任务不计入之前的部分）
+    requests_this_run: int = 0
+    tokens_this_run: int = 0
+    started_at: float = Field(default_factory=time.monotonic)
+    status: str = "pending"
+    recent_conversations: List[Dict[str, Any]] = []
+
+    def start(self, job: Dict[str, Any]):
+        self.total_requests = job["total_requests"]
+        self.completed_requests = job["succeeded_requests"]
+        self.failed_requests = job["failed_requests"]
+        self.conversations = job["conversation_count"]
+        self.started_at = time.monotonic()
+        self.status = "running"
+
+    def add_preview(self, conversations: List[Dict[str, Any]]):
+        self.recent_conversations = (self.recent_conversations + conversations)[
+            -PROGRESS_PREVIEW_SIZE:
+        ]
+
+    def record_success(self, conversations: List[Dict[str, Any]], tokens: int):
+        self.completed_requests += 1
+        self.requests_this_run += 1
+        self.conversations += len(conversations)
+        self.tokens_this_run += tokens or 0
+
+    def record_failure(self):
+        self.failed_requests += 1
+        self.requests_this_run += 1
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def tokens_per_second(self) -> float:
+        elapsed = self.elapsed_seconds
+        return self.tokens_this_run / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """按本次运行的平均请求速度估算剩余时间，尚无完成请求时返回 None"""
+        if not self.requests_this_run:
+            return None
+        remaining = max(
+            0, self.total_requests - self.completed_requests - self.failed_requests
+        )
+        return remaining * self.elapsed_seconds / self.requests_this_run
+
+
 def get_prompt_templates() -> List[Dict[str, str]]:
     """获取所有可用的提示词模板文件列表"""
     try:
@@ -97,13 +184,34 @@ def generate_preview_prompt(
 ) -> str:
     """
     Generates the final prompt for LLM based on a dataset and parameters.
+
+    Rendered prompts are cached per dataset id (see src.utils.prompt_cache); a
+    repeated call with unchanged sources only looks up their versions and stats
+    the template file.
     """
     if not dataset_name:
         return "⚠️ 请先选择一个数据集再预览提示词。\n\n📝 使用说明：\n1. 在左侧面板选择一个数据集\n2. 选择合适的提示词模板\n3. 调整对话轮数和生成数量\n4. 点击此按钮预览最终提示词"
 
-    # 1. Get dataset details, which includes linked character and scenarios
     try:
-        dataset = dataset_service.get_dataset_details(dataset_name)
+        # 0. Take the cache key (with source versions) before reading any data
+        cache_generation = prompt_cache.generation()
+        sources = dataset_service.get_prompt_source_versions(dataset_name)
+        if not sources:
+            return f"❌ 错误：未找到数据集 '{dataset_name}'。请检查数据集是否存在。"
+        cache_key = (
+            sources["dataset_id"],
+            conversation_turns,
+            num_to_generate,
+            template_path,
+            prompt_cache.template_stamp(template_path),
+            sources["versions"],
+        )
+        cached_prompt = prompt_cache.get(cache_key)
+        if cached_prompt is not None:
+            return cached_prompt
+
+        # 1. Get dataset details, which includes linked character and scenarios
+        dataset = dataset_service.get_dataset_details_by_id(sources["dataset_id"])
         if not dataset:
             return f"❌ 错误：未找到数据集 '{dataset_name}'。请检查数据集是否存在。"
 
@@ -142,6 +250,16 @@ def generate_preview_prompt(
         }
 
         final_prompt = template.substitute(prompt_data)
+        prompt_cache.put(
+            cache_key,
+            final_prompt,
+            tags=[
+                (prompt_cache.SOURCE_DATASET, sources["dataset_id"]),
+                (prompt_cache.SOURCE_CHARACTER, sources["character_id"]),
+                (prompt_cache.SOURCE_SCENARIO, sources["character_id"]),
+            ],
+            since=cache_generation,
+        )
         return final_prompt
 
     except Exception as e:
@@ -158,12 +276,20 @@ async def call_openai_structured(
     top_p: float = 1.0,
     frequency_penalty: float = 0.5,
     presence_penalty: float = 0.5,
+    stream: bool = False,
+    on_conversation=None,
     **kwargs,
 ) -> Dict[str, Any]:
-    """调用OpenAI API并要求结构化输出"""
+    """
+    调用OpenAI API并要求结构化输出
+
+    stream 为 True 时以流式方式接收响应，每解析出一条完整的对话即调用
+    on_conversation(conversation)。响应被截断或部分损坏时，返回其中完整的对话，
+    并在结果中标记 "truncated"。
+    """
     try:
         logger.debug(prompt)
-        response = await client.chat.completions.create(
+        request = dict(
             model=model,
             messages=[
                 {
@@ -180,38 +306,113 @@ async def call_openai_structured(
             presence_penalty=presence_penalty,
             **kwargs,
         )
+        if stream:
+            return await _consume_openai_stream(client, request, on_conversation)
+
+        response = await client.chat.completions.create(**request)
+
+        usage = {"total_tokens": response.usage.total_tokens} if response.usage else {}
+        content = response.choices[0].message.content
+        if not content:
+            raise MalformedOutputError("响应内容为空", usage)
+        logger.debug(content)
+        return _parse_conversations(
+            content, usage, finish_reason=response.choices[0].finish_reason
+        )
 
-        if response.choices[0].message.content:
-            logger.debug(response.choices[0].message.content)
-            try:
-                content = response.choices[0].message.content
-                clean_string = content.removeprefix("```json\n").removesuffix("\n```")
-                json_content = json.loads(clean_string)  # 直接解析JSON
-                if isinstance(json_content, list):
-                    return {"conversations": json_content}
-                elif isinstance(json_content, dict) and "conversations" in json_content:
-                    return json_content
-                else:
-                    return {"conversations": []}
-            except json.JSONDecodeError:
-                logger.error(
-                    f"无法解析响应为JSON: \n {response.choices[0].message.content}"
-                )
-                return {"conversations": []}
-        else:
-            # Fallback to regular content if parsing fails
-            content = response.choices[0].message.content
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                logger.error(f"无法解析响应为JSON: {content}")
-                return {"conversations": []}
-
+    except MalformedOutputError:
+        raise
     except Exception as e:
         logger.error(f"OpenAI API调用失败: {e}")
         raise
 
 
+def _parse_conversations(
+    content: str, usage: Dict[str, Any] = None, finish_reason: str = None
+) -> Dict[str, Any]:
+    """从响应文本中提取对话列表，必要时修复常见的格式问题"""
+    usage = usage or {}
+    conversations, repairs = json_extractor.extract_conversations(content)
+    if conversations is None:
+        logger.error(f"无法解析响应为JSON: \n {content}")
+        raise MalformedOutputError("无法解析响应为JSON", usage)
+    if repairs:
+        logger.info(
+            f"响应经过修复（finish_reason: {finish_reason}）: {', '.join(sorted(repairs))}，"
+            f"得到 {len(conversations)} 条对话"
+        )
+    result = {"conversations": conversations, "usage": usage}
+    if json_extractor.REPAIR_TRUNCATED in repairs:
+        result["truncated"] = True
+    return result
+
+
+async def _consume_openai_stream(
+    client: AsyncOpenAI, request: Dict[str, Any], on_conversation=None
+) -> Dict[str, Any]:
+    """以流式方式接收响应，边接收边解析对话数组"""
+    think_filter = json_extractor.ThinkTagFilter()
+    parser = json_stream.ConversationStreamParser(
+        repair=json_extractor.repair_json_text
+    )
+    conversations = []
+    # 保留原始文本，流式解析没有得到对话时交给完整解析兜底
+    content_chunks = []
+    usage = {}
+    finish_reason = None
+
+    response_stream = await client.chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **request
+    )
+    async for chunk in response_stream:
+        if chunk.usage:
+            usage = {"total_tokens": chunk.usage.total_tokens}
+        if not chunk.choices:
+            continue
+        choice = chunk.choices[0]
+        finish_reason = choice.finish_reason or finish_reason
+        if not choice.delta or not choice.delta.content:
+            continue
+        content_chunks.append(choice.delta.content)
+        for conversation in parser.feed(think_filter.feed(choice.delta.content)):
+            conversations.append(conversation)
+            if on_conversation:
+                outcome = on_conversation(conversation)
+                if inspect.isawaitable(outcome):
+                    await outcome
+
+    if not conversations:
+        # 流式解析锁定了错误的数组或没有找到数组，用完整解析重新提取一次
+        result = _parse_conversations(
+            "".join(content_chunks), usage, finish_reason=finish_reason
+        )
+        if not result["conversations"]:
+            raise MalformedOutputError("流式响应中没有可解析的对话", usage)
+        if on_conversation:
+            for conversation in result["conversations"]:
+                outcome = on_conversation(conversation)
+                if inspect.isawaitable(outcome):
+                    await outcome
+        return {**result, "truncated": result.get("truncated", False)}
+
+    repairs = set(parser.repairs)
+    if think_filter.found:
+        repairs.add(json_extractor.REPAIR_THINK_TAGS)
+    if parser.truncated:
+        repairs.add(json_extractor.REPAIR_TRUNCATED)
+    json_extractor.record_repairs(repairs, True)
+    if parser.truncated or parser.error_count:
+        logger.warning(
+            f"流式响应不完整（finish_reason: {finish_reason}），恢复 {len(conversations)} 条对话，"
+            f"跳过 {parser.error_count} 条无法解析的对话"
+        )
+    return {
+        "conversations": conversations,
+        "usage": usage,
+        "truncated": parser.truncated,
+    }
+
+
 async def call_google_structured(
     api_key: str,
     prompt: str,
@@ -234,13 +435,10 @@ async def call_google_structured(
             prompt, generation_config=generation_config
         )
 
-        content = response.text
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            logger.error(f"无法解析Google响应为JSON: {content}")
-            return {"conversations": []}
+        return _parse_conversations(response.text)
 
+    except MalformedOutputError:
+        raise
     except Exception as e:
         logger.error(f"Google AI API调用失败: {e}")
         raise
@@ -255,170 +453,350 @@ async def generate_single_batch(
     top_p: float,
     frequency_penalty: float,
     presence_penalty: float,
+    retry: retry_policy.RetryPolicy = None,
+    circuit_breaker: retry_policy.CircuitBreaker = None,
+    stream: bool = False,
+    on_conversation=None,
+    on_attempt=None,
 ) -> Dict[str, Any]:
-    """生成单个批次的对话"""
+    """
+    生成单个批次的对话。
+
+    请求失败时按 retry 策略分类重试；传入 circuit_breaker 时，同一任务的所有请求
+    共享它，错误率过高时整个任务暂停。stream 为 True 时（仅 OpenAI）流式接收响应，
+    每条对话解析完成即调用 on_conversation。每次实际发出请求（包括重试）前
+    调用 on_attempt，它可以是协程函数。
+    """
     api_type = api_config["api_type"]
     api_key = api_config["api_key"]
     base_url = api_config.get("base_url")
 
-    if api_type == "OpenAI":
-        client = AsyncOpenAI(
-            api_key=api_key.strip(), base_url=base_url.strip() if base_url else None
-        )
-        return await call_openai_structured(
-            client,
-            prompt,
-            model,
-            temperature,
-            max_tokens,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty,
+    if api_type not in ("OpenAI", "Google"):
+        raise ValueError(f"不支持的API类型: {api_type}")
+
+    # 按API配置共享的 RPM/TPM 限流，token 消耗按提示词长度 + max_tokens 预估
+    limiter = rate_limiter.get_rate_limiter(
+        api_config["name"], api_config.get("rpm_limit"), api_config.get("tpm_limit")
+    )
+
+    async def attempt() -> Dict[str, Any]:
+        # 每次重试都是一次真实请求，需要重新申请限流额度
+        reserved_tokens = await limiter.acquire(
+            rate_limiter.estimate_tokens(prompt) + max_tokens
         )
-    elif api_type == "Google":
-        return await call_google_structured(
-            api_key, prompt, model, temperature, max_tokens
+        usage = {}
+        try:
+            if on_attempt:
+                outcome = on_attempt()
+                if inspect.isawaitable(outcome):
+                    await outcome
+            if api_type == "OpenAI":
+                client = client_pool.get_async_client(api_key, base_url)
+                result = await call_openai_structured(
+                    client,
+                    prompt,
+                    model,
+                    temperature,
+                    max_tokens,
+                    top_p=top_p,
+                    frequency_penalty=frequency_penalty,
+                    presence_penalty=presence_penalty,
+                    stream=stream,
+                    on_conversation=on_conversation,
+                )
+            else:
+                result = await call_google_structured(
+                    api_key, prompt, model, temperature, max_tokens
+                )
+            usage = result.get("usage") or {}
+            return result
+        except MalformedOutputError as e:
+            usage = e.usage
+            raise
+        finally:
+            limiter.settle(reserved_tokens, usage.get("total_tokens"))
+
+    return await (retry or retry_policy.RetryPolicy()).run(attempt, circuit_breaker)
+
+
+async def _create_topic_steering(
+    dataset_id: int, avoid_topics: int
+) -> Optional[diversity_service.TopicSteering]:
+    """创建避免重复话题的引导器，avoid_topics 为 0 或创建失败时返回 None"""
+    if not avoid_topics:
+        return None
+    try:
+        return await asyncio.to_thread(
+            diversity_service.TopicSteering.for_dataset, dataset_id, avoid_topics
         )
-    else:
-        raise ValueError(f"不支持的API类型: {api_type}")
+    except Exception as e:
+        logger.warning(f"话题引导初始化失败，按原提示词生成: {e}")
+        return None
 
 
-async def generate_corpus_batch(
-    dataset_name: str,
-    api_config_name: str,
-    model_name: str,
-    num_to_generate: int,
-    conversation_turns: int,
-    total_requests: int,
+async def run_bounded_requests(
+    request_indices,
+    request_fn,
+    on_request_done,
     max_parallel_requests: int,
-    batch_cooldown_seconds: int,
-    temperature: float = 0.7,
-    max_tokens: int = 8096,
-    top_p: float = 1.0,
-    frequency_penalty: float = 0.5,
-    presence_penalty: float = 0.5,
-    prompt_content: str = None,
-    progress_callback=None,
-) -> GenerationBatch:
-    """异步批量生成语料数据"""
-
-    # 获取API配置
-    api_config = api_config_service.get_api_config_by_name(api_config_name)
-    if not api_config:
-        raise ValueError(f"API配置 '{api_config_name}' 不存在")
+    cooldown_seconds: float,
+    circuit_breaker: retry_policy.CircuitBreaker = None,
+):
+    """
+    以固定大小的工作池执行请求，始终保持最多 max_parallel_requests 个请求在途。
+
+    - 任一请求完成后立即由空闲的 worker 领取下一个请求，不做额外等待。
+    - 请求在重试后仍被限流 (HTTP 429) 时，暂停派发新请求 cooldown_seconds 秒；
+      重试只由 request_fn 内的 RetryPolicy 负责，失败的请求不会重新入队。
+    - 传入 circuit_breaker 时，熔断器断开期间不派发新请求。
+    - 每个请求结束时调用 on_request_done(index, result)，失败时 result 为异常对象；
+      on_request_done 可以是协程函数，此时 worker 会等待其完成后再领取下一个请求。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for request_index in request_indices:
+        queue.put_nowait(request_index)
+
+    dispatch_open = asyncio.Event()
+    dispatch_open.set()
+
+    async def cooldown():
+        if not dispatch_open.is_set():
+            return
+        logger.warning(f"服务商触发限流，暂停派发新请求 {cooldown_seconds} 秒")
+        dispatch_open.clear()
+        try:
+            await asyncio.sleep(cooldown_seconds)
+        finally:
+            dispatch_open.set()
 
-    # 获取数据集信息
-    dataset = dataset_service.get_dataset_details(dataset_name)
-    if not dataset:
-        raise ValueError(f"数据集 '{dataset_name}' 不存在")
+    async def worker():
+        while True:
+            try:
+                request_index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await dispatch_open.wait()
+            if circuit_breaker:
+                await circuit_breaker.wait_closed()
+            try:
+                result = await request_fn(request_index)
+            except Exception as e:
+                if retry_policy.classify_error(e) == retry_policy.ERROR_THROTTLE:
+                    await cooldown()
+                result = e
+            outcome = on_request_done(request_index, result)
+            if inspect.isawaitable(outcome):
+                await outcome
+
+    worker_count = max(1, min(int(max_parallel_requests), queue.qsize()))
+    await asyncio.gather(*(worker() for _ in range(worker_count)))
+
+
+def to_corpus_record(
+    conversation: Dict[str, Any], batch_id: str, generation_time: str
+) -> dict:
+    """将一条生成的对话转换为 batch_save_corpus_to_dataset 所需的格式"""
+    return {
+        "scenarios": conversation.get("scenarios", []),
+        "dialogues": [
+            {
+                "role": turn.get("role", "user"),
+                "content": turn.get("content", ""),
+            }
+            for turn in conversation.get("dialogues", [])
+        ],
+        "batch_id": batch_id,
+        "generation_time": generation_time,
+    }
+
+
+def build_corpus_records(
+    conversations: List[Dict[str, Any]], batch_id: str, generation_time: str
+) -> List[dict]:
+    """批量转换生成的对话，格式无效的对话会被记录并跳过"""
+    records = []
+    for conversation in conversations:
+        try:
+            records.append(to_corpus_record(conversation, batch_id, generation_time))
+        except Exception as e:
+            logger.error(f"保存对话失败: {e}")
+    return records
 
-    # 验证提示词内容
-    if not prompt_content or prompt_content.strip() == "":
-        raise ValueError("提示词内容不能为空")
 
-    # 使用传入的提示词内容
-    base_prompt = prompt_content
+async def run_generation_job(job_id: int, progress: JobProgress = None) -> str:
+    """
+    执行（或恢复）一个持久化的生成任务，返回任务的最终状态。
 
-    # 创建批次信息
-    batch = GenerationBatch(
-        batch_id=f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-        dataset_name=dataset_name,
-        character_name=dataset.get("character_name", ""),
-        scenario_names=[s["name"] for s in dataset.get("scenario_objects", [])],
-        total_requested=total_requests * num_to_generate,
-        start_time=datetime.now(),
+    只会发送尚未成功的请求；每个请求结束后立即记录其状态、尝试次数和输出，
+    自动入库模式下语料与请求状态在同一个事务中写入。
+    传入 progress 时会实时更新其中的进度信息。
+    """
+    progress = progress or JobProgress(job_id=job_id)
+    job, pending_indices = await asyncio.to_thread(
+        generation_job_service.start_job, job_id
     )
+    progress.start(job)
+    batch_id = job["batch_id"]
+    generation_time = (job["created_at"] or datetime.now()).isoformat()
+    params = job["params"]
 
-    # 创建任务列表
-    tasks = []
-    for i in range(total_requests):
-        task = generate_single_batch(
-            api_config=api_config,
-            prompt=base_prompt,
-            model=model_name,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty,
+    api_config = await asyncio.to_thread(
+        api_config_service.get_api_config_by_name, job["api_config_name"]
+    )
+    if not api_config:
+        error = f"API配置 '{job['api_config_name']}' 不存在"
+        logger.error(f"生成任务 {batch_id} 无法执行: {error}")
+        progress.status = await asyncio.to_thread(
+            generation_job_service.finish_job, job_id, error
         )
-        await asyncio.sleep(1)  # 防止请求过于频繁
-        tasks.append(task)
-        logger.info(f"生成任务 {i+1} 已添加: 请求生成{num_to_generate} 条语料")
-        if i % max_parallel_requests == 0:
-            await asyncio.sleep(batch_cooldown_seconds)
+        return progress.status
 
     logger.info(
-        f"开始并行生成 {len(tasks)} 个批次，每次请求生成 {num_to_generate} 条对话，最大并行请求数 {max_parallel_requests}，\
-            冷却时间 {batch_cooldown_seconds} 秒，总请求数量 {total_requests}"
+        f"开始执行生成任务 {batch_id}: 待执行 {len(pending_indices)}/{job['total_requests']} 个请求"
     )
 
-    # 并行执行所有任务
-    try:
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+    circuit_breaker = retry_policy.CircuitBreaker()
+    stream = params.get("stream", False)
+    steering = None
+    if params.get("avoid_topics"):
+        dataset = await asyncio.to_thread(
+            dataset_service.get_dataset_details, job["dataset_name"]
+        )
+        if dataset:
+            steering = await _create_topic_steering(
+                dataset["id"], params["avoid_topics"]
+            )
+
+    async def run_request(request_index: int) -> Dict[str, Any]:
+        await asyncio.to_thread(
+            generation_job_service.mark_task_running, job_id, request_index
+        )
+        return await generate_single_batch(
+            api_config=api_config,
+            prompt=job["prompt"] + (steering.prompt_suffix() if steering else ""),
+            model=job["model_name"],
+            temperature=params.get("temperature", 0.7),
+            max_tokens=params.get("max_tokens", 8096),
+            top_p=params.get("top_p", 1.0),
+            frequency_penalty=params.get("frequency_penalty", 0.5),
+            presence_penalty=params.get("presence_penalty", 0.5),
+            circuit_breaker=circuit_breaker,
+            stream=stream,
+            # 流式模式下每条对话解析完成即进入实时预览
+            on_conversation=(
+                (lambda conversation: progress.add_preview([conversation]))
+                if stream
+                else None
+            ),
+            on_attempt=lambda: asyncio.to_thread(
+                generation_job_service.record_task_attempt, job_id, request_index
+            ),
+        )
 
-        # 处理结果
-        for i, result in enumerate(results):
+    async def on_request_done(request_index: int, result: Any):
+        try:
             if isinstance(result, Exception):
-                logger.error(f"批次 {i+1} 生成失败: {result}")
-                batch.failed += 1
-                if progress_callback:
-                    progress_callback(f"批次 {i+1} 失败: {str(result)}")
-            else:
-                conversations = result.get("conversations", [])
-                batch.results.extend(conversations)
-                batch.completed += len(conversations)
-                logger.info(f"批次 {i+1} 成功生成 {len(conversations)} 条对话")
-                if progress_callback:
-                    progress_callback(
-                        f"批次 {i+1} 完成，生成 {len(conversations)} 条对话"
-                    )
+                logger.error(f"任务 {batch_id} 请求 {request_index+1} 失败: {result}")
+                await asyncio.to_thread(
+                    generation_job_service.fail_task,
+                    job_id,
+                    request_index,
+                    str(result),
+                )
+                progress.record_failure()
+                return
+
+            conversations = result.get("conversations", [])
+            records = (
+                build_corpus_records(conversations, batch_id, generation_time)
+                if job["auto_commit"]
+                else None
+            )
+            await asyncio.to_thread(
+                generation_job_service.complete_task,
+                job_id,
+                request_index,
+                conversations,
+                records,
+                job["dataset_name"],
+            )
+            if not stream:
+                progress.add_preview(conversations)
+            if steering:
+                await asyncio.to_thread(steering.add, conversations)
+            progress.record_success(
+                conversations, (result.get("usage") or {}).get("total_tokens")
+            )
+        except Exception as e:
+            logger.error(f"记录任务 {batch_id} 请求 {request_index+1} 结果失败: {e}")
+            await asyncio.to_thread(
+                generation_job_service.fail_task, job_id, request_index, str(e)
+            )
+            progress.record_failure()
 
+    error = None
+    try:
+        await run_bounded_requests(
+            request_indices=pending_indices,
+            request_fn=run_request,
+            on_request_done=on_request_done,
+            max_parallel_requests=params.get("max_parallel_requests", 1),
+            cooldown_seconds=params.get("batch_cooldown_seconds", 5),
+            circuit_breaker=circuit_breaker,
+        )
     except Exception as e:
-        logger.error(f"批量生成过程中出现错误: {e}")
-        batch.failed = len(tasks)
-        if progress_callback:
-            progress_callback(f"生成失败: {str(e)}")
+        logger.error(f"生成任务 {batch_id} 执行出错: {e}")
+        error = str(e)
 
-    batch.end_time = datetime.now()
-    total_time = (batch.end_time - batch.start_time).total_seconds()
-    logger.info(
-        f"批次 {batch.batch_id} 完成: 成功 {batch.completed}/{batch.total_requested}，用时 {total_time:.2f}秒"
+    progress.status = await asyncio.to_thread(
+        generation_job_service.finish_job, job_id, error
     )
+    logger.info(f"生成任务 {batch_id} 结束，状态: {progress.status}")
+    return progress.status
 
-    return batch
 
+def load_job_batch(job_id: int) -> GenerationBatch:
+    """根据持久化的生成任务构建批次信息，用于结果预览和入库"""
+    job = generation_job_service.get_job(job_id)
+    if not job:
+        raise ValueError(f"生成任务 {job_id} 不存在")
 
-def save_generation_results(batch: GenerationBatch, dataset_name: str) -> int:
-    """将生成结果保存到数据库"""
-    from src.services.dataset_service import save_corpus_to_dataset
-
-    saved_count = 0
-    for conversation in batch.results:
-        try:
-            # 转换为所需格式
-            dialogue_data = {
-                "scenario_labels": conversation.get("scenarios", []),
-                "dialogues": [
-                    {
-                        "role": turn.get("role", "user"),
-                        "content": turn.get("content", ""),
-                    }
-                    for turn in conversation.get("dialogues", [])
-                ],
-                "turn_count": len(conversation.get("dialogues", [])) // 2,
-                "batch_id": batch.batch_id,
-                "generation_time": batch.start_time.isoformat(),
-            }
-
-            scenario_names = conversation.get("scenarios", [])
-            save_corpus_to_dataset(dataset_name, dialogue_data, scenario_names)
-            saved_count += 1
+    dataset = dataset_service.get_dataset_details(job["dataset_name"]) or {}
+    batch = GenerationBatch(
+        batch_id=job["batch_id"],
+        dataset_name=job["dataset_name"],
+        character_name=dataset.get("character_name") or "",
+        scenario_names=[s["name"] for s in dataset.get("scenario_objects", [])],
+        total_requested=job["total_requests"] * job["params"].get("num_to_generate", 0),
+        completed=job["conversation_count"],
+        failed=job["failed_requests"],
+        auto_commit=job["auto_commit"],
+        start_time=job["created_at"] or datetime.now(),
+        end_time=job["finished_at"],
+    )
+    if job["auto_commit"]:
+        batch.results = generation_job_service.get_task_outputs(
+            job_id, unsaved_only=True
+        )
+        batch.saved = generation_job_service.get_saved_conversation_count(job_id)
+        batch.preview = generation_job_service.get_task_outputs(
+            job_id, latest_requests=AUTO_COMMIT_PREVIEW_SIZE
+        )[-AUTO_COMMIT_PREVIEW_SIZE:]
+    else:
+        batch.results = generation_job_service.get_task_outputs(job_id)
+        batch.saved = generation_job_service.get_saved_conversation_count(job_id)
+    return batch
 
-        except Exception as e:
-            logger.error(f"保存对话失败: {e}")
 
-    logger.info(
-        f"成功保存 {saved_count}/{len(batch.results)} 条对话到数据集 '{dataset_name}'"
+def save_job_results(job_id: int) -> int:
+    """将生成任务中尚未入库的结果保存到数据集，已入库的请求不会重复保存"""
+    job = generation_job_service.get_job(job_id)
+    if not job:
+        raise ValueError(f"生成任务 {job_id} 不存在")
+    generation_time = (job["created_at"] or datetime.now()).isoformat()
+    return generation_job_service.save_unsaved_outputs(
+        job_id,
+        lambda conversations: build_corpus_records(
+            conversations, job["batch_id"], generation_time
+        ),
     )
-    return saved_count
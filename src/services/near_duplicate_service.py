@@ -0,0 +1,196 @@
+"""
+Near-duplicate detection over a dataset's corpus.
+
+Every corpus row gets a MinHash signature of its assistant turns in the
+corpus_minhash table: the corpus insert path in dataset_service writes it in
+the same transaction, and rows stored before the table existed are signed
+lazily by index_missing_signatures() on the next search. A search loads the
+dataset's signatures into one numpy array, finds similar pairs with LSH
+banding and merges them into clusters (see src.utils.minhash).
+"""
+
+import logging
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Text, exists, func, insert, select, type_coerce
+
+from src.database.database_manager import DatabaseManager
+from src.models.data_models import Corpus, CorpusMinHash
+from src.utils import minhash
+
+logger = logging.getLogger(__name__)
+
+db_manager = DatabaseManager()
+
+# 补建签名与读取签名时每批处理的语料条数
+INDEX_BATCH_SIZE = 1000
+# 默认的估计 Jaccard 相似度阈值
+DEFAULT_THRESHOLD = 0.6
+# 附带示例文本的簇数量与示例长度
+SAMPLE_CLUSTERS = 20
+SAMPLE_LENGTH = 100
+
+
+def signature_row(corpus_id: int, dataset_id: int, dialogue_data) -> dict:
+    """构造一条 corpus_minhash 行"""
+    return {
+        "corpus_id": corpus_id,
+        "dataset_id": dataset_id,
+        "signature": minhash.signature(dialogue_data),
+    }
+
+
+def index_missing_signatures(dataset_id: int) -> int:
+    """为数据集中尚无签名的语料计算签名，每批提交一次，返回新建的签名数量"""
+    session = db_manager.get_session()
+    indexed = 0
+    try:
+        last_id = 0
+        while True:
+            rows = session.execute(
+                select(Corpus.id, type_coerce(Corpus.dialogue, Text))
+                .where(
+                    Corpus.dataset_id == dataset_id,
+                    Corpus.id > last_id,
+                    ~exists().where(CorpusMinHash.corpus_id == Corpus.id),
+                )
+                .order_by(Corpus.id)
+                .limit(INDEX_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            session.execute(
+                insert(CorpusMinHash),
+                [
+                    signature_row(corpus_id, dataset_id, raw_dialogue)
+                    for corpus_id, raw_dialogue in rows
+                ],
+            )
+            session.commit()
+            indexed += len(rows)
+            last_id = rows[-1][0]
+        if indexed:
+            logger.info(f"数据集 {dataset_id}: 补建 {indexed} 条语料的 MinHash 签名")
+        return indexed
+    except Exception as e:
+        session.rollback()
+        logger.error(f"补建 MinHash 签名失败: {e}")
+        raise
+    finally:
+        session.close()
+
+
+def _load_signatures(session, dataset_id: int):
+    """按语料ID顺序读取数据集的全部签名，返回 (corpus_ids, signatures)"""
+    count = session.scalar(
+        select(func.count())
+        .select_from(CorpusMinHash)
+        .where(
+            CorpusMinHash.dataset_id == dataset_id,
+            CorpusMinHash.signature.isnot(None),
+        )
+    )
+    corpus_ids = np.empty(count, dtype=np.int64)
+    signatures = np.empty((count, minhash.NUM_PERM), dtype=minhash.SIGNATURE_DTYPE)
+    result = session.execute(
+        select(CorpusMinHash.corpus_id, CorpusMinHash.signature)
+        .where(
+            CorpusMinHash.dataset_id == dataset_id,
+            CorpusMinHash.signature.isnot(None),
+        )
+        .order_by(CorpusMinHash.corpus_id)
+        .execution_options(yield_per=INDEX_BATCH_SIZE)
+    )
+    filled = 0
+    for rows in result.partitions():
+        # 读取期间有新写入时只取开始时统计到的行数
+        rows = rows[: count - filled]
+        if not rows:
+            break
+        end = filled + len(rows)
+        corpus_ids[filled:end] = [row[0] for row in rows]
+        signatures[filled:end] = minhash.signatures_to_array([row[1] for row in rows])
+        filled = end
+    return corpus_ids[:filled], signatures[:filled]
+
+
+def _assistant_samples(session, corpus_ids: list) -> dict:
+    if not corpus_ids:
+        return {}
+    rows = session.execute(
+        select(Corpus.id, type_coerce(Corpus.dialogue, Text)).where(
+            Corpus.id.in_(corpus_ids)
+        )
+    )
+    return {
+        corpus_id: minhash.assistant_text(raw_dialogue)[:SAMPLE_LENGTH]
+        for corpus_id, raw_dialogue in rows
+    }
+
+
+def find_near_duplicates(dataset_id: int, threshold: Optional[float] = None) -> dict:
+    """
+    查找数据集中 assistant 回复高度相似的语料簇。
+
+    Returns:
+        {
+            "total_checked": int,      # 参与比较的语料数量
+            "duplicate_count": int,    # 各簇 duplicate_ids 的总数
+            "clusters": [{"corpus_ids": [...], "keep_id": int,
+                          "duplicate_ids": [...], "similarity": float,
+                          "sample": str}, ...],
+        }
+        簇按大小降序排列，keep_id 为簇内最早写入（ID最小）的语料，
+        similarity 为簇内相似对的最高估计 Jaccard 相似度，
+        仅前 SAMPLE_CLUSTERS 个簇附带 sample。
+        簇经由相似对传递形成，duplicate_ids 只包含与 keep_id 本身的估计相似度
+        达到阈值的语料，删除时只删除这些语料。
+    """
+    threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+    index_missing_signatures(dataset_id)
+
+    session = db_manager.get_read_session()
+    try:
+        corpus_ids, signatures = _load_signatures(session, dataset_id)
+        left, right, similarity = minhash.find_similar_pairs(signatures, threshold)
+        clusters = minhash.cluster_pairs(len(corpus_ids), left, right)
+
+        best_similarity = {}
+        for a, b, value in zip(left.tolist(), right.tolist(), similarity.tolist()):
+            for i in (a, b):
+                best_similarity[i] = max(best_similarity.get(i, 0.0), value)
+
+        result_clusters = []
+        for members in clusters:
+            to_keep = minhash.similarity_to(signatures, members[1:], members[0])
+            result_clusters.append(
+                {
+                    "corpus_ids": corpus_ids[members].tolist(),
+                    "keep_id": int(corpus_ids[members[0]]),
+                    "duplicate_ids": corpus_ids[members[1:]][
+                        to_keep >= threshold
+                    ].tolist(),
+                    "similarity": max(best_similarity[i] for i in members),
+                }
+            )
+        result_clusters.sort(key=lambda c: (-len(c["corpus_ids"]), c["keep_id"]))
+
+        samples = _assistant_samples(
+            session, [c["keep_id"] for c in result_clusters[:SAMPLE_CLUSTERS]]
+        )
+        for cluster in result_clusters[:SAMPLE_CLUSTERS]:
+            cluster["sample"] = samples.get(cluster["keep_id"], "")
+    finally:
+        session.close()
+
+    duplicate_count = sum(len(c["duplicate_ids"]) for c in result_clusters)
+    logger.info(
+        f"数据集 {dataset_id}: 比较 {len(corpus_ids)} 条语料，"
+        f"发现 {len(result_clusters)} 个近似重复簇，共 {duplicate_count} 条可删除"
+    )
+    return {
+        "total_checked": len(corpus_ids),
+        "duplicate_count": duplicate_count,
+        "clusters": result_clusters,
+    }
@@ -5,6 +5,7 @@ import os
 from datetime import datetime
 from src.database.database_manager import DatabaseManager
 from src.models.data_models import Scenario, Character
+from src.utils import prompt_cache
 
 logger = logging.getLogger(__name__)
 
@@ -58,6 +59,7 @@ def get_scenarios_for_display_by_character(character_id: int):
         return scenarios if scenarios else []
 
 
+@prompt_cache.invalidates(prompt_cache.SOURCE_SCENARIO, "character_id")
 def save_scenario(
     character_id: int,
     original_name: str = None,
@@ -104,6 +106,7 @@ def save_scenario(
         return True
 
 
+@prompt_cache.invalidates(prompt_cache.SOURCE_SCENARIO, "character_id")
 def delete_scenario_by_name(character_id: int, name: str):
     """通过名称删除指定角色的场景"""
     if not character_id:
@@ -149,6 +152,7 @@ def export_scenarios_to_json(character_id: int):
     return file_path
 
 
+@prompt_cache.invalidates(prompt_cache.SOURCE_SCENARIO, "character_id")
 def import_scenarios_from_json(character_id: int, file_path: str):
     """从JSON文件为指定角色导入场景。"""
     if not character_id:
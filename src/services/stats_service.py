@@ -0,0 +1,214 @@
+"""
+Materialized per-dataset corpus statistics.
+
+The dataset_stats table holds each dataset's corpus count, total characters,
+per-scenario counts and a histogram of dialogue round counts. The corpus
+insert and delete paths in dataset_service build a StatsDelta for the rows
+they write and apply it in the same transaction, after the corpus statement
+has taken SQLite's write lock, so reading the stats is a single primary-key
+lookup. Applying a delta also increments datasets.corpus_version, a change
+counter that caches of per-dataset corpus results are keyed on. rebuild_dataset_stats() recomputes a dataset from the materialized
+corpus turn_count/char_count columns to repair drift. Per-role statistics
+are aggregated directly from the dialogue_turns table.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, delete, func, select, text
+
+from src.database.database_manager import DatabaseManager
+from src.models.data_models import (
+    Corpus,
+    Dataset,
+    DatasetStats,
+    DialogueTurn,
+    Scenario,
+    corpus_scenarios_association,
+)
+
+logger = logging.getLogger(__name__)
+
+db_manager = DatabaseManager()
+
+# 重建统计时每批读取的语料条数
+REBUILD_FETCH_SIZE = 1000
+
+
+class StatsDelta:
+    """一批语料写入或删除对各数据集统计的增量"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.chars = Counter()
+        self.scenarios: Dict[int, Counter] = defaultdict(Counter)
+        self.turns: Dict[int, Counter] = defaultdict(Counter)
+
+    def add(
+        self,
+        dataset_id: int,
+        turn_count: int,
+        char_count: int,
+        scenario_ids: Iterable[int],
+        sign=1,
+    ):
+        """计入一条语料，sign 为 -1 时表示删除"""
+        self.counts[dataset_id] += sign
+        self.chars[dataset_id] += sign * (char_count or 0)
+        # 直方图按对话轮数统计，与 dialogue_data["turn_count"] 的计算方式一致
+        self.turns[dataset_id][str((turn_count or 0) // 2)] += sign
+        for scenario_id in scenario_ids:
+            self.scenarios[dataset_id][str(scenario_id)] += sign
+
+    def __bool__(self):
+        return bool(self.counts)
+
+
+def _merge_counts(current: dict, delta: Counter) -> dict:
+    merged = Counter(current or {})
+    merged.update(delta)
+    # 计数归零的键不再保留
+    return {key: count for key, count in merged.items() if count > 0}
+
+
+def apply_stats_delta(session, delta: StatsDelta):
+    """
+    在调用方的事务中把增量写入 dataset_stats，不提交事务。
+    必须在语料的 INSERT/DELETE 之后调用，此时事务已持有写锁，
+    读取-修改-写入不会与其他写入交错。
+    同时递增受影响数据集的 corpus_version（不经过 ORM，不会改动 updated_at）。
+    """
+    if delta:
+        session.execute(
+            text(
+                "UPDATE datasets SET corpus_version = corpus_version + 1 "
+                "WHERE id IN :dataset_ids"
+            ).bindparams(bindparam("dataset_ids", expanding=True)),
+            {"dataset_ids": list(delta.counts)},
+        )
+    for dataset_id, count in delta.counts.items():
+        stats = session.get(DatasetStats, dataset_id)
+        if stats is None:
+            # 还没有统计的数据集直接重建，避免在不完整的基础上累加
+            _rebuild(session, dataset_id)
+            continue
+        stats.total_count = max(0, stats.total_count + count)
+        stats.total_chars = max(0, stats.total_chars + delta.chars[dataset_id])
+        stats.scenario_counts = _merge_counts(
+            stats.scenario_counts, delta.scenarios[dataset_id]
+        )
+        stats.turn_histogram = _merge_counts(
+            stats.turn_histogram, delta.turns[dataset_id]
+        )
+
+
+def _rebuild(session, dataset_id: int) -> DatasetStats:
+    delta = StatsDelta()
+    result = session.execute(
+        select(Corpus.id, Corpus.turn_count, Corpus.char_count)
+        .where(Corpus.dataset_id == dataset_id)
+        .execution_options(yield_per=REBUILD_FETCH_SIZE)
+    )
+    for rows in result.partitions():
+        scenario_ids = defaultdict(list)
+        for corpus_id, scenario_id in session.execute(
+            select(
+                corpus_scenarios_association.c.corpus_id,
+                corpus_scenarios_association.c.scenario_id,
+            ).where(
+                corpus_scenarios_association.c.corpus_id.in_([row[0] for row in rows])
+            )
+        ):
+            scenario_ids[corpus_id].append(scenario_id)
+        for corpus_id, turn_count, char_count in rows:
+            delta.add(dataset_id, turn_count, char_count, scenario_ids[corpus_id])
+
+    stats = session.get(DatasetStats, dataset_id)
+    if stats is None:
+        stats = DatasetStats(dataset_id=dataset_id)
+        session.add(stats)
+    stats.total_count = delta.counts[dataset_id]
+    stats.total_chars = delta.chars[dataset_id]
+    stats.scenario_counts = _merge_counts({}, delta.scenarios[dataset_id])
+    stats.turn_histogram = _merge_counts({}, delta.turns[dataset_id])
+    return stats
+
+
+def rebuild_dataset_stats(dataset_id: Optional[int] = None) -> int:
+    """从语料表重新计算数据集（为None时为所有数据集）的统计，返回重建的数据集数量"""
+    session = db_manager.get_session()
+    try:
+        if dataset_id:
+            dataset_ids = [dataset_id]
+        else:
+            dataset_ids = [id_ for (id_,) in session.query(Dataset.id)]
+        for id_ in dataset_ids:
+            # 先写入再读取：DELETE 让事务立即取得写锁，重建期间不会有新语料写入
+            session.execute(delete(DatasetStats).where(DatasetStats.dataset_id == id_))
+            _rebuild(session, id_)
+            session.commit()
+        logger.info(f"已重建 {len(dataset_ids)} 个数据集的统计")
+        return len(dataset_ids)
+    except Exception as e:
+        session.rollback()
+        logger.error(f"重建数据集统计失败: {e}")
+        raise
+    finally:
+        session.close()
+
+
+def get_stats(dataset_id: int) -> Optional[dict]:
+    """读取数据集的统计，尚无统计记录时返回 None"""
+    session = db_manager.get_read_session()
+    try:
+        stats = session.get(DatasetStats, dataset_id)
+        if stats is None:
+            return None
+        scenario_counts = {int(k): v for k, v in stats.scenario_counts.items()}
+        names = dict(
+            session.query(Scenario.id, Scenario.name).filter(
+                Scenario.id.in_(scenario_counts)
+            )
+        )
+        return {
+            "total_corpus_count": stats.total_count,
+            "total_chars": stats.total_chars,
+            # 已删除的场景不再显示
+            "scenario_counts": {
+                names[scenario_id]: count
+                for scenario_id, count in sorted(scenario_counts.items())
+                if scenario_id in names
+            },
+            "turn_histogram": {
+                int(turns): count
+                for turns, count in sorted(
+                    stats.turn_histogram.items(), key=lambda item: int(item[0])
+                )
+            },
+        }
+    finally:
+        session.close()
+
+
+def get_role_stats(dataset_id: int) -> Dict[str, dict]:
+    """按角色汇总数据集的消息条数与字符数，返回 {role: {"turns": int, "chars": int}}"""
+    session = db_manager.get_read_session()
+    try:
+        rows = session.execute(
+            select(
+                DialogueTurn.role,
+                func.count(),
+                func.total(func.length(DialogueTurn.content)),
+            )
+            .join(Corpus, Corpus.id == DialogueTurn.corpus_id)
+            .where(Corpus.dataset_id == dataset_id)
+            .group_by(DialogueTurn.role)
+            .order_by(func.count().desc())
+        ).all()
+        return {
+            role if role is not None else "": {"turns": turns, "chars": int(chars)}
+            for role, turns, chars in rows
+        }
+    finally:
+        session.close()
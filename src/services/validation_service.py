@@ -0,0 +1,205 @@
+"""
+Validation of stored corpus dialogues.
+
+Structural checks run inside SQLite: json_valid/json_type/json_each select
+only the rows whose dialogue is not a {"dialogues": [...]} object made of
+{"role": <non-empty string>, "content": <string>} turns. Only those suspect
+rows are streamed back, in chunks, and inspected in Python to describe each
+issue. Results are cached per dataset together with its corpus_version, a
+counter incremented by every corpus insert and delete, so a clean right
+after a detect reuses the detect result. find_suspect_ids() re-checks a
+given set of rows, so a clean never deletes by a stale report alone.
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+
+from src.database.database_manager import DatabaseManager
+from src.models.data_models import Dataset
+
+logger = logging.getLogger(__name__)
+
+db_manager = DatabaseManager()
+
+# 每批从数据库取回的可疑语料条数
+VALIDATION_CHUNK_SIZE = 1000
+
+# 对话结构不合规范的语料：无法解析、缺少 dialogues 数组，或存在不合规的对话回合。
+# CASE 保证只对合法 JSON 调用 json_each，避免整条查询因格式错误的行而失败。
+_SUSPECT_CONDITION = """
+CASE
+    WHEN NOT json_valid(c.dialogue) THEN 1
+    WHEN json_type(c.dialogue, '$.dialogues') IS NOT 'array' THEN 1
+    ELSE EXISTS (
+        SELECT 1 FROM json_each(c.dialogue, '$.dialogues') AS turn
+        WHERE turn.type IS NOT 'object'
+            OR json_type(turn.value, '$.role') IS NOT 'text'
+            OR json_extract(turn.value, '$.role') = ''
+            OR json_type(turn.value, '$.content') IS NOT 'text'
+    )
+END
+"""
+
+_cache: Dict[Optional[int], Tuple[tuple, dict]] = {}
+_cache_lock = threading.Lock()
+
+
+def _dataset_filter(dataset_id: Optional[int]) -> Tuple[str, dict]:
+    if dataset_id:
+        return "WHERE c.dataset_id = :dataset_id", {"dataset_id": dataset_id}
+    return "", {}
+
+
+def _fingerprint(session, dataset_id: Optional[int]) -> tuple:
+    """
+    语料行数与数据集的 corpus_version（不限数据集时为各数据集之和及数据集数量），
+    插入或删除语料后都会变化，SQLite 复用已删除的最大ID也不影响；
+    created_at 区分复用了已删除数据集ID的新数据集
+    """
+    where, params = _dataset_filter(dataset_id)
+    count = session.execute(
+        text(f"SELECT count(*) FROM corpus AS c {where}"), params
+    ).scalar()
+    if dataset_id:
+        version = session.execute(
+            text(
+                "SELECT created_at, corpus_version FROM datasets WHERE id = :dataset_id"
+            ),
+            params,
+        ).one_or_none()
+    else:
+        version = session.execute(
+            text("SELECT count(*), total(corpus_version) FROM datasets")
+        ).one()
+    return count, tuple(version) if version else None
+
+
+def find_suspect_ids(corpus_ids: List[int]) -> List[int]:
+    """重新检查给定的语料，返回其中仍然存在且对话结构不合规范的ID"""
+    suspect_ids = []
+    session = db_manager.get_read_session()
+    try:
+        for start in range(0, len(corpus_ids), VALIDATION_CHUNK_SIZE):
+            suspect_ids += session.execute(
+                text(
+                    f"SELECT c.id FROM corpus AS c "
+                    f"WHERE c.id IN :ids AND {_SUSPECT_CONDITION} ORDER BY c.id"
+                ).bindparams(bindparam("ids", expanding=True)),
+                {"ids": corpus_ids[start : start + VALIDATION_CHUNK_SIZE]},
+            ).scalars()
+    finally:
+        session.close()
+    return suspect_ids
+
+
+def inspect_dialogue(dialogue_data) -> List[str]:
+    """返回一条语料对话数据的问题描述列表，合规时为空列表"""
+    if not isinstance(dialogue_data, dict):
+        return ["dialogue字段不是字典类型"]
+
+    if "dialogues" not in dialogue_data:
+        return ["缺少dialogues字段"]
+
+    dialogues = dialogue_data["dialogues"]
+    if not isinstance(dialogues, list):
+        return ["dialogues字段不是列表类型"]
+
+    issues = []
+    for i, turn in enumerate(dialogues):
+        if not isinstance(turn, dict):
+            issues.append(f"第{i+1}轮对话不是字典类型")
+            continue
+
+        # 检查role字段
+        role = turn.get("role")
+        if not role or not isinstance(role, str):
+            issues.append(f"第{i+1}轮对话缺少有效的role字段")
+
+        # 检查content字段
+        content = turn.get("content")
+        if content is None:
+            issues.append(f"第{i+1}轮对话缺少content字段")
+        elif isinstance(content, dict):
+            issues.append(f"第{i+1}轮对话的content是字典类型而非字符串")
+        elif not isinstance(content, str):
+            issues.append(f"第{i+1}轮对话的content不是字符串类型：{type(content)}")
+    return issues
+
+
+def _dialogue_sample(dialogue_data) -> str:
+    if isinstance(dialogue_data, dict) and isinstance(
+        dialogue_data.get("dialogues"), list
+    ):
+        sample_turns = dialogue_data["dialogues"][:2]  # 只取前两轮
+        return json.dumps(sample_turns, ensure_ascii=False)[:200] + "..."
+    return str(dialogue_data)[:100] + "..."
+
+
+def _inspect_chunk(rows, dataset_names: Dict[int, str]) -> List[dict]:
+    invalid_entries = []
+    for corpus_id, dataset_id, raw_text in rows:
+        try:
+            dialogue_data = json.loads(raw_text)
+        except (TypeError, ValueError) as e:
+            issues = [f"数据解析异常: {str(e)}"]
+            dialogue_data = raw_text
+        else:
+            issues = inspect_dialogue(dialogue_data)
+        if issues:
+            invalid_entries.append(
+                {
+                    "corpus_id": corpus_id,
+                    "dataset_name": dataset_names.get(dataset_id, "未知"),
+                    "issues": issues,
+                    "dialogue_sample": _dialogue_sample(dialogue_data),
+                }
+            )
+    return invalid_entries
+
+
+def validate_corpus(dataset_id: int = None, use_cache: bool = True) -> dict:
+    """
+    检测数据集（为None时检测所有数据集）中不合规范的语料。
+
+    Returns:
+        {"total_checked": int, "invalid_entries": [...]}，
+        格式与 dataset_service.detect_invalid_corpus_data 相同
+    """
+    session = db_manager.get_read_session()
+    try:
+        fingerprint = _fingerprint(session, dataset_id)
+        if use_cache:
+            with _cache_lock:
+                cached = _cache.get(dataset_id)
+            if cached and cached[0] == fingerprint:
+                logger.info(f"数据集 {dataset_id} 的语料未变化，复用上次的检测结果")
+                return cached[1]
+
+        dataset_names = dict(session.query(Dataset.id, Dataset.name).all())
+        where, params = _dataset_filter(dataset_id)
+        where = f"{where} AND" if where else "WHERE"
+        result = session.execute(
+            text(
+                f"SELECT c.id, c.dataset_id, c.dialogue FROM corpus AS c "
+                f"{where} {_SUSPECT_CONDITION} ORDER BY c.id"
+            ).execution_options(yield_per=VALIDATION_CHUNK_SIZE),
+            params,
+        )
+        invalid_entries = []
+        for rows in result.partitions():
+            invalid_entries.extend(_inspect_chunk(rows, dataset_names))
+    finally:
+        session.close()
+
+    total_checked = fingerprint[0]
+    logger.info(
+        f"检测完成：总共检查 {total_checked} 条语料，发现 {len(invalid_entries)} 条不合规范数据"
+    )
+    report = {"total_checked": total_checked, "invalid_entries": invalid_entries}
+    with _cache_lock:
+        _cache[dataset_id] = (fingerprint, report)
+    return report
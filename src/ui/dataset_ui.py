@@ -1,13 +1,65 @@
 import gradio as gr
 import pandas as pd
 import json
+import os
 from src.services import character_service, scenario_service, dataset_service
+from src.utils import export_writers, text_embeddings
+
+# 导出格式选项 -> (导出类型, 文件格式, 压缩格式)
+EXPORT_FORMATS = {
+    "完整格式 (JSONL)": ("full", "jsonl", export_writers.COMPRESSION_NONE),
+    "完整格式 (JSONL.GZ)": ("full", "jsonl", export_writers.COMPRESSION_GZIP),
+    "训练格式 (JSONL)": ("training", "jsonl", export_writers.COMPRESSION_NONE),
+    "训练格式 (JSONL.GZ)": ("training", "jsonl", export_writers.COMPRESSION_GZIP),
+}
+if export_writers.ZSTD_AVAILABLE:
+    EXPORT_FORMATS["完整格式 (JSONL.ZST)"] = (
+        "full",
+        "jsonl",
+        export_writers.COMPRESSION_ZSTD,
+    )
+    EXPORT_FORMATS["训练格式 (JSONL.ZST)"] = (
+        "training",
+        "jsonl",
+        export_writers.COMPRESSION_ZSTD,
+    )
+if export_writers.PARQUET_AVAILABLE:
+    EXPORT_FORMATS["训练格式 (Parquet)"] = (
+        "training",
+        "parquet",
+        export_writers.COMPRESSION_NONE,
+    )
+
+# 分片导出的文件格式 -> (output_format, compression)
+SHARD_EXPORT_FORMATS = {
+    "JSONL": ("jsonl", export_writers.COMPRESSION_NONE),
+    "JSONL.GZ": ("jsonl", export_writers.COMPRESSION_GZIP),
+}
+if export_writers.ZSTD_AVAILABLE:
+    SHARD_EXPORT_FORMATS["JSONL.ZST"] = ("jsonl", export_writers.COMPRESSION_ZSTD)
+if export_writers.PARQUET_AVAILABLE:
+    SHARD_EXPORT_FORMATS["Parquet"] = ("parquet", export_writers.COMPRESSION_NONE)
+
+# 语料预览的长度筛选 -> (最少字符数, 最多字符数)，按 Corpus.char_count 筛选
+LENGTH_FILTERS = {
+    "全部长度": (None, None),
+    "短 (<200字)": (None, 200),
+    "中 (200-1000字)": (200, 1000),
+    "长 (≥1000字)": (1000, None),
+}
+# 去重统计中显示的最近批次数
+DEDUP_REPORT_ROWS = 20
+# 近似重复结果中显示的簇数
+NEAR_DUP_DISPLAY_CLUSTERS = 20
+# 语义检索返回的相似语料条数
+SIMILAR_CORPUS_COUNT = 5
 
 
 def create_dataset_ui():
     """Creates the UI for dataset management."""
 
     selected_dataset_id_state = gr.State(None)
+    corpus_page_state = gr.State(None)
 
     def load_all_dropdowns():
         datasets = dataset_service.get_all_datasets_for_display()
@@ -29,37 +81,176 @@ def create_dataset_ui():
                 return dialogue
         return json.dumps(dialogue, ensure_ascii=False, indent=2)
 
-    def update_corpus_view(dataset_id, scenario_filters):
-        if not dataset_id:
-            empty_df = pd.DataFrame(columns=["dialogue", "scenarios"])
-            return empty_df, "请先选择一个数据集。", gr.update(choices=[], value=[])
-
-        corpus_data = dataset_service.get_corpus_by_dataset(
-            dataset_id, scenario_filters
+    def load_corpus_page(
+        dataset_id, scenario_filters, cursor=None, direction="next", length_filter=None
+    ):
+        """加载一页语料，返回 (预览表格, 分页查询结果)"""
+        min_chars, max_chars = LENGTH_FILTERS.get(length_filter, (None, None))
+        page = dataset_service.get_corpus_page(
+            dataset_id,
+            scenario_filters,
+            cursor=cursor,
+            direction=direction,
+            min_chars=min_chars,
+            max_chars=max_chars,
         )
-        if corpus_data:
-            for item in corpus_data:
-                item["dialogue"] = format_dialogue(item.get("dialogue", "{}"))
         corpus_df = (
-            pd.DataFrame(corpus_data)
-            if corpus_data
+            pd.DataFrame(
+                [
+                    {
+                        "dialogue": format_dialogue(item["dialogue"]),
+                        "scenarios": item["scenarios"],
+                    }
+                    for item in page["items"]
+                ]
+            )
+            if page["items"]
             else pd.DataFrame(columns=["dialogue", "scenarios"])
         )
+        return corpus_df, page
+
+    def to_page_state(page, number):
+        """分页状态只保存游标，不保存语料内容"""
+        return {
+            "first_cursor": page["first_cursor"],
+            "last_cursor": page["last_cursor"],
+            "has_prev": page["has_prev"],
+            "has_next": page["has_next"],
+            "number": number,
+            "count": len(page["items"]),
+        }
+
+    def page_info_text(page_state):
+        if not page_state or not page_state.get("count"):
+            return "暂无语料"
+        return f"第 {page_state['number']} 页（本页 {page_state['count']} 条）"
+
+    def on_change_page(
+        dataset_id, scenario_filters, page_state, direction, length_filter=None
+    ):
+        """翻页：以当前页首行或末行为游标读取相邻的一页"""
+        if not dataset_id or not page_state:
+            return gr.update(), page_state, gr.update()
+        if direction == "next" and not page_state["has_next"]:
+            gr.Info("已经是最后一页")
+            return gr.update(), page_state, gr.update()
+        if direction == "prev" and not page_state["has_prev"]:
+            gr.Info("已经是第一页")
+            return gr.update(), page_state, gr.update()
+
+        cursor = (
+            page_state["last_cursor"]
+            if direction == "next"
+            else page_state["first_cursor"]
+        )
+        corpus_df, page = load_corpus_page(
+            dataset_id, scenario_filters, cursor, direction, length_filter
+        )
+        if not page["items"]:
+            return gr.update(), page_state, gr.update()
+        new_state = to_page_state(
+            page, page_state["number"] + (1 if direction == "next" else -1)
+        )
+        return corpus_df, new_state, page_info_text(new_state)
 
-        stats = dataset_service.get_dataset_stats(dataset_id)
-        stats_md = f"**总语料数**: {stats['total_corpus_count']}\n\n**各场景语料数**:\n"
+    def format_stats(stats):
+        stats_md = (
+            f"**总语料数**: {stats['total_corpus_count']}"
+            f"　**总字符数**: {stats['total_chars']}\n\n**各场景语料数**:\n"
+        )
         if stats["scenario_counts"]:
             stats_md += "\n".join(
                 f"- {name}: {count}" for name, count in stats["scenario_counts"].items()
             )
         else:
             stats_md += "- 暂无场景统计"
+        if stats["turn_histogram"]:
+            stats_md += "\n\n**对话轮数分布**:\n" + "\n".join(
+                f"- {turns} 轮: {count}"
+                for turns, count in stats["turn_histogram"].items()
+            )
+        return stats_md
+
+    def on_rebuild_stats(dataset_id):
+        """从语料表重建统计，修复统计偏差"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        try:
+            dataset_service.rebuild_dataset_stats(dataset_id)
+            gr.Info("数据集统计已重建")
+            return format_stats(dataset_service.get_dataset_stats(dataset_id))
+        except Exception as e:
+            gr.Warning(f"重建统计失败: {str(e)}")
+            return gr.update()
+
+    def on_show_role_stats(dataset_id):
+        """从 dialogue_turns 按角色汇总消息条数与字符数"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        role_stats = dataset_service.get_dataset_role_stats(dataset_id)
+        if not role_stats:
+            return "**各角色消息统计**:\n- 暂无对话消息"
+        return "**各角色消息统计**:\n" + "\n".join(
+            f"- {role or '(无角色)'}: {item['turns']} 条消息，{item['chars']} 字符"
+            f"（平均 {item['chars'] / item['turns']:.0f} 字符）"
+            for role, item in role_stats.items()
+        )
+
+    def on_show_dedup_report(dataset_id):
+        """按生成批次显示写入时跳过的重复语料数量与命中率"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        report = dataset_service.get_dedup_report(dataset_id)
+        if not report["batches"]:
+            return "**去重统计**:\n- 暂无写入记录"
+        totals = report["totals"]
+        lines = [
+            f"**去重统计**: 共提交 {totals['submitted']} 条，入库 {totals['inserted']} 条，"
+            f"重复率 {totals['hit_rate']:.1%}",
+            "",
+            "| 批次 | 提交 | 入库 | 批内重复 | 与已有重复 | 重复率 |",
+            "| --- | --- | --- | --- | --- | --- |",
+        ]
+        for entry in report["batches"][:DEDUP_REPORT_ROWS]:
+            lines.append(
+                f"| {entry['batch_id'] or '(无批次)'} | {entry['submitted']} "
+                f"| {entry['inserted']} | {entry['batch_duplicates']} "
+                f"| {entry['existing_duplicates']} | {entry['hit_rate']:.1%} |"
+            )
+        return "\n".join(lines)
+
+    def update_corpus_view(dataset_id, scenario_filters, length_filter=None):
+        if not dataset_id:
+            empty_df = pd.DataFrame(columns=["dialogue", "scenarios"])
+            return (
+                empty_df,
+                "请先选择一个数据集。",
+                gr.update(choices=[], value=[]),
+                None,
+                "",
+            )
+
+        corpus_df, page = load_corpus_page(
+            dataset_id, scenario_filters, length_filter=length_filter
+        )
+        page_state = to_page_state(page, 1)
+
+        stats_md = format_stats(dataset_service.get_dataset_stats(dataset_id))
 
         dataset_details = dataset_service.get_dataset_details_by_id(dataset_id)
         scenario_choices = (
             dataset_details.get("scenario_names", []) if dataset_details else []
         )
-        return corpus_df, stats_md, gr.update(choices=scenario_choices)
+        return (
+            corpus_df,
+            stats_md,
+            gr.update(choices=scenario_choices),
+            page_state,
+            page_info_text(page_state),
+        )
 
     def on_select_dataset(dataset_name):
         if not dataset_name:
@@ -67,18 +258,13 @@ def create_dataset_ui():
 
         details = dataset_service.get_dataset_details(dataset_name)
         if details:
-            corpus_df, stats_md, scenario_filter_update = update_corpus_view(
-                details["id"], []
-            )
             return (
                 details["id"],
                 details["name"],
                 details["description"],
                 details["character_name"],
                 details["scenario_names"],
-                corpus_df,
-                stats_md,
-                scenario_filter_update,
+                *update_corpus_view(details["id"], []),
             )
         return None, "", "", None, [], *update_corpus_view(None, [])
 
@@ -94,6 +280,9 @@ def create_dataset_ui():
                 gr.update(),
                 gr.update(),
                 gr.update(),
+                gr.update(),
+                gr.update(),
+                gr.update(),
             )
 
         try:
@@ -102,7 +291,6 @@ def create_dataset_ui():
             )
             gr.Info(f"数据集 '{name}' 已成功保存！")
             datasets_dd, _, _ = load_all_dropdowns()
-            corpus_df, stats_md, scenario_filter_update = update_corpus_view(new_id, [])
             return (
                 datasets_dd,
                 new_id,
@@ -110,9 +298,7 @@ def create_dataset_ui():
                 description,
                 character,
                 scenarios,
-                corpus_df,
-                stats_md,
-                scenario_filter_update,
+                *update_corpus_view(new_id, []),
             )
         except ValueError as e:
             gr.Warning(str(e))
@@ -126,6 +312,8 @@ def create_dataset_ui():
                 gr.update(),
                 gr.update(),
                 gr.update(),
+                gr.update(),
+                gr.update(),
             )
 
     def on_delete_dataset(dataset_id):
@@ -140,6 +328,9 @@ def create_dataset_ui():
                 gr.update(),
                 gr.update(),
                 gr.update(),
+                gr.update(),
+                gr.update(),
+                gr.update(),
             )
 
         success = dataset_service.delete_dataset(dataset_id)
@@ -160,28 +351,54 @@ def create_dataset_ui():
                 gr.update(),
                 gr.update(),
                 gr.update(),
+                gr.update(),
+                gr.update(),
+                gr.update(),
             )
 
-    def on_export_corpus(dataset_id, export_format):
+    def on_export_corpus(dataset_id, export_format, incremental):
         """导出语料库数据"""
         if not dataset_id:
             gr.Warning("请先选择一个数据集！")
             return None
 
         try:
-            if export_format == "完整格式 (JSONL)":
-                filename = dataset_service.export_dataset_corpus_to_jsonl(dataset_id)
-            elif export_format == "训练格式 (JSONL)":
-                filename = dataset_service.export_dataset_corpus_to_standard_format(
-                    dataset_id
-                )
-            else:
+            if export_format not in EXPORT_FORMATS:
                 gr.Warning("请选择导出格式！")
                 return None
+            kind, output_format, compression = EXPORT_FORMATS[export_format]
 
-            # 检查文件是否存在
-            import os
+            if incremental:
+                result = dataset_service.export_dataset_corpus_incremental(
+                    dataset_id,
+                    kind=kind,
+                    output_format=output_format,
+                    compression=compression,
+                )
+                if not result["part_path"]:
+                    gr.Info(f"没有新增语料，已累计导出 {result['total_rows']} 条。")
+                    return gr.update(value=result["manifest_path"], visible=True)
+                gr.Info(
+                    f"增量导出 {result['rows']} 条新语料，"
+                    f"累计 {result['total_rows']} 条。"
+                )
+                return gr.update(
+                    value=[result["part_path"], result["manifest_path"]],
+                    visible=True,
+                )
+
+            if output_format == "parquet":
+                filename = dataset_service.export_dataset_corpus_to_parquet(dataset_id)
+            elif kind == "full":
+                filename = dataset_service.export_dataset_corpus_to_jsonl(
+                    dataset_id, compression=compression
+                )
+            else:
+                filename = dataset_service.export_dataset_corpus_to_standard_format(
+                    dataset_id, compression=compression
+                )
 
+            # 检查文件是否存在
             if os.path.exists(filename):
                 gr.Info(
                     "语料库已成功导出！文件已准备好下载。",
@@ -194,6 +411,50 @@ def create_dataset_ui():
             gr.Warning(f"导出失败: {str(e)}")
             return gr.update(visible=False)
 
+    def on_reset_incremental_export(dataset_id):
+        """重置增量导出检查点，下次增量导出将从头开始"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update(visible=False)
+        try:
+            dataset_service.reset_incremental_export(dataset_id)
+            gr.Info("已重置增量导出，下次增量导出将包含全部语料。")
+        except Exception as e:
+            gr.Warning(f"重置失败: {str(e)}")
+        return gr.update(visible=False)
+
+    def on_export_sharded(dataset_id, shard_format, num_shards, val_ratio, test_ratio):
+        """分片导出训练格式语料，并按比例划分 train / val / test"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return None
+
+        try:
+            output_format, compression = SHARD_EXPORT_FORMATS[shard_format]
+            manifest_path = dataset_service.export_dataset_corpus_sharded(
+                dataset_id,
+                num_shards=int(num_shards),
+                val_ratio=val_ratio,
+                test_ratio=test_ratio,
+                output_format=output_format,
+                compression=compression,
+            )
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            output_dir = os.path.dirname(manifest_path)
+            files = [manifest_path] + [
+                os.path.join(output_dir, entry["path"]) for entry in manifest["files"]
+            ]
+            counts = manifest["counts"]
+            gr.Info(
+                f"分片导出完成：train {counts['train']} 条，"
+                f"val {counts['val']} 条，test {counts['test']} 条"
+            )
+            return gr.update(value=files, visible=True)
+        except Exception as e:
+            gr.Warning(f"分片导出失败: {str(e)}")
+            return gr.update(visible=False)
+
     def on_add_new_dataset():
         return None, "", "", None, []
 
@@ -212,12 +473,13 @@ def create_dataset_ui():
 
     def on_delete_corpus_by_scenario(dataset_id, scenarios_to_delete):
         """处理按场景删除语料的按钮点击事件"""
+        no_change = (gr.update(),) * 5
         if not dataset_id:
             gr.Warning("请先选择一个数据集！")
-            return gr.update(), gr.update(), gr.update()
+            return no_change
         if not scenarios_to_delete:
             gr.Warning("请至少选择一个要删除语料的场景！")
-            return gr.update(), gr.update(), gr.update()
+            return no_change
 
         try:
             deleted_count = dataset_service.delete_corpus_by_scenarios(
@@ -228,7 +490,7 @@ def create_dataset_ui():
             return update_corpus_view(dataset_id, [])
         except Exception as e:
             gr.Warning(f"删除语料失败: {e}")
-            return gr.update(), gr.update(), gr.update()
+            return no_change
 
     def on_detect_invalid_data(dataset_id):
         """检测不合规范的数据"""
@@ -321,6 +583,7 @@ def create_dataset_ui():
 
     def on_clean_invalid_data(dataset_id, dry_run):
         """清理不合规范的数据"""
+        no_change = (gr.update(),) * 5
         try:
             result = dataset_service.clean_invalid_corpus_data(dataset_id, dry_run)
             detected_count = result["detected_count"]
@@ -328,29 +591,205 @@ def create_dataset_ui():
 
             if detected_count == 0:
                 gr.Info("未发现需要清理的不合规范数据")
-                return "未发现需要清理的数据", gr.update(), gr.update(), gr.update()
+                return "未发现需要清理的数据", *no_change
 
             if dry_run:
                 cleanup_info = f"🔍 试运行模式：发现 {detected_count} 条不合规范数据，如需删除请点击'确认清理'"
                 gr.Info(f"试运行完成：发现 {detected_count} 条不合规范数据")
-                return cleanup_info, gr.update(), gr.update(), gr.update()
+                return cleanup_info, *no_change
             else:
                 cleanup_info = f"✅ 清理完成：成功删除 {deleted_count}/{detected_count} 条不合规范数据"
                 gr.Info(f"清理完成：成功删除 {deleted_count} 条数据")
 
                 # 刷新语料预览和统计
                 if dataset_id:
-                    corpus_df, stats_md, scenario_filter_update = update_corpus_view(
-                        dataset_id, []
-                    )
-                    return cleanup_info, corpus_df, stats_md, scenario_filter_update
+                    return cleanup_info, *update_corpus_view(dataset_id, [])
                 else:
-                    return cleanup_info, gr.update(), gr.update(), gr.update()
+                    return cleanup_info, *no_change
 
         except Exception as e:
             error_msg = f"❌ 清理失败: {str(e)}"
             gr.Warning(f"清理失败: {str(e)}")
-            return error_msg, gr.update(), gr.update(), gr.update()
+            return error_msg, *no_change
+
+    def on_find_near_duplicates(dataset_id, threshold):
+        """按 MinHash + LSH 查找近似重复的语料簇"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        try:
+            result = dataset_service.find_near_duplicate_corpus(dataset_id, threshold)
+        except Exception as e:
+            gr.Warning(f"查找近似重复失败: {str(e)}")
+            return f"❌ 查找近似重复失败: {str(e)}"
+
+        clusters = result["clusters"]
+        if not clusters:
+            return f"✅ 比较了 {result['total_checked']} 条语料，未发现近似重复"
+        lines = [
+            f"🔍 比较了 {result['total_checked']} 条语料，发现 {len(clusters)} 个近似重复簇，"
+            f"删除后可去掉 {result['duplicate_count']} 条语料",
+            "",
+        ]
+        for i, cluster in enumerate(clusters[:NEAR_DUP_DISPLAY_CLUSTERS], 1):
+            ids = cluster["corpus_ids"]
+            shown_ids = ", ".join(str(corpus_id) for corpus_id in ids[:10])
+            if len(ids) > 10:
+                shown_ids += " ..."
+            lines.append(
+                f"{i}. **{len(ids)} 条**（相似度 {cluster['similarity']:.2f}，"
+                f"保留 ID {cluster['keep_id']}）: {shown_ids}"
+            )
+            kept_apart = len(ids) - 1 - len(cluster["duplicate_ids"])
+            if kept_apart:
+                lines.append(
+                    f"   {kept_apart} 条与保留条目本身相似度不足阈值，删除时会保留"
+                )
+            if cluster.get("sample"):
+                lines.append(f"   > {cluster['sample']}...")
+        if len(clusters) > NEAR_DUP_DISPLAY_CLUSTERS:
+            lines.append(f"\n... 还有 {len(clusters) - NEAR_DUP_DISPLAY_CLUSTERS} 个簇")
+        return "\n".join(lines)
+
+    def on_prune_near_duplicates(dataset_id, threshold):
+        """删除近似重复的语料，每簇保留最早写入的一条"""
+        no_change = (gr.update(),) * 5
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update(), *no_change
+        try:
+            result = dataset_service.prune_near_duplicate_corpus(dataset_id, threshold)
+        except Exception as e:
+            gr.Warning(f"删除近似重复失败: {str(e)}")
+            return f"❌ 删除近似重复失败: {str(e)}", *no_change
+        if not result["deleted_count"]:
+            gr.Info("未发现近似重复的语料")
+            return "未发现近似重复的语料", *no_change
+        gr.Info(f"已删除 {result['deleted_count']} 条近似重复语料")
+        return (
+            f"✅ 已删除 {result['deleted_count']} 条近似重复语料"
+            f"（{result['cluster_count']} 个簇各保留一条）",
+            *update_corpus_view(dataset_id, []),
+        )
+
+    def on_find_exact_duplicates(dataset_id):
+        """查找去重上线之前写入的完全重复语料"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        try:
+            result = dataset_service.find_exact_duplicate_corpus(dataset_id)
+        except Exception as e:
+            gr.Warning(f"查找重复语料失败: {str(e)}")
+            return f"❌ 查找重复语料失败: {str(e)}"
+        if not result["duplicate_count"]:
+            return f"✅ 检查了 {result['total_checked']} 条未去重的语料，未发现完全重复"
+        shown = ", ".join(
+            f"{d['corpus_id']}（与 {d['keep_id']} 相同）"
+            for d in result["duplicates"][:NEAR_DUP_DISPLAY_CLUSTERS]
+        )
+        if result["duplicate_count"] > NEAR_DUP_DISPLAY_CLUSTERS:
+            shown += " ..."
+        return (
+            f"🔍 检查了 {result['total_checked']} 条未去重的语料，"
+            f"发现 {result['duplicate_count']} 条与更早的语料完全相同: {shown}"
+        )
+
+    def on_prune_exact_duplicates(dataset_id):
+        """删除完全重复的历史语料，保留最早写入的一条"""
+        no_change = (gr.update(),) * 5
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update(), *no_change
+        try:
+            result = dataset_service.prune_exact_duplicate_corpus(dataset_id)
+        except Exception as e:
+            gr.Warning(f"删除重复语料失败: {str(e)}")
+            return f"❌ 删除重复语料失败: {str(e)}", *no_change
+        if not result["deleted_count"]:
+            gr.Info("未发现完全重复的语料")
+            return "未发现完全重复的语料", *no_change
+        gr.Info(f"已删除 {result['deleted_count']} 条完全重复的语料")
+        return (
+            f"✅ 已删除 {result['deleted_count']} 条完全重复的语料"
+            f"（ID: {', '.join(map(str, result['deleted_corpus_ids'][:50]))}"
+            f"{' ...' if result['deleted_count'] > 50 else ''}）",
+            *update_corpus_view(dataset_id, []),
+        )
+
+    def format_diversity_index(dataset_id):
+        """语义向量索引状态与各场景的话题多样性"""
+        info = dataset_service.get_diversity_index_info(dataset_id)
+        if not info:
+            return "尚未构建语义向量索引"
+        backend = info["model"] or "哈希 TF-IDF"
+        lines = [
+            f"**语义向量索引**: {info['count']} 条语料，{info['dim']} 维（{backend}），"
+            f"更新于 {info['updated_at'][:19].replace('T', ' ')}",
+        ]
+        coverage = dataset_service.get_scenario_coverage(dataset_id)
+        overall = coverage["overall"]
+        if overall["diversity"] is not None:
+            lines.append(f"- 整体话题多样性: {overall['diversity']:.3f}")
+        if coverage["scenarios"]:
+            lines += [
+                "",
+                "| 场景 | 语料数 | 话题多样性 |",
+                "| --- | --- | --- |",
+            ]
+            for item in coverage["scenarios"]:
+                diversity = (
+                    f"{item['diversity']:.3f}" if item["diversity"] is not None else "-"
+                )
+                lines.append(f"| {item['scenario']} | {item['count']} | {diversity} |")
+            lines.append("\n多样性越低说明该场景的对话越集中在相同话题上")
+        return "\n".join(lines)
+
+    def on_build_diversity_index(dataset_id, use_local_model, incremental):
+        """构建或增量更新语义向量索引"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        try:
+            if incremental:
+                dataset_service.update_diversity_index(dataset_id)
+            else:
+                dataset_service.build_diversity_index(dataset_id, use_local_model)
+            gr.Info("语义向量索引已更新")
+            return format_diversity_index(dataset_id)
+        except Exception as e:
+            gr.Warning(f"构建语义向量索引失败: {str(e)}")
+            return f"❌ 构建语义向量索引失败: {str(e)}"
+
+    def on_show_diversity(dataset_id):
+        """显示索引状态与场景覆盖度"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        try:
+            return format_diversity_index(dataset_id)
+        except Exception as e:
+            return f"❌ {str(e)}"
+
+    def on_find_similar_corpus(dataset_id, query_text):
+        """在语义向量索引中检索与输入文本最相似的语料"""
+        if not dataset_id:
+            gr.Warning("请先选择一个数据集！")
+            return gr.update()
+        if not query_text or not query_text.strip():
+            return "请输入要检索的话题或对话内容"
+        try:
+            neighbors = dataset_service.find_similar_corpus(
+                dataset_id, query_text, SIMILAR_CORPUS_COUNT
+            )
+        except Exception as e:
+            return f"❌ 检索失败: {str(e)}"
+        if not neighbors:
+            return "索引中没有语料"
+        return "\n".join(
+            f"{i}. **ID {item['corpus_id']}**（相似度 {item['score']:.3f}）: {item['snippet']}"
+            for i, item in enumerate(neighbors, 1)
+        )
 
     with gr.Blocks(analytics_enabled=False) as dataset_ui:
         gr.Markdown("## 📚 语料数据集管理\n管理和配置用于生成任务的数据集。")
@@ -377,11 +816,47 @@ def create_dataset_ui():
                 with gr.Group():
                     export_format = gr.Dropdown(
                         label="导出格式",
-                        choices=["完整格式 (JSONL)", "训练格式 (JSONL)"],
+                        choices=list(EXPORT_FORMATS),
                         value="完整格式 (JSONL)",
-                        info="完整格式包含所有元数据，训练格式适用于模型微调",
+                        info="完整格式包含所有元数据，训练格式适用于模型微调；"
+                        ".gz/.zst 为压缩文件，Parquet 可供训练框架直接内存映射读取",
                     )
-                    export_btn = gr.Button("📥 导出语料库", variant="secondary")
+                    incremental_export = gr.Checkbox(
+                        label="增量导出",
+                        value=False,
+                        info="只导出上次增量导出之后新增的语料，写为新的分片文件",
+                    )
+                    with gr.Row():
+                        export_btn = gr.Button("📥 导出语料库", variant="secondary")
+                        reset_incremental_btn = gr.Button(
+                            "↺ 重置增量导出", variant="secondary"
+                        )
+                    with gr.Accordion("分片导出（训练格式）", open=False):
+                        with gr.Row():
+                            shard_format = gr.Dropdown(
+                                label="文件格式",
+                                choices=list(SHARD_EXPORT_FORMATS),
+                                value="JSONL",
+                            )
+                            num_shards = gr.Number(
+                                label="分片数", value=8, minimum=1, precision=0
+                            )
+                        with gr.Row():
+                            val_ratio = gr.Slider(
+                                label="验证集比例",
+                                minimum=0,
+                                maximum=0.5,
+                                value=0.05,
+                                step=0.01,
+                            )
+                            test_ratio = gr.Slider(
+                                label="测试集比例",
+                                minimum=0,
+                                maximum=0.5,
+                                value=0.05,
+                                step=0.01,
+                            )
+                        shard_export_btn = gr.Button("📦 分片导出", variant="secondary")
                     export_file = gr.File(label="下载文件", visible=False)
 
                 # 添加数据清理功能区域
@@ -402,11 +877,80 @@ def create_dataset_ui():
                     # 清理结果显示
                     cleanup_result = gr.Markdown(visible=True)
 
+                with gr.Group():
+                    gr.Markdown(
+                        "**查找去重功能上线之前写入的完全重复语料**"
+                        "（新写入的语料会自动跳过重复内容）"
+                    )
+                    with gr.Row():
+                        find_exact_dup_btn = gr.Button(
+                            "🔍 查找完全重复", variant="secondary"
+                        )
+                        prune_exact_dup_btn = gr.Button(
+                            "🗑️ 删除完全重复（保留最早一条）", variant="stop"
+                        )
+                    exact_dup_result = gr.Markdown()
+
+                with gr.Group():
+                    gr.Markdown("**查找 assistant 回复高度相似的近似重复语料**")
+                    with gr.Row():
+                        near_dup_threshold = gr.Slider(
+                            label="相似度阈值",
+                            minimum=0.3,
+                            maximum=0.95,
+                            value=0.6,
+                            step=0.05,
+                        )
+                    with gr.Row():
+                        find_near_dup_btn = gr.Button(
+                            "🔍 查找近似重复", variant="secondary"
+                        )
+                        prune_near_dup_btn = gr.Button(
+                            "🗑️ 删除近似重复（每簇保留最早一条）", variant="stop"
+                        )
+                    near_dup_result = gr.Markdown()
+
+                with gr.Accordion("语义多样性索引", open=False):
+                    gr.Markdown(
+                        "离线计算每条语料的话题向量，用于查看各场景的覆盖度、"
+                        "检索相似语料，以及在生成时避开已覆盖的话题"
+                    )
+                    with gr.Row():
+                        use_local_embedding_model = gr.Checkbox(
+                            label="使用本地向量模型",
+                            value=False,
+                            visible=text_embeddings.SENTENCE_TRANSFORMERS_AVAILABLE,
+                            info=f"sentence-transformers: {text_embeddings.DEFAULT_SENTENCE_MODEL}",
+                        )
+                    with gr.Row():
+                        build_index_btn = gr.Button("🧮 重建索引", variant="secondary")
+                        update_index_btn = gr.Button(
+                            "➕ 追加新语料", variant="secondary"
+                        )
+                        show_diversity_btn = gr.Button(
+                            "📊 场景覆盖度", variant="secondary"
+                        )
+                    diversity_result = gr.Markdown()
+                    with gr.Row():
+                        similar_query = gr.Textbox(
+                            label="检索相似语料",
+                            placeholder="输入话题或对话内容",
+                            scale=4,
+                        )
+                        similar_search_btn = gr.Button("🔎 检索", scale=1)
+                    similar_result = gr.Markdown()
+
             with gr.Column(scale=2):
                 gr.Markdown("### 数据集预览与统计")
                 with gr.Row():
                     filter_by_scenario_dropdown = gr.Dropdown(
-                        label="按场景筛选预览", multiselect=True, scale=4
+                        label="按场景筛选预览", multiselect=True, scale=3
+                    )
+                    length_filter_dropdown = gr.Dropdown(
+                        label="按长度筛选",
+                        choices=list(LENGTH_FILTERS),
+                        value="全部长度",
+                        scale=1,
                     )
                     delete_corpus_by_scenario_btn = gr.Button(
                         "🗑️ 删除选中场景的语料", variant="stop", scale=1
@@ -417,7 +961,17 @@ def create_dataset_ui():
                     row_count=(10, "dynamic"),
                     wrap=True,
                 )
+                with gr.Row():
+                    prev_page_btn = gr.Button("⬅️ 上一页", size="sm")
+                    page_info = gr.Markdown()
+                    next_page_btn = gr.Button("下一页 ➡️", size="sm")
                 stats_display = gr.Markdown(label="数据集统计")
+                with gr.Row():
+                    rebuild_stats_btn = gr.Button("🔄 重建统计", size="sm")
+                    role_stats_btn = gr.Button("👥 角色统计", size="sm")
+                    dedup_report_btn = gr.Button("🔁 去重统计", size="sm")
+                role_stats_display = gr.Markdown()
+                dedup_report_display = gr.Markdown()
 
         outputs_left_panel = [
             selected_dataset_id_state,
@@ -430,6 +984,8 @@ def create_dataset_ui():
             corpus_preview_df,
             stats_display,
             filter_by_scenario_dropdown,
+            corpus_page_state,
+            page_info,
         ]
 
         dataset_ui.load(
@@ -469,24 +1025,74 @@ def create_dataset_ui():
         # 添加导出事件处理
         export_btn.click(
             fn=on_export_corpus,
-            inputs=[selected_dataset_id_state, export_format],
+            inputs=[selected_dataset_id_state, export_format, incremental_export],
+            outputs=[export_file],
+        )
+        reset_incremental_btn.click(
+            fn=on_reset_incremental_export,
+            inputs=[selected_dataset_id_state],
+            outputs=[export_file],
+        )
+        shard_export_btn.click(
+            fn=on_export_sharded,
+            inputs=[
+                selected_dataset_id_state,
+                shard_format,
+                num_shards,
+                val_ratio,
+                test_ratio,
+            ],
             outputs=[export_file],
         )
 
         filter_by_scenario_dropdown.change(
             fn=update_corpus_view,
-            inputs=[selected_dataset_id_state, filter_by_scenario_dropdown],
+            inputs=[
+                selected_dataset_id_state,
+                filter_by_scenario_dropdown,
+                length_filter_dropdown,
+            ],
+            outputs=outputs_right_panel,
+        )
+        length_filter_dropdown.change(
+            fn=update_corpus_view,
+            inputs=[
+                selected_dataset_id_state,
+                filter_by_scenario_dropdown,
+                length_filter_dropdown,
+            ],
             outputs=outputs_right_panel,
         )
 
+        prev_page_btn.click(
+            fn=lambda dataset_id, filters, page_state, length: on_change_page(
+                dataset_id, filters, page_state, "prev", length
+            ),
+            inputs=[
+                selected_dataset_id_state,
+                filter_by_scenario_dropdown,
+                corpus_page_state,
+                length_filter_dropdown,
+            ],
+            outputs=[corpus_preview_df, corpus_page_state, page_info],
+        )
+        next_page_btn.click(
+            fn=lambda dataset_id, filters, page_state, length: on_change_page(
+                dataset_id, filters, page_state, "next", length
+            ),
+            inputs=[
+                selected_dataset_id_state,
+                filter_by_scenario_dropdown,
+                corpus_page_state,
+                length_filter_dropdown,
+            ],
+            outputs=[corpus_preview_df, corpus_page_state, page_info],
+        )
+
         delete_corpus_by_scenario_btn.click(
             fn=on_delete_corpus_by_scenario,
             inputs=[selected_dataset_id_state, filter_by_scenario_dropdown],
-            outputs=[
-                corpus_preview_df,
-                stats_display,
-                filter_by_scenario_dropdown,
-            ],
+            outputs=outputs_right_panel,
         )
 
         # 添加数据清理事件处理
@@ -499,23 +1105,76 @@ def create_dataset_ui():
         clean_dry_run_btn.click(
             fn=lambda dataset_id: on_clean_invalid_data(dataset_id, dry_run=True),
             inputs=[selected_dataset_id_state],
-            outputs=[
-                cleanup_result,
-                corpus_preview_df,
-                stats_display,
-                filter_by_scenario_dropdown,
-            ],
+            outputs=[cleanup_result, *outputs_right_panel],
         )
 
         clean_confirm_btn.click(
             fn=lambda dataset_id: on_clean_invalid_data(dataset_id, dry_run=False),
             inputs=[selected_dataset_id_state],
-            outputs=[
-                cleanup_result,
-                corpus_preview_df,
-                stats_display,
-                filter_by_scenario_dropdown,
-            ],
+            outputs=[cleanup_result, *outputs_right_panel],
+        )
+
+        find_exact_dup_btn.click(
+            fn=on_find_exact_duplicates,
+            inputs=[selected_dataset_id_state],
+            outputs=[exact_dup_result],
+        )
+        prune_exact_dup_btn.click(
+            fn=on_prune_exact_duplicates,
+            inputs=[selected_dataset_id_state],
+            outputs=[exact_dup_result, *outputs_right_panel],
+        )
+
+        find_near_dup_btn.click(
+            fn=on_find_near_duplicates,
+            inputs=[selected_dataset_id_state, near_dup_threshold],
+            outputs=[near_dup_result],
+        )
+        prune_near_dup_btn.click(
+            fn=on_prune_near_duplicates,
+            inputs=[selected_dataset_id_state, near_dup_threshold],
+            outputs=[near_dup_result, *outputs_right_panel],
+        )
+
+        build_index_btn.click(
+            fn=lambda dataset_id, use_local_model: on_build_diversity_index(
+                dataset_id, use_local_model, incremental=False
+            ),
+            inputs=[selected_dataset_id_state, use_local_embedding_model],
+            outputs=[diversity_result],
+        )
+        update_index_btn.click(
+            fn=lambda dataset_id: on_build_diversity_index(
+                dataset_id, False, incremental=True
+            ),
+            inputs=[selected_dataset_id_state],
+            outputs=[diversity_result],
+        )
+        show_diversity_btn.click(
+            fn=on_show_diversity,
+            inputs=[selected_dataset_id_state],
+            outputs=[diversity_result],
+        )
+        similar_search_btn.click(
+            fn=on_find_similar_corpus,
+            inputs=[selected_dataset_id_state, similar_query],
+            outputs=[similar_result],
+        )
+
+        rebuild_stats_btn.click(
+            fn=on_rebuild_stats,
+            inputs=[selected_dataset_id_state],
+            outputs=[stats_display],
+        )
+        role_stats_btn.click(
+            fn=on_show_role_stats,
+            inputs=[selected_dataset_id_state],
+            outputs=[role_stats_display],
+        )
+        dedup_report_btn.click(
+            fn=on_show_dedup_report,
+            inputs=[selected_dataset_id_state],
+            outputs=[dedup_report_display],
         )
 
     return dataset_ui
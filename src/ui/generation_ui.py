@@ -1,9 +1,19 @@
 import gradio as gr
 import pandas as pd
-import asyncio
 import json
+import time
 from datetime import datetime
-from src.services import api_config_service, dataset_service, llm_service
+from src.services import (
+    api_config_service,
+    dataset_service,
+    generation_job_service,
+    generation_worker,
+    llm_service,
+)
+from src.utils import json_extractor
+
+# 生成过程中刷新进度的间隔（秒）
+PROGRESS_POLL_SECONDS = 1.0
 
 
 def create_generation_ui():
@@ -12,7 +22,7 @@ def create_generation_ui():
     # --- Helper Functions ---
     def load_form_from_config(config_name):
         if not config_name:
-            return "", "", "", 1.0, 0.0, 0.0, "OpenAI", gr.update(visible=True)
+            return "", "", "", 1.0, 0.0, 0.0, "OpenAI", gr.update(visible=True), 0, 0
         config = api_config_service.get_api_config_by_name(config_name)
         if config:
             is_visible = config["api_type"] in ["OpenAI", "Anthropic"]
@@ -25,6 +35,8 @@ def create_generation_ui():
                 config.get("presence_penalty", 0.0),
                 config["api_type"],
                 gr.update(visible=is_visible),
+                config.get("rpm_limit", 0),
+                config.get("tpm_limit", 0),
             )
         return (
             gr.update(),
@@ -35,6 +47,8 @@ def create_generation_ui():
             gr.update(),
             gr.update(),
             gr.update(),
+            gr.update(),
+            gr.update(),
         )
 
     def load_form_and_models(config_name):
@@ -64,6 +78,8 @@ def create_generation_ui():
                 "配置名称": c["name"],
                 "API类型": c["api_type"],
                 "Base URL": c.get("base_url", ""),
+                "RPM限制": c.get("rpm_limit", 0),
+                "TPM限制": c.get("tpm_limit", 0),
                 "创建时间": c["created_at"],
             }
             for c in configs
@@ -71,13 +87,23 @@ def create_generation_ui():
         df = pd.DataFrame(df_data)
         return gr.update(choices=names), df
 
-    def on_save_api_config(name, provider, key, base_url, top_p, freq_p, pres_p):
+    def on_save_api_config(
+        name, provider, key, base_url, top_p, freq_p, pres_p, rpm_limit, tpm_limit
+    ):
         if not all([name, provider, key]):
             gr.Warning("配置名称、API提供商和API Key不能为空！")
             return gr.update(), gr.update()
         try:
             api_config_service.save_api_config(
-                name, provider, key, base_url, top_p, freq_p, pres_p
+                name,
+                provider,
+                key,
+                base_url,
+                top_p,
+                freq_p,
+                pres_p,
+                rpm_limit,
+                tpm_limit,
             )
             gr.Info(f"API配置 '{name}' 已成功保存。")
             return refresh_all_configs()
@@ -153,18 +179,26 @@ def create_generation_ui():
         template_name,
         template_map,
         prompt_content,
+        auto_commit,
+        stream_output,
+        avoid_topics,
     ):
         """开始生成语料"""
         if not all([dataset_name, api_config_name, model_name]):
             gr.Warning("请确保已选择数据集、API配置和模型！")
-            return "请完善生成配置", gr.update(), None
+            yield "请完善生成配置", gr.update(), None
+            return
 
         # 验证提示词内容
         if not prompt_content or prompt_content.strip() == "":
             gr.Warning("提示词内容为空！请先点击'生成/刷新提示词'按钮生成提示词。")
-            return "提示词内容为空", gr.update(), None
+            yield "提示词内容为空", gr.update(), None
+            return
 
         try:
+            if not dataset_service.get_dataset_details(dataset_name):
+                raise ValueError(f"数据集 '{dataset_name}' 不存在")
+
             # 显示开始信息
             progress_msg = f"开始生成 {num_to_generate} 条语料...\n"
             progress_msg += f"数据集: {dataset_name}\n"
@@ -172,75 +206,186 @@ def create_generation_ui():
             progress_msg += f"API配置: {api_config_name}\n"
             progress_msg += f"模型: {model_name}\n"
             progress_msg += f"并行请求数: {max_parallel_requests}\n"
-            progress_msg += "使用预览框中的提示词内容进行生成\n"
-
-            # 运行异步生成任务
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-
-            try:
-                batch = loop.run_until_complete(
-                    llm_service.generate_corpus_batch(
-                        dataset_name=dataset_name,
-                        api_config_name=api_config_name,
-                        model_name=model_name,
-                        num_to_generate=num_to_generate,
-                        conversation_turns=conversation_turns,
-                        total_requests=total_requests,
-                        max_parallel_requests=max_parallel_requests,
-                        batch_cooldown_seconds=batch_cooldown_seconds,
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        top_p=top_p,
-                        frequency_penalty=frequency_penalty,
-                        presence_penalty=presence_penalty,
-                        prompt_content=prompt_content,
-                    )
+            if auto_commit:
+                progress_msg += "自动入库: 每个请求完成后即写入数据集\n"
+            if avoid_topics:
+                progress_msg += (
+                    f"话题引导: 每个请求避开 {int(avoid_topics)} 个已覆盖的话题\n"
                 )
+            progress_msg += "使用预览框中的提示词内容进行生成\n"
 
-                # 格式化结果
-                total_time = (batch.end_time - batch.start_time).total_seconds()
-                progress_msg += "\n✅ 生成完成！\n"
-                progress_msg += f"成功: {batch.completed}/{batch.total_requested}\n"
-                progress_msg += f"失败: {batch.failed}\n"
-                progress_msg += f"用时: {total_time:.2f}秒\n"
-
-                # 准备预览数据
-                preview_data = []
-                for i, conversation in enumerate(batch.results):  # 只显示前10条
-                    scenarios_str = ", ".join(conversation.get("scenarios", []))
-                    dialogues = conversation.get("dialogues", [])
-
-                    dialogue_text = ""
-                    for turn in dialogues:
-                        role = turn.get("role", "unknown")
-                        content = turn.get("content", "")
-                        dialogue_text += f"{role}: {content} \n"
-
-                    preview_data.append(
-                        {
-                            "序号": i + 1,
-                            "场景标签": scenarios_str,
-                            "对话内容": dialogue_text.strip(),
-                            "轮数": len(dialogues),
-                        }
+            # 创建持久化的生成任务，进程重启后未完成的请求会自动恢复
+            job_id = generation_job_service.create_job(
+                dataset_name=dataset_name,
+                api_config_name=api_config_name,
+                model_name=model_name,
+                prompt=prompt_content,
+                params={
+                    "num_to_generate": num_to_generate,
+                    "conversation_turns": conversation_turns,
+                    "max_parallel_requests": max_parallel_requests,
+                    "batch_cooldown_seconds": batch_cooldown_seconds,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "top_p": top_p,
+                    "frequency_penalty": frequency_penalty,
+                    "presence_penalty": presence_penalty,
+                    "template_name": template_name,
+                    "stream": stream_output,
+                    "avoid_topics": int(avoid_topics),
+                },
+                total_requests=int(total_requests),
+                auto_commit=auto_commit,
+            )
+            progress_msg += f"任务ID: {job_id}\n"
+
+            # 提交到后台执行器，任务结束前定期输出实时进度
+            worker = generation_worker.get_worker()
+            future = worker.submit(job_id)
+            while not future.done():
+                progress = worker.get_progress(job_id)
+                if progress is not None:
+                    yield (
+                        progress_msg + format_progress(progress),
+                        conversations_to_df(progress.recent_conversations),
+                        None,
                     )
+                time.sleep(PROGRESS_POLL_SECONDS)
+            future.result()
+            batch = llm_service.load_job_batch(job_id)
+
+            summary_msg, preview_df = summarize_batch(batch)
+            progress_msg += summary_msg
+
+            # 存储到全局状态以供确认入库使用
+            current_batch_state = {
+                "batch": batch,
+                "dataset_name": dataset_name,
+                "job_id": job_id,
+            }
 
-                preview_df = pd.DataFrame(preview_data)
-
-                # 存储到全局状态以供确认入库使用
-                current_batch_state = {"batch": batch, "dataset_name": dataset_name}
-
-                gr.Info(f"生成完成！成功生成 {batch.completed} 条对话")
-                return progress_msg, preview_df, current_batch_state
-
-            finally:
-                loop.close()
+            gr.Info(f"生成完成！成功生成 {batch.completed} 条对话")
+            yield progress_msg, preview_df, current_batch_state
 
         except Exception as e:
             error_msg = f"❌ 生成失败: {str(e)}"
             gr.Warning(error_msg)
-            return error_msg, gr.update(), None
+            yield error_msg, gr.update(), None
+
+    def format_progress(progress):
+        """格式化生成任务的实时进度"""
+        finished = progress.completed_requests + progress.failed_requests
+        progress_msg = f"\n⏳ 生成中: {finished}/{progress.total_requests} 个请求\n"
+        progress_msg += (
+            f"成功: {progress.completed_requests}，失败: {progress.failed_requests}\n"
+        )
+        progress_msg += f"已生成对话: {progress.conversations} 条\n"
+        progress_msg += f"速度: {progress.tokens_per_second:.1f} tokens/秒\n"
+        progress_msg += f"已用时: {progress.elapsed_seconds:.0f}秒"
+        if progress.eta_seconds is not None:
+            progress_msg += f"，预计剩余: {progress.eta_seconds:.0f}秒"
+        return progress_msg + "\n"
+
+    def summarize_batch(batch):
+        """格式化批次结果摘要和预览表格"""
+        end_time = batch.end_time or datetime.now()
+        total_time = (end_time - batch.start_time).total_seconds()
+        summary_msg = "\n✅ 生成完成！\n"
+        summary_msg += f"成功: {batch.completed}/{batch.total_requested}\n"
+        summary_msg += f"失败: {batch.failed}\n"
+        summary_msg += f"用时: {total_time:.2f}秒\n"
+        if batch.auto_commit:
+            summary_msg += f"已自动入库: {batch.saved} 条\n"
+            if batch.results:
+                summary_msg += (
+                    f"入库失败: {len(batch.results)} 条，可点击'确认入库'重试\n"
+                )
+        repair_stats = json_extractor.format_repair_stats()
+        if repair_stats:
+            summary_msg += repair_stats + "\n"
+
+        # 准备预览数据，自动入库模式下只保留最近生成的对话
+        preview_source = batch.preview if batch.auto_commit else batch.results
+        return summary_msg, conversations_to_df(preview_source)
+
+    def conversations_to_df(conversations):
+        """将对话列表转换为预览表格"""
+        preview_data = []
+        for i, conversation in enumerate(conversations):
+            scenarios_str = ", ".join(conversation.get("scenarios", []))
+            dialogues = conversation.get("dialogues", [])
+
+            dialogue_text = ""
+            for turn in dialogues:
+                role = turn.get("role", "unknown")
+                content = turn.get("content", "")
+                dialogue_text += f"{role}: {content} \n"
+
+            preview_data.append(
+                {
+                    "序号": i + 1,
+                    "场景标签": scenarios_str,
+                    "对话内容": dialogue_text.strip(),
+                    "轮数": len(dialogues),
+                }
+            )
+
+        return pd.DataFrame(preview_data)
+
+    def refresh_jobs():
+        """刷新生成任务记录列表"""
+        jobs = generation_job_service.get_recent_jobs()
+        return pd.DataFrame(
+            [
+                {
+                    "任务ID": job["id"],
+                    "批次ID": job["batch_id"],
+                    "数据集": job["dataset_name"],
+                    "状态": job["status"],
+                    "成功请求": job["succeeded_requests"],
+                    "失败请求": job["failed_requests"],
+                    "待执行请求": job["pending_requests"],
+                    "创建时间": (
+                        job["created_at"].strftime("%Y-%m-%d %H:%M")
+                        if job["created_at"]
+                        else ""
+                    ),
+                }
+                for job in jobs
+            ],
+            columns=[
+                "任务ID",
+                "批次ID",
+                "数据集",
+                "状态",
+                "成功请求",
+                "失败请求",
+                "待执行请求",
+                "创建时间",
+            ],
+        )
+
+    def load_job_results(job_id):
+        """加载历史生成任务的结果，用于预览和入库"""
+        if not job_id:
+            gr.Warning("请先在任务列表中选择一个任务！")
+            return gr.update(), gr.update(), gr.update()
+        try:
+            batch = llm_service.load_job_batch(int(job_id))
+            summary_msg, preview_df = summarize_batch(batch)
+            status_msg = f"已加载任务 {job_id} ({batch.batch_id})\n" + summary_msg
+            return (
+                status_msg,
+                preview_df,
+                {
+                    "batch": batch,
+                    "dataset_name": batch.dataset_name,
+                    "job_id": int(job_id),
+                },
+            )
+        except Exception as e:
+            gr.Warning(f"加载任务失败: {str(e)}")
+            return gr.update(), gr.update(), gr.update()
 
     def confirm_save_results(current_batch_state):
         """确认保存生成结果到数据库"""
@@ -252,8 +397,16 @@ def create_generation_ui():
             batch = current_batch_state["batch"]
             dataset_name = current_batch_state["dataset_name"]
 
-            # 保存到数据库
-            saved_count = llm_service.save_generation_results(batch, dataset_name)
+            if batch.auto_commit and not batch.results:
+                info_msg = f"ℹ️ 本批次已自动入库 {batch.saved} 条语料，无需重复保存"
+                gr.Info(info_msg)
+                return info_msg
+
+            # 保存到数据库，任务中已入库的请求不会被重复保存
+            saved_count = llm_service.save_job_results(current_batch_state["job_id"])
+            batch.saved += saved_count
+            if batch.auto_commit:
+                batch.results = []
 
             success_msg = f"✅ 成功保存 {saved_count} 条语料到数据集 '{dataset_name}'"
             gr.Info(success_msg)
@@ -307,6 +460,7 @@ def create_generation_ui():
     with gr.Blocks(analytics_enabled=False) as generation_ui:
         selected_config_name_state = gr.State(None)
         current_batch_state = gr.State(None)  # 存储当前生成批次的状态
+        selected_job_id_state = gr.State(None)
         template_map_state = gr.State({})  # 存储模板名称到路径的映射
 
         with gr.Row():
@@ -339,7 +493,7 @@ def create_generation_ui():
                         maximum=20,
                         step=1,
                         value=10,
-                        info="同时发送给LLM的请求数量",
+                        info="同时在途的LLM请求数量，任一请求完成后立即发送下一个",
                     )
                     batch_cooldown_seconds = gr.Slider(
                         label="冷却时间",
@@ -347,7 +501,25 @@ def create_generation_ui():
                         maximum=30,
                         step=1,
                         value=5,
-                        info="每批请求之间的冷却时间，单位秒，避免被封号",
+                        info="服务商触发限流 (HTTP 429) 时暂停发送新请求的时间，单位秒",
+                    )
+                    auto_commit = gr.Checkbox(
+                        label="自动入库",
+                        value=False,
+                        info="每个请求完成后立即将结果分批写入数据集，中途中断也不会丢失已生成的语料",
+                    )
+                    stream_output = gr.Checkbox(
+                        label="流式接收",
+                        value=False,
+                        info="边接收边解析响应，每条对话生成完成即可预览；输出被截断时保留已完成的对话（仅 OpenAI）",
+                    )
+                    avoid_topics = gr.Slider(
+                        label="避开已覆盖话题数",
+                        minimum=0,
+                        maximum=10,
+                        step=1,
+                        value=0,
+                        info="在提示词末尾列出数据集中最集中的话题，要求模型生成不同的对话；0 为关闭。先在数据集管理中构建向量索引效果更好",
                     )
 
                 gr.Markdown("### 3. 配置API调用")
@@ -405,6 +577,21 @@ def create_generation_ui():
                                 base_url = gr.Textbox(
                                     label="Base URL (可选)", visible=True
                                 )
+                                with gr.Row():
+                                    rpm_limit = gr.Number(
+                                        label="RPM限制",
+                                        value=0,
+                                        precision=0,
+                                        minimum=0,
+                                        info="每分钟最大请求数，0表示不限制",
+                                    )
+                                    tpm_limit = gr.Number(
+                                        label="TPM限制",
+                                        value=0,
+                                        precision=0,
+                                        minimum=0,
+                                        info="每分钟最大token数，0表示不限制",
+                                    )
                                 with gr.Row():
                                     save_api_btn = gr.Button("💾 保存并测试")
 
@@ -414,9 +601,18 @@ def create_generation_ui():
                                         "配置名称",
                                         "API类型",
                                         "Base URL",
+                                        "RPM限制",
+                                        "TPM限制",
                                         "创建时间",
                                     ],
-                                    datatype=["str", "str", "str", "str"],
+                                    datatype=[
+                                        "str",
+                                        "str",
+                                        "str",
+                                        "number",
+                                        "number",
+                                        "str",
+                                    ],
                                     row_count=5,
                                     label="已保存的API配置列表",
                                     interactive=True,
@@ -478,6 +674,25 @@ def create_generation_ui():
                         save_results_btn = gr.Button("💾 确认入库", variant="primary")
                         export_json_btn = gr.Button("📄 导出JSON")
 
+                with gr.Accordion("📋 生成任务记录", open=False):
+                    jobs_list = gr.Dataframe(
+                        headers=[
+                            "任务ID",
+                            "批次ID",
+                            "数据集",
+                            "状态",
+                            "成功请求",
+                            "失败请求",
+                            "待执行请求",
+                            "创建时间",
+                        ],
+                        label="最近的生成任务（未完成的任务会在应用重启后自动恢复）",
+                        interactive=False,
+                    )
+                    with gr.Row():
+                        refresh_jobs_btn = gr.Button("🔄 刷新任务列表")
+                        load_job_btn = gr.Button("📂 加载选中任务结果")
+
         # --- Event Handlers Binding ---
         api_form_outputs = [
             api_name,
@@ -488,6 +703,8 @@ def create_generation_ui():
             presence_penalty,
             api_provider,
             base_url,
+            rpm_limit,
+            tpm_limit,
         ]
         all_sliders = [
             num_to_generate,
@@ -550,6 +767,8 @@ def create_generation_ui():
                 top_p,
                 frequency_penalty,
                 presence_penalty,
+                rpm_limit,
+                tpm_limit,
             ],
             outputs=[api_config, api_config_list],
         )
@@ -636,8 +855,27 @@ def create_generation_ui():
                 template_selector,
                 template_map_state,
                 prompt_preview,
+                auto_commit,
+                stream_output,
+                avoid_topics,
             ],
             outputs=[generation_status, results_preview, current_batch_state],
+            # 生成在后台执行器中进行，这里只轮询进度，允许多个任务同时运行
+            concurrency_limit=None,
+        )
+
+        # Events for the job list
+        def on_select_job(df: pd.DataFrame, evt: gr.SelectData):
+            if evt.index is None:
+                return None
+            return df.iloc[evt.index[0]]["任务ID"]
+
+        refresh_jobs_btn.click(refresh_jobs, outputs=[jobs_list])
+        jobs_list.select(on_select_job, [jobs_list], selected_job_id_state)
+        load_job_btn.click(
+            load_job_results,
+            inputs=[selected_job_id_state],
+            outputs=[generation_status, results_preview, current_batch_state],
         )
 
         # Event for the "Save Results" button
@@ -0,0 +1,178 @@
+"""
+Registry of pooled, reusable OpenAI clients.
+
+Clients are keyed by (api_key, base_url) so every request to the same endpoint
+reuses one keep-alive HTTP connection pool (HTTP/2 when the optional `h2`
+package is installed) instead of paying for a new DNS lookup and TLS handshake
+per call. Async clients are additionally keyed by the event loop they were
+created on, because httpx async pools cannot be shared across loops.
+
+The SDK's own retries are disabled (max_retries=0): RetryPolicy is the only
+retry layer, so every failed HTTP call is classified, counted by the circuit
+breaker and backed off exactly once.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# 超过该时间未被使用的客户端会被关闭并移出注册表
+CLIENT_IDLE_TIMEOUT_SECONDS = float(os.getenv("LLM_CLIENT_IDLE_TIMEOUT_SECONDS", "900"))
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+
+class _PooledClient:
+    def __init__(self, client, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.client = client
+        self.loop = loop
+        self.last_used = time.monotonic()
+
+
+_async_clients: Dict[Tuple, _PooledClient] = {}
+_sync_clients: Dict[Tuple, _PooledClient] = {}
+_lock = threading.Lock()
+
+
+def _client_key(api_key: str, base_url: Optional[str]) -> Tuple[str, Optional[str]]:
+    return api_key.strip(), (base_url.strip() or None) if base_url else None
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def _close_async_entry(entry: _PooledClient, wait: bool = False):
+    """在客户端所属的事件循环上关闭它；事件循环已关闭时直接丢弃。"""
+    if entry.loop.is_closed():
+        return
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+
+    if entry.loop is running_loop:
+        entry.loop.create_task(entry.client.close())
+    elif entry.loop.is_running():
+        future = asyncio.run_coroutine_threadsafe(entry.client.close(), entry.loop)
+        if wait:
+            try:
+                future.result(timeout=5)
+            except Exception as e:
+                logger.warning(f"关闭异步客户端失败: {e}")
+    elif running_loop is None:
+        entry.loop.run_until_complete(entry.client.close())
+
+
+def _evict_idle_locked():
+    """关闭空闲超时的客户端，以及所属事件循环已关闭的异步客户端。调用方需持有 _lock。"""
+    now = time.monotonic()
+    for key, entry in list(_async_clients.items()):
+        if entry.loop.is_closed():
+            del _async_clients[key]
+        elif now - entry.last_used > CLIENT_IDLE_TIMEOUT_SECONDS:
+            del _async_clients[key]
+            _close_async_entry(entry)
+    for key, entry in list(_sync_clients.items()):
+        if now - entry.last_used > CLIENT_IDLE_TIMEOUT_SECONDS:
+            del _sync_clients[key]
+            entry.client.close()
+
+
+def get_async_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """获取绑定到当前事件循环的共享 AsyncOpenAI 客户端，必须在事件循环中调用。"""
+    loop = asyncio.get_running_loop()
+    api_key, base_url = _client_key(api_key, base_url)
+    key = (api_key, base_url, loop)
+    with _lock:
+        _evict_idle_locked()
+        entry = _async_clients.get(key)
+        if entry is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=DefaultAsyncHttpxClient(
+                    http2=HTTP2_ENABLED, limits=_pool_limits()
+                ),
+            )
+            entry = _PooledClient(client, loop)
+            _async_clients[key] = entry
+            logger.info(
+                f"创建新的异步客户端连接池: {base_url or 'default'} (HTTP/2: {HTTP2_ENABLED})"
+            )
+        entry.last_used = time.monotonic()
+        return entry.client
+
+
+def get_sync_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """获取共享的同步 OpenAI 客户端。"""
+    key = _client_key(api_key, base_url)
+    with _lock:
+        _evict_idle_locked()
+        entry = _sync_clients.get(key)
+        if entry is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                max_retries=0,
+                http_client=DefaultHttpxClient(
+                    http2=HTTP2_ENABLED, limits=_pool_limits()
+                ),
+            )
+            entry = _PooledClient(client)
+            _sync_clients[key] = entry
+            logger.info(f"创建新的同步客户端连接池: {key[1] or 'default'}")
+        entry.last_used = time.monotonic()
+        return entry.client
+
+
+async def close_loop_clients():
+    """关闭绑定到当前事件循环的所有异步客户端，应在关闭事件循环之前调用。"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        entries = [
+            _async_clients.pop(key)
+            for key, entry in list(_async_clients.items())
+            if entry.loop is loop
+        ]
+    for entry in entries:
+        await entry.client.close()
+
+
+def close_all():
+    """关闭所有客户端，在应用退出时调用。"""
+    with _lock:
+        async_entries = list(_async_clients.values())
+        sync_entries = list(_sync_clients.values())
+        _async_clients.clear()
+        _sync_clients.clear()
+
+    for entry in async_entries:
+        try:
+            _close_async_entry(entry, wait=True)
+        except Exception as e:
+            logger.warning(f"关闭异步客户端失败: {e}")
+    for entry in sync_entries:
+        try:
+            entry.client.close()
+        except Exception as e:
+            logger.warning(f"关闭同步客户端失败: {e}")
+    logger.info(
+        f"已关闭 {len(async_entries)} 个异步客户端和 {len(sync_entries)} 个同步客户端"
+    )
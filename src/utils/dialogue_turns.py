@@ -0,0 +1,94 @@
+"""
+Helpers that derive per-row columns from a corpus dialogue.
+
+Corpus.dialogue stays the canonical JSON blob; the dialogue_turns table and
+the Corpus.turn_count/char_count/content_hash columns are derived from it with
+the functions below, both when corpus rows are inserted and when migrations
+backfill existing rows, so the two paths cannot disagree.
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def dialogue_messages(dialogue_data) -> Optional[list]:
+    """取出对话数据中的 dialogues 列表，dialogue_data 可以是 JSON 文本；结构不符时返回 None"""
+    if isinstance(dialogue_data, str):
+        try:
+            dialogue_data = json.loads(dialogue_data)
+        except ValueError:
+            return None
+    if not isinstance(dialogue_data, dict):
+        return None
+    dialogues = dialogue_data.get("dialogues")
+    return dialogues if isinstance(dialogues, list) else None
+
+
+def dialogue_metrics(dialogue_data) -> Tuple[int, int]:
+    """返回 (消息条数, 字符数)，即写入 Corpus.turn_count / char_count 的值"""
+    dialogues = dialogue_messages(dialogue_data)
+    if dialogues is None:
+        return 0, 0
+    chars = sum(
+        len(turn["content"])
+        for turn in dialogues
+        if isinstance(turn, dict) and isinstance(turn.get("content"), str)
+    )
+    return len(dialogues), chars
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(value: Optional[str]) -> str:
+    """NFKC 规范化并合并空白，只差在全半角或空白上的对话视为相同"""
+    if value is None:
+        return ""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", value)).strip()
+
+
+def content_hash(dialogue_data) -> Optional[str]:
+    """
+    对话内容的规范化哈希，只包含各条消息的 role 和 content，
+    不包含 batch_id、生成时间、场景标签等元数据。无法解析的对话返回 None。
+    """
+    dialogues = dialogue_messages(dialogue_data)
+    if dialogues is None:
+        return None
+    messages = [
+        [
+            normalize_text(_turn_text(turn.get("role"))),
+            normalize_text(_turn_text(turn.get("content"))),
+        ]
+        for turn in dialogues
+        if isinstance(turn, dict)
+    ]
+    payload = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _turn_text(value) -> Optional[str]:
+    """消息的 role/content 以文本存储，非字符串值保存为紧凑 JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def dialogue_turn_rows(corpus_id: int, dialogue_data) -> List[Dict[str, Any]]:
+    """把一条语料的 dialogues 数组拆成 dialogue_turns 行，非字典的消息不保存"""
+    dialogues = dialogue_messages(dialogue_data)
+    if dialogues is None:
+        return []
+    return [
+        {
+            "corpus_id": corpus_id,
+            "idx": idx,
+            "role": _turn_text(turn.get("role")),
+            "content": _turn_text(turn.get("content")),
+        }
+        for idx, turn in enumerate(dialogues)
+        if isinstance(turn, dict)
+    ]
@@ -0,0 +1,120 @@
+"""
+File writers for corpus exports.
+
+JSONL can be written plain, gzip-compressed or zstd-compressed; compression is
+applied while streaming, so the uncompressed file never exists on disk. The
+Parquet writer stores training records as `messages` plus flat metadata
+columns and flushes a row group every ROW_GROUP_SIZE rows, so memory stays
+bounded and trainers can memory-map the result. zstd needs the optional
+`zstandard` package and Parquet the optional `pyarrow` package.
+"""
+
+import gzip
+import importlib.util
+import io
+from typing import Any, Dict, List
+
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+
+JSONL_EXTENSIONS = {
+    COMPRESSION_NONE: ".jsonl",
+    COMPRESSION_GZIP: ".jsonl.gz",
+    COMPRESSION_ZSTD: ".jsonl.zst",
+}
+
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# 未压缩文件的写缓冲区大小（字节）
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Parquet 每个行组的行数
+ROW_GROUP_SIZE = 10000
+
+
+def open_jsonl_writer(filepath: str, compression: str = COMPRESSION_NONE):
+    """打开一个文本写入流，写入的内容按 compression 流式压缩"""
+    if compression == COMPRESSION_NONE:
+        return open(filepath, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+    if compression == COMPRESSION_GZIP:
+        return gzip.open(filepath, "wt", encoding="utf-8", compresslevel=GZIP_LEVEL)
+    if compression == COMPRESSION_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise ValueError("zstd 压缩需要安装 zstandard: pip install zstandard")
+        import zstandard
+
+        raw = open(filepath, "wb")
+        compressed = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw)
+        return io.TextIOWrapper(
+            io.BufferedWriter(compressed, WRITE_BUFFER_SIZE), encoding="utf-8"
+        )
+    raise ValueError(f"不支持的压缩格式: {compression}")
+
+
+class TrainingParquetWriter:
+    """
+    将标准训练格式记录写入 Parquet：messages 为 list<struct<role, content>>，
+    metadata 拆分为 dataset / character / scenarios / corpus_id 列。
+    """
+
+    def __init__(self, filepath: str, row_group_size: int = ROW_GROUP_SIZE):
+        if not PARQUET_AVAILABLE:
+            raise ValueError("Parquet 导出需要安装 pyarrow: pip install pyarrow")
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.schema = pa.schema(
+            [
+                (
+                    "messages",
+                    pa.list_(
+                        pa.struct([("role", pa.string()), ("content", pa.string())])
+                    ),
+                ),
+                ("dataset", pa.string()),
+                ("character", pa.string()),
+                ("scenarios", pa.list_(pa.string())),
+                ("corpus_id", pa.int64()),
+            ]
+        )
+        self._writer = pq.ParquetWriter(filepath, self.schema, compression="zstd")
+        self._row_group_size = row_group_size
+        self._rows: List[Dict[str, Any]] = []
+        self.row_count = 0
+
+    def write(self, entry: Dict[str, Any]):
+        """写入一条 {"messages": [...], "metadata": {...}} 记录"""
+        metadata = entry.get("metadata", {})
+        self._rows.append(
+            {
+                "messages": entry["messages"],
+                "dataset": metadata.get("dataset"),
+                "character": metadata.get("character"),
+                "scenarios": metadata.get("scenarios", []),
+                "corpus_id": metadata.get("corpus_id"),
+            }
+        )
+        if len(self._rows) >= self._row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+        self._writer.write_table(table)
+        self.row_count += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
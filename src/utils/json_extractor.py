@@ -0,0 +1,290 @@
+"""
+Extraction and repair of the JSON payload in LLM responses.
+
+Models often wrap the JSON in <think> blocks, Markdown code fences (```json,
+```JSON or a bare ```), or leading and trailing prose. Some responses also
+contain trailing commas or raw newlines inside strings, or are cut off inside
+the last element. extract_conversations() finds the outermost JSON array or
+object in one linear scan and applies only the repairs that are needed.
+Process-wide counters record what fraction of responses needed each repair.
+"""
+
+import json
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.utils.json_stream import ConversationStreamParser
+
+logger = logging.getLogger(__name__)
+
+REPAIR_THINK_TAGS = "think_tags"
+REPAIR_CODE_FENCE = "code_fence"
+REPAIR_SURROUNDING_TEXT = "surrounding_text"
+REPAIR_TRAILING_COMMA = "trailing_comma"
+REPAIR_UNESCAPED_CONTROL = "unescaped_control"
+REPAIR_TRUNCATED = "truncated"
+
+REPAIR_LABELS = {
+    REPAIR_THINK_TAGS: "思考标签",
+    REPAIR_CODE_FENCE: "代码块",
+    REPAIR_SURROUNDING_TEXT: "前后说明文字",
+    REPAIR_TRAILING_COMMA: "尾随逗号",
+    REPAIR_UNESCAPED_CONTROL: "未转义换行",
+    REPAIR_TRUNCATED: "截断",
+}
+
+# 依次尝试的候选 JSON 片段数量上限（跳过说明文字中的 [1] 之类的片段）
+MAX_CANDIDATES = 5
+
+_THINK_BLOCK = re.compile(r"<think>.*?(?:</think>|$)", re.S | re.I)
+_CODE_FENCE = re.compile(r"```[\w-]*[^\S\n]*\n?(.*?)(?:```|$)", re.S)
+_JSON_OPENER = re.compile(r"[\[{]")
+_STRUCTURAL_CHARS = re.compile(r'[\[\]{}"]')
+_STRING_CHARS = re.compile(r'["\\]')
+_SANITIZE_OUTSIDE = re.compile(r'[",]')
+_SANITIZE_INSIDE = re.compile(r'["\\\x00-\x1f]')
+_NEXT_NON_SPACE = re.compile(r"\S")
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _find_json_end(text: str, start: int) -> Tuple[int, bool]:
+    """从 start 处的 [ 或 { 开始扫描，返回 (结束位置, 是否完整闭合)"""
+    depth = 0
+    pos = start
+    in_string = False
+    while True:
+        if in_string:
+            match = _STRING_CHARS.search(text, pos)
+            if not match:
+                return len(text), False
+            pos = match.end()
+            if match.group() == "\\":
+                pos += 1
+            else:
+                in_string = False
+            continue
+        match = _STRUCTURAL_CHARS.search(text, pos)
+        if not match:
+            return len(text), False
+        pos = match.end()
+        char = match.group()
+        if char == '"':
+            in_string = True
+        elif char in "[{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos, True
+
+
+def _json_candidates(text: str):
+    """依次产出文本中顶层 JSON 片段的 (起点, 终点, 是否闭合)"""
+    pos = 0
+    for _ in range(MAX_CANDIDATES):
+        match = _JSON_OPENER.search(text, pos)
+        if not match:
+            return
+        end, closed = _find_json_end(text, match.start())
+        yield match.start(), end, closed
+        if not closed:
+            return
+        pos = end
+
+
+def repair_json_text(text: str) -> Tuple[str, Set[str]]:
+    """
+    一次线性扫描修复尾随逗号和字符串中未转义的控制字符，
+    返回 (修复后的文本, 应用的修复项)。
+    """
+    pieces = []
+    repairs = set()
+    pos = last = 0
+    in_string = False
+    while True:
+        pattern = _SANITIZE_INSIDE if in_string else _SANITIZE_OUTSIDE
+        match = pattern.search(text, pos)
+        if not match:
+            break
+        char, index, pos = match.group(), match.start(), match.end()
+        if in_string:
+            if char == "\\":
+                pos += 1
+            elif char == '"':
+                in_string = False
+            else:
+                pieces.append(text[last:index])
+                pieces.append(_CONTROL_ESCAPES.get(char, f"\\u{ord(char):04x}"))
+                last = pos
+                repairs.add(REPAIR_UNESCAPED_CONTROL)
+        elif char == '"':
+            in_string = True
+        else:
+            following = _NEXT_NON_SPACE.search(text, pos)
+            if following and following.group() in "]}":
+                pieces.append(text[last:index])
+                last = pos
+                repairs.add(REPAIR_TRAILING_COMMA)
+    if not repairs:
+        return text, repairs
+    pieces.append(text[last:])
+    return "".join(pieces), repairs
+
+
+def _as_conversations(value: Any) -> Optional[List[Dict[str, Any]]]:
+    if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+        return value
+    if isinstance(value, dict) and isinstance(value.get("conversations"), list):
+        return value["conversations"]
+    return None
+
+
+def _parse_candidate(text: str) -> Tuple[Optional[List[Dict[str, Any]]], Set[str]]:
+    try:
+        return _as_conversations(json.loads(text)), set()
+    except json.JSONDecodeError:
+        pass
+
+    repaired, repairs = repair_json_text(text)
+    if repairs:
+        try:
+            return _as_conversations(json.loads(repaired)), repairs
+        except json.JSONDecodeError:
+            pass
+
+    # 仍无法解析时（通常是最后一个元素被截断），保留所有完整的对话
+    parser = ConversationStreamParser(repair=repair_json_text)
+    conversations = parser.feed(repaired)
+    if not conversations:
+        return None, repairs
+    repairs |= parser.repairs
+    if parser.truncated:
+        repairs.add(REPAIR_TRUNCATED)
+    return conversations, repairs
+
+
+def extract_conversations(
+    text: str,
+) -> Tuple[Optional[List[Dict[str, Any]]], Set[str]]:
+    """
+    从模型响应中提取对话列表，返回 (对话列表, 应用的修复项)。
+    无法提取时对话列表为 None。每次调用都会计入修复统计。
+    """
+    repairs = set()
+    body = text or ""
+
+    without_think = _THINK_BLOCK.sub("", body)
+    if len(without_think) != len(body):
+        repairs.add(REPAIR_THINK_TAGS)
+        body = without_think
+
+    fence = _CODE_FENCE.search(body)
+    if fence and _JSON_OPENER.search(fence.group(1)):
+        repairs.add(REPAIR_CODE_FENCE)
+        outside = body[: fence.start()] + body[fence.end() :]
+        body = fence.group(1)
+    else:
+        outside = ""
+
+    conversations = None
+    for start, end, _ in _json_candidates(body):
+        conversations, candidate_repairs = _parse_candidate(body[start:end])
+        if conversations is not None:
+            repairs |= candidate_repairs
+            if outside.strip() or body[:start].strip() or body[end:].strip():
+                repairs.add(REPAIR_SURROUNDING_TEXT)
+            break
+
+    record_repairs(repairs, conversations is not None)
+    return conversations, repairs
+
+
+class ThinkTagFilter:
+    """流式去除响应开头的 <think>...</think> 块，其余文本原样输出"""
+
+    _OPEN = "<think>"
+    _CLOSE = "</think>"
+
+    def __init__(self):
+        self._pending = ""
+        self._in_think = False
+        self._done = False
+        self.found = False
+
+    def feed(self, text: str) -> str:
+        if self._done:
+            return text
+        self._pending += text
+        if not self._in_think:
+            head = self._pending.lstrip()[: len(self._OPEN)].lower()
+            if not head or (
+                len(head) < len(self._OPEN) and self._OPEN.startswith(head)
+            ):
+                return ""
+            if head != self._OPEN:
+                self._done = True
+                output, self._pending = self._pending, ""
+                return output
+            self._in_think = True
+            self.found = True
+        # 只在新到达的文本附近查找结束标签，避免重复扫描整个思考内容
+        search_from = max(0, len(self._pending) - len(text) - len(self._CLOSE))
+        end = self._pending[search_from:].lower().find(self._CLOSE)
+        if end < 0:
+            return ""
+        self._done = True
+        output = self._pending[search_from + end + len(self._CLOSE) :]
+        self._pending = ""
+        return output
+
+
+def record_repairs(repairs: Set[str], success: bool = True):
+    """记录一次响应的解析结果"""
+    with _stats_lock:
+        _stats["responses"] += 1
+        if not success:
+            _stats["failed"] += 1
+        for repair in repairs:
+            _stats[repair] += 1
+
+
+def get_repair_stats() -> Dict[str, Any]:
+    """返回已解析响应数、失败比例，以及需要每种修复的响应比例"""
+    with _stats_lock:
+        responses = _stats["responses"]
+        return {
+            "responses": responses,
+            "failed": _stats["failed"] / responses if responses else 0.0,
+            "repairs": {
+                repair: (_stats[repair] / responses if responses else 0.0)
+                for repair in REPAIR_LABELS
+            },
+        }
+
+
+def format_repair_stats() -> str:
+    """格式化修复统计，用于界面展示"""
+    stats = get_repair_stats()
+    if not stats["responses"]:
+        return ""
+    repairs = "，".join(
+        f"{REPAIR_LABELS[repair]} {fraction:.0%}"
+        for repair, fraction in stats["repairs"].items()
+        if fraction
+    )
+    return (
+        f"响应解析（本次运行累计 {stats['responses']} 个）: 失败 {stats['failed']:.0%}"
+        + (f"，需要修复: {repairs}" if repairs else "")
+    )
+
+
+def reset_repair_stats():
+    """清空修复统计（主要用于测试）。"""
+    with _stats_lock:
+        _stats.clear()
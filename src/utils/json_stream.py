@@ -0,0 +1,199 @@
+"""
+Incremental parser for the `conversations` array in LLM responses.
+
+The parser is fed raw text, either streamed chunks or a complete response, and
+returns each conversation object as soon as its closing brace arrives. It
+accepts a bare top-level array of objects or an object with a "conversations"
+key, and it ignores any text before the JSON starts, such as a ```json fence
+or a bracketed aside like "[see below]". Objects that
+were closed before the output was cut off are still returned, so a response
+truncated by max_tokens keeps every complete conversation.
+"""
+
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 字符串外需要关注的字符，以及字符串内需要关注的字符
+_STRUCTURAL_CHARS = re.compile(r'[\[\]{}"]')
+_STRING_CHARS = re.compile(r'["\\]')
+_CONVERSATIONS_KEY = re.compile(r'"conversations"\s*:\s*$')
+_NEXT_NON_SPACE = re.compile(r"\S")
+# 尚未找到对话数组时，为匹配 "conversations" 键保留的末尾文本长度
+_KEY_LOOKBEHIND = 64
+
+
+class ConversationStreamParser:
+    """
+    增量解析对话数组：feed() 返回本次输入中新闭合的对话对象。
+
+    只扫描结构字符并跟踪字符串与嵌套深度，每个字符最多扫描一次；
+    已解析的文本会被丢弃，缓冲区只保留当前未闭合的对话。
+    传入 repair(text) -> (修复后的文本, 修复项) 时，无法解析的对话会先尝试修复。
+    """
+
+    def __init__(self, repair: Callable[[str], Tuple[str, Set[str]]] = None):
+        self._repair = repair
+        self.repairs: Set[str] = set()
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self.finished = False
+        self.parsed_count = 0
+        self.error_count = 0
+
+    @property
+    def found_array(self) -> bool:
+        return self._array_depth is not None
+
+    @property
+    def truncated(self) -> bool:
+        """对话数组已开始但尚未闭合，说明输出被截断"""
+        return self.found_array and not self.finished
+
+    @property
+    def pending_text(self) -> str:
+        """尚未闭合的最后一个对话的文本，没有时为空字符串"""
+        if self._item_start is None:
+            return ""
+        return self._buffer[self._item_start :]
+
+    def _is_target_array(self, index: int) -> Optional[bool]:
+        """
+        判断 index 处尚未入栈的 [ 是否为对话数组：顶层数组的第一个元素必须是对象，
+        对象内的数组必须在 "conversations" 键下。还看不到第一个元素时返回 None。
+        """
+        if not self._stack:
+            first = _NEXT_NON_SPACE.search(self._buffer, index + 1)
+            if first is None:
+                return None
+            return first.group() == "{"
+        return (
+            len(self._stack) == 1
+            and self._stack[0] == "{"
+            and _CONVERSATIONS_KEY.search(
+                self._buffer, max(0, index - _KEY_LOOKBEHIND), index
+            )
+            is not None
+        )
+
+    def _parse_item(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError as e:
+            item = self._parse_repaired(text)
+            if item is None:
+                self.error_count += 1
+                logger.debug(f"跳过无法解析的对话对象: {e}")
+                return None
+        if not isinstance(item, dict):
+            self.error_count += 1
+            return None
+        self.parsed_count += 1
+        return item
+
+    def _parse_repaired(self, text: str) -> Any:
+        if not self._repair:
+            return None
+        repaired, repairs = self._repair(text)
+        if not repairs:
+            return None
+        try:
+            item = json.loads(repaired)
+        except json.JSONDecodeError:
+            return None
+        self.repairs |= repairs
+        return item
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """输入一段文本，返回其中新闭合的对话对象"""
+        if self.finished or not text:
+            return []
+        self._buffer += text
+        buf = self._buffer
+        pos = self._pos
+        items = []
+
+        while pos < len(buf):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    pos += 1
+                    continue
+                match = _STRING_CHARS.search(buf, pos)
+                if not match:
+                    pos = len(buf)
+                    break
+                pos = match.end()
+                if match.group() == "\\":
+                    self._escape = True
+                else:
+                    self._in_string = False
+                continue
+
+            match = _STRUCTURAL_CHARS.search(buf, pos)
+            if not match:
+                pos = len(buf)
+                break
+            char, index, pos = match.group(), match.start(), match.end()
+
+            if char == '"':
+                # JSON 开始之前的引号属于说明文字，不进入字符串状态
+                self._in_string = bool(self._stack)
+            elif char in "[{":
+                is_target = False
+                if char == "[" and self._array_depth is None:
+                    is_target = self._is_target_array(index)
+                    if is_target is None:
+                        # 等待更多输入，再根据数组的第一个元素判断
+                        pos = index
+                        break
+                self._stack.append(char)
+                depth = len(self._stack)
+                if self._array_depth is None:
+                    if is_target:
+                        self._array_depth = depth
+                elif char == "{" and depth == self._array_depth + 1:
+                    self._item_start = index
+            elif self._stack:
+                depth = len(self._stack)
+                self._stack.pop()
+                if self._array_depth is None:
+                    continue
+                if (
+                    char == "}"
+                    and depth == self._array_depth + 1
+                    and self._item_start is not None
+                ):
+                    item = self._parse_item(buf[self._item_start : pos])
+                    self._item_start = None
+                    if item is not None:
+                        items.append(item)
+                elif depth == self._array_depth:
+                    self.finished = True
+                    break
+
+        # 丢弃已处理的文本
+        if self._item_start is not None:
+            keep_from = self._item_start
+        elif self._array_depth is None:
+            keep_from = max(0, pos - _KEY_LOOKBEHIND)
+        else:
+            keep_from = pos
+        self._buffer = buf[keep_from:]
+        self._pos = pos - keep_from
+        if self._item_start is not None:
+            self._item_start -= keep_from
+        return items
+
+
+def salvage_conversations(text: str) -> List[Dict[str, Any]]:
+    """从完整但可能被截断或部分损坏的响应中取出所有完整的对话对象"""
+    return ConversationStreamParser().feed(text)
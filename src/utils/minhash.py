@@ -0,0 +1,143 @@
+"""
+MinHash signatures and LSH banding for near-duplicate detection.
+
+A conversation is represented by the set of character n-grams of its
+assistant turns. Shingles are hashed from Unicode code points with numpy and
+MinHash uses multiply-shift hashing, so signing a conversation has no
+per-character Python loop. find_similar_pairs() bands the signatures, sorts
+each band's keys to find rows that share a bucket and verifies each
+candidate against its bucket leader with the estimated Jaccard similarity,
+so the cost grows with n log n instead of n² pairwise comparisons.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from src.utils.dialogue_turns import dialogue_messages, normalize_text
+
+# 签名长度 = 分带数 × 每带行数；阈值约为 (1/BANDS)^(1/ROWS_PER_BAND) ≈ 0.5
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+# 字符 n-gram 的长度，中文对话以 3 个字为宜
+SHINGLE_SIZE = 3
+SIGNATURE_DTYPE = np.dtype("<u4")
+
+# 固定种子，签名在不同进程与版本间保持一致
+_rng = np.random.default_rng(0x5EED)
+_PERM_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_PERM_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_SHINGLE_BASE = np.uint64(0x100000001B3)
+
+
+def assistant_text(dialogue_data) -> str:
+    """拼接对话中 assistant 消息的规范化文本"""
+    dialogues = dialogue_messages(dialogue_data) or []
+    return "\n".join(
+        normalize_text(turn["content"])
+        for turn in dialogues
+        if isinstance(turn, dict)
+        and turn.get("role") == "assistant"
+        and isinstance(turn.get("content"), str)
+    )
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """文本各个字符 n-gram 的 uint64 哈希（可能重复，不影响 MinHash 的最小值）"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype="<u4").astype(np.uint64)
+    if len(codes) < size:
+        return np.empty(0, dtype=np.uint64)
+    hashes = codes[: len(codes) - size + 1].copy()
+    for offset in range(1, size):
+        hashes = hashes * _SHINGLE_BASE ^ codes[offset : len(codes) - size + 1 + offset]
+    return hashes
+
+
+def signature(dialogue_data) -> Optional[bytes]:
+    """对话 assistant 文本的 MinHash 签名，文本短于一个 n-gram 时返回 None"""
+    hashes = shingle_hashes(assistant_text(dialogue_data))
+    if not len(hashes):
+        return None
+    # multiply-shift：取 a*x+b（模 2^64）的高 32 位作为第 i 个哈希函数的值；
+    # 右移是单调的，先取最小值再右移，结果相同
+    values = np.multiply.outer(hashes, _PERM_A)
+    values += _PERM_B
+    minimum = values.min(axis=0) >> np.uint64(32)
+    return minimum.astype(SIGNATURE_DTYPE).tobytes()
+
+
+def signatures_to_array(blobs) -> np.ndarray:
+    """把签名字节串列表转换为 (n, NUM_PERM) 的 uint32 数组"""
+    if not blobs:
+        return np.empty((0, NUM_PERM), dtype=SIGNATURE_DTYPE)
+    return np.frombuffer(b"".join(blobs), dtype=SIGNATURE_DTYPE).reshape(-1, NUM_PERM)
+
+
+def _band_keys(signatures: np.ndarray, band: int) -> np.ndarray:
+    rows = signatures[:, band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND]
+    keys = np.zeros(len(signatures), dtype=np.uint64)
+    for column in range(ROWS_PER_BAND):
+        keys = keys * _SHINGLE_BASE ^ rows[:, column].astype(np.uint64)
+    return keys
+
+
+def find_similar_pairs(signatures: np.ndarray, threshold: float):
+    """
+    LSH 分带找出候选对，并按签名估计的 Jaccard 相似度过滤。
+
+    Returns:
+        (left, right, similarity) 三个等长数组，left/right 为行下标
+    """
+    lefts, rights, similarities = [], [], []
+    for band in range(BANDS):
+        keys = _band_keys(signatures, band)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        is_start = np.empty(len(order), dtype=bool)
+        is_start[:1] = True
+        is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        # 每个桶与桶内第一行比较
+        leaders = order[np.flatnonzero(is_start)[np.cumsum(is_start) - 1]]
+        members = ~is_start
+        left, right = leaders[members], order[members]
+        if not len(left):
+            continue
+        similarity = (signatures[left] == signatures[right]).mean(axis=1)
+        matched = similarity >= threshold
+        lefts.append(left[matched])
+        rights.append(right[matched])
+        similarities.append(similarity[matched])
+    if not lefts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+    return np.concatenate(lefts), np.concatenate(rights), np.concatenate(similarities)
+
+
+def similarity_to(signatures: np.ndarray, rows, row: int) -> np.ndarray:
+    """rows 中每一行与 row 的估计 Jaccard 相似度"""
+    return (signatures[rows] == signatures[row]).mean(axis=1)
+
+
+def cluster_pairs(size: int, left: np.ndarray, right: np.ndarray) -> list:
+    """
+    用并查集把相似对合并为簇，返回行下标列表的列表（只含两行以上的簇）。
+    簇可以经由传递形成（A~B、B~C），簇内任意两行不一定彼此相似。
+    """
+    parent = list(range(size))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in zip(left.tolist(), right.tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    clusters = {}
+    for i in set(left.tolist()) | set(right.tolist()):
+        clusters.setdefault(find(i), []).append(i)
+    return [sorted(members) for members in clusters.values() if len(members) > 1]
@@ -0,0 +1,124 @@
+"""
+Process-wide LRU cache of rendered generation prompts.
+
+Rendering a prompt needs the dataset, its character and scenarios from the
+database plus the template file from disk. A cached prompt is keyed by the
+dataset id, the render parameters, a stat() stamp of the template file and
+the versions of its sources: the ids and updated_at (created_at before the
+first update) of the dataset, its character and its scenarios. The versions
+come from the database, so a save made by another process is noticed too; a
+cache hit costs one small indexed query and a stat() instead of loading the
+ORM objects and reading the template.
+
+Every entry is tagged with the sources it was rendered from. Saves in this
+process drop just the entries tagged with the changed dataset, character or
+character's scenarios, which also covers two saves within the same second
+(updated_at has second resolution). Template files need no invalidation,
+their stat stamp is part of the key.
+
+Callers take generation() before reading the sources and pass it to put(): a
+prompt rendered concurrently with an invalidation is then not stored.
+"""
+
+import functools
+import inspect
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional, Tuple
+
+SOURCE_DATASET = "dataset"
+SOURCE_CHARACTER = "character"
+# 场景按所属角色的ID标记，数据集只会关联其角色下的场景
+SOURCE_SCENARIO = "scenario"
+
+# 最多缓存的提示词数量
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "128"))
+
+# key -> (prompt, tags)
+_entries: "OrderedDict[Hashable, Tuple[str, frozenset]]" = OrderedDict()
+_generation = 0
+_stats = {"hits": 0, "misses": 0}
+_lock = threading.Lock()
+
+
+def generation() -> int:
+    """失效计数，每次 invalidate() 加一"""
+    with _lock:
+        return _generation
+
+
+def template_stamp(template_path: str) -> Tuple[int, int]:
+    """模板文件的 (修改时间, 大小)，文件不存在时抛出 FileNotFoundError"""
+    stat = os.stat(template_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get(key: Hashable) -> Optional[str]:
+    """读取缓存的提示词并标记为最近使用，未命中时返回 None"""
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return entry[0]
+
+
+def put(
+    key: Hashable,
+    prompt: str,
+    tags: Iterable[Tuple[str, Hashable]],
+    since: int,
+):
+    """
+    缓存提示词，tags 为其依赖的 (来源, ID)；since 为读取数据前取得的
+    generation()，其后发生过失效时不缓存。超出容量时淘汰最久未使用的条目。
+    """
+    with _lock:
+        if since != _generation:
+            return
+        _entries[key] = (prompt, frozenset(tags))
+        _entries.move_to_end(key)
+        while len(_entries) > PROMPT_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate(source: str, source_id: Hashable):
+    """数据来源变更后调用，删除依赖 (source, source_id) 的缓存条目"""
+    global _generation
+    tag = (source, source_id)
+    with _lock:
+        _generation += 1
+        for key in [key for key, (_, tags) in _entries.items() if tag in tags]:
+            del _entries[key]
+
+
+def invalidates(source: str, id_param: str):
+    """
+    装饰保存函数：函数结束（提交事务）后按参数 id_param 的值使相应来源的缓存
+    失效，出错时也会失效；参数为空（新建）时没有可失效的条目。
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            source_id = signature.bind(*args, **kwargs).arguments.get(id_param)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if source_id:
+                    invalidate(source, source_id)
+
+        return wrapper
+
+    return decorator
+
+
+def stats() -> dict:
+    """缓存命中统计"""
+    with _lock:
+        return {**_stats, "size": len(_entries)}
@@ -0,0 +1,166 @@
+"""
+Token-bucket rate limiting for LLM API calls.
+
+Limiters are keyed by ApiConfig name and shared by the whole process, so every
+generation job and every Gradio session using the same API config draws from
+the same requests-per-minute (RPM) and tokens-per-minute (TPM) budgets.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数量。
+    CJK字符按每字1个token计算，其余字符按每4个字符1个token计算。
+    """
+    if not text:
+        return 0
+    cjk_chars = sum(
+        1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uf900" <= ch <= "\uffef"
+    )
+    return cjk_chars + math.ceil((len(text) - cjk_chars) / 4)
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为 capacity，每秒补充 refill_rate 个令牌。
+
+    reserve() 允许预支令牌（余额可以为负），返回调用方需要等待的秒数，
+    这样等待者按预约顺序依次放行，不会出现饥饿。
+    """
+
+    def __init__(
+        self,
+        capacity: float,
+        refill_rate: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self._clock = clock
+        self._tokens = float(capacity)
+        self._updated_at = clock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = max(0.0, now - self._updated_at)
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_rate)
+        self._updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """预约 amount 个令牌，返回需要等待的秒数。单次预约不会超过桶容量。"""
+        self._refill()
+        self._tokens -= min(float(amount), self.capacity)
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.refill_rate
+
+    def refund(self, amount: float):
+        """归还未实际使用的令牌。"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + float(amount))
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+
+class RateLimiter:
+    """
+    同时约束 RPM 与 TPM 的限流器。limit 为 0 或 None 表示不限制该维度。
+
+    内部状态由线程锁保护，等待则通过 asyncio 完成，因此同一个限流器可以被
+    运行在不同线程、不同事件循环中的生成任务共享。
+    """
+
+    def __init__(
+        self,
+        rpm_limit: Optional[int] = None,
+        tpm_limit: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], "asyncio.Future"] = asyncio.sleep,
+    ):
+        self.rpm_limit = rpm_limit or 0
+        self.tpm_limit = tpm_limit or 0
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._request_bucket = (
+            TokenBucket(self.rpm_limit, self.rpm_limit / 60.0, clock)
+            if self.rpm_limit > 0
+            else None
+        )
+        self._token_bucket = (
+            TokenBucket(self.tpm_limit, self.tpm_limit / 60.0, clock)
+            if self.tpm_limit > 0
+            else None
+        )
+
+    def reserve(self, tokens: int) -> float:
+        """为一次请求预约额度，返回需要等待的秒数。"""
+        with self._lock:
+            wait = 0.0
+            if self._request_bucket:
+                wait = max(wait, self._request_bucket.reserve(1))
+            if self._token_bucket:
+                wait = max(wait, self._token_bucket.reserve(tokens))
+            return wait
+
+    async def acquire(self, tokens: int) -> int:
+        """等待直到额度允许发送一次消耗约 tokens 个token的请求，返回预约的token数。"""
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.debug(f"触发本地限流，等待 {wait:.2f} 秒")
+            await self._sleep(wait)
+        return tokens
+
+    def settle(self, reserved_tokens: int, actual_tokens: Optional[int]):
+        """请求完成后按实际用量结算，归还多预约的token。"""
+        if not self._token_bucket or actual_tokens is None:
+            return
+        unused = reserved_tokens - actual_tokens
+        if unused > 0:
+            with self._lock:
+                self._token_bucket.refund(unused)
+
+
+_limiters: Dict[str, RateLimiter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    config_name: str, rpm_limit: Optional[int], tpm_limit: Optional[int]
+) -> RateLimiter:
+    """
+    获取指定API配置的共享限流器。
+    如果配置中的限额发生了变化，则以新的限额重建限流器。
+    """
+    rpm_limit = rpm_limit or 0
+    tpm_limit = tpm_limit or 0
+    with _registry_lock:
+        limiter = _limiters.get(config_name)
+        if (
+            limiter is None
+            or limiter.rpm_limit != rpm_limit
+            or limiter.tpm_limit != tpm_limit
+        ):
+            limiter = RateLimiter(rpm_limit, tpm_limit)
+            _limiters[config_name] = limiter
+            logger.info(
+                f"为API配置 '{config_name}' 创建限流器: RPM={rpm_limit or '不限'}，TPM={tpm_limit or '不限'}"
+            )
+        return limiter
+
+
+def reset_rate_limiters():
+    """清空所有限流器（主要用于测试）。"""
+    with _registry_lock:
+        _limiters.clear()
@@ -0,0 +1,237 @@
+"""
+Retry policy for LLM API calls.
+
+Errors are classified by type: throttling (HTTP 429), timeouts, server errors
+(5xx), connection errors, malformed model output, and fatal errors such as bad
+requests or invalid credentials. Transient errors are retried with exponential
+backoff and full jitter, honouring the server's Retry-After header, while
+malformed output has its own, smaller retry budget. A per-job circuit breaker
+pauses every request of the job when the recent error rate spikes.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+ERROR_THROTTLE = "throttle"
+ERROR_TIMEOUT = "timeout"
+ERROR_SERVER = "server"
+ERROR_CONNECTION = "connection"
+ERROR_MALFORMED = "malformed"
+ERROR_FATAL = "fatal"
+
+TRANSIENT_ERRORS = (ERROR_THROTTLE, ERROR_TIMEOUT, ERROR_SERVER, ERROR_CONNECTION)
+
+# Retry-After 超过该值（秒）时视为异常值，按该上限等待
+MAX_RETRY_AFTER_SECONDS = 300.0
+
+
+class MalformedOutputError(Exception):
+    """模型返回的内容无法解析为预期的结构化输出"""
+
+    def __init__(self, message: str, usage: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        # 即使输出不可用，请求也消耗了token，供限流器结算
+        self.usage = usage or {}
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status if isinstance(status, int) else None
+
+
+def classify_error(error: Exception) -> str:
+    """将异常归类为 throttle / timeout / server / connection / malformed / fatal"""
+    if isinstance(error, MalformedOutputError):
+        return ERROR_MALFORMED
+    # APITimeoutError 是 APIConnectionError 的子类，需要先判断
+    if isinstance(
+        error, (openai.APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError)
+    ):
+        return ERROR_TIMEOUT
+    if isinstance(
+        error, (openai.APIConnectionError, httpx.TransportError, ConnectionError)
+    ):
+        return ERROR_CONNECTION
+
+    status = _status_code(error)
+    if status == 429:
+        return ERROR_THROTTLE
+    if status in (408, 409):
+        return ERROR_TIMEOUT
+    if status is not None and status >= 500:
+        return ERROR_SERVER
+    return ERROR_FATAL
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """从错误响应的 retry-after-ms / Retry-After 头中读取服务商建议的等待秒数"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    # Retry-After 也可以是 HTTP 日期
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """
+    熔断器：统计最近 window_size 次请求的结果，当失败率达到 failure_threshold 时
+    断开 cooldown_seconds 秒，期间同一任务的所有请求都在 wait_closed() 处等待。
+    """
+
+    def __init__(
+        self,
+        window_size: int = 20,
+        min_requests: int = 10,
+        failure_threshold: float = 0.5,
+        cooldown_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+    ):
+        self.min_requests = min_requests
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self._outcomes = deque(maxlen=window_size)
+        self._clock = clock
+        self._sleep = sleep
+        self._open_until = 0.0
+        self.trips = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._clock() < self._open_until
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def record(self, success: bool):
+        """记录一次请求结果，失败率过高时断开熔断器"""
+        if self.is_open:
+            return
+        self._outcomes.append(success)
+        if (
+            len(self._outcomes) >= self.min_requests
+            and self.failure_rate >= self.failure_threshold
+        ):
+            logger.warning(
+                f"最近 {len(self._outcomes)} 次请求失败率 {self.failure_rate:.0%}，"
+                f"暂停任务 {self.cooldown_seconds} 秒"
+            )
+            self._open_until = self._clock() + self.cooldown_seconds
+            self._outcomes.clear()
+            self.trips += 1
+
+    async def wait_closed(self):
+        """熔断器断开时等待其恢复"""
+        while True:
+            remaining = self._open_until - self._clock()
+            if remaining <= 0:
+                return
+            await self._sleep(remaining)
+
+
+class RetryPolicy:
+    """
+    按错误类型重试：临时错误（限流、超时、5xx、连接错误）与输出格式错误分别计数，
+    临时错误按带完全抖动的指数退避等待，并遵守 Retry-After；格式错误立即重试；
+    其余错误（如 400/401）不重试。
+    """
+
+    def __init__(
+        self,
+        max_transient_retries: int = 4,
+        max_malformed_retries: int = 2,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+        rng: Callable[[], float] = random.random,
+    ):
+        self.max_transient_retries = max_transient_retries
+        self.max_malformed_retries = max_malformed_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._rng = rng
+
+    def backoff_delay(self, retry_number: int, retry_after: float = None) -> float:
+        """第 retry_number 次重试（从1开始）前的等待秒数"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (retry_number - 1))
+        delay = self._rng() * ceiling
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_AFTER_SECONDS))
+        return delay
+
+    async def run(
+        self,
+        attempt_fn: Callable[[], Awaitable[Any]],
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ) -> Any:
+        """执行 attempt_fn，按策略重试，重试预算耗尽后抛出最后一次的异常"""
+        transient_retries = 0
+        malformed_retries = 0
+        while True:
+            if circuit_breaker:
+                await circuit_breaker.wait_closed()
+            try:
+                result = await attempt_fn()
+            except Exception as e:
+                kind = classify_error(e)
+                if circuit_breaker and kind in TRANSIENT_ERRORS:
+                    circuit_breaker.record(False)
+
+                if kind == ERROR_MALFORMED:
+                    if malformed_retries >= self.max_malformed_retries:
+                        raise
+                    malformed_retries += 1
+                    logger.warning(
+                        f"模型输出格式错误，进行第 {malformed_retries} 次重试: {e}"
+                    )
+                    continue
+                if kind not in TRANSIENT_ERRORS or (
+                    transient_retries >= self.max_transient_retries
+                ):
+                    raise
+
+                transient_retries += 1
+                delay = self.backoff_delay(transient_retries, get_retry_after(e))
+                logger.warning(
+                    f"请求失败（{kind}），{delay:.1f} 秒后进行第 {transient_retries} 次重试: {e}"
+                )
+                await self._sleep(delay)
+                continue
+
+            if circuit_breaker:
+                circuit_breaker.record(True)
+            return result
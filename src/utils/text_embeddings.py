@@ -0,0 +1,135 @@
+"""
+Local CPU text embeddings for corpus conversations.
+
+The default HashingTfidfEmbedder needs no model: character unigrams and
+bigrams are hashed into EMBEDDING_DIM buckets with numpy, term counts are
+log-scaled and weighted by an IDF vector computed from the dataset, and
+vectors are L2-normalized so a dot product is the cosine similarity. When the
+optional `sentence-transformers` package is installed, a local model can be
+used instead (EMBEDDING_MODEL environment variable).
+"""
+
+import importlib.util
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from src.utils.dialogue_turns import dialogue_messages, normalize_text
+
+BACKEND_HASHING = "hashing"
+BACKEND_SENTENCE_TRANSFORMERS = "sentence-transformers"
+
+SENTENCE_TRANSFORMERS_AVAILABLE = (
+    importlib.util.find_spec("sentence_transformers") is not None
+)
+DEFAULT_SENTENCE_MODEL = os.getenv(
+    "EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2"
+)
+
+# 哈希 TF-IDF 向量的维度
+EMBEDDING_DIM = 512
+VECTOR_DTYPE = np.dtype("<f4")
+
+_FEATURE_BASE = np.uint64(0x100000001B3)
+_FEATURE_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def conversation_text(dialogue_data) -> str:
+    """拼接对话中全部消息的规范化文本，用于计算话题向量"""
+    dialogues = dialogue_messages(dialogue_data) or []
+    return "\n".join(
+        normalize_text(turn["content"])
+        for turn in dialogues
+        if isinstance(turn, dict) and isinstance(turn.get("content"), str)
+    )
+
+
+def conversation_snippet(dialogue_data, length: int = 60) -> str:
+    """对话的简短摘要：第一条用户消息与第一条 assistant 回复的开头"""
+    parts = {}
+    for turn in dialogue_messages(dialogue_data) or []:
+        if not isinstance(turn, dict) or not isinstance(turn.get("content"), str):
+            continue
+        role = turn.get("role")
+        if role in ("user", "assistant") and role not in parts:
+            parts[role] = normalize_text(turn["content"])
+    snippet = " / ".join(parts[role] for role in ("user", "assistant") if role in parts)
+    return snippet[:length]
+
+
+def _feature_buckets(text: str, dim: int) -> np.ndarray:
+    """文本的字符 1-gram 与 2-gram 所在的哈希桶（可能重复）"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype="<u4").astype(np.uint64)
+    if not len(codes):
+        return np.empty(0, dtype=np.int64)
+    features = np.concatenate([codes, codes[:-1] * _FEATURE_BASE ^ codes[1:]])
+    mixed = features * _FEATURE_MIX
+    return ((mixed >> np.uint64(32)) % np.uint64(dim)).astype(np.int64)
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(VECTOR_DTYPE)
+
+
+class HashingTfidfEmbedder:
+    """哈希技巧的字符 n-gram TF-IDF 向量，不需要模型文件"""
+
+    backend = BACKEND_HASHING
+
+    def __init__(self, dim: int = EMBEDDING_DIM, idf: Optional[np.ndarray] = None):
+        self.dim = dim
+        self.idf = (
+            np.asarray(idf, dtype=VECTOR_DTYPE)
+            if idf is not None
+            else np.ones(dim, dtype=VECTOR_DTYPE)
+        )
+
+    @staticmethod
+    def idf_from_counts(document_counts: np.ndarray, total_documents: int):
+        """由各哈希桶的文档频数计算平滑 IDF"""
+        return (
+            np.log((1 + total_documents) / (1 + document_counts.astype(np.float64))) + 1
+        ).astype(VECTOR_DTYPE)
+
+    def document_counts(self, texts: List[str]) -> np.ndarray:
+        """一批文本中各哈希桶出现的文档数"""
+        counts = np.zeros(self.dim, dtype=np.int64)
+        for text in texts:
+            counts[np.unique(_feature_buckets(text, self.dim))] += 1
+        return counts
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """返回 (len(texts), dim) 的单位向量矩阵"""
+        vectors = np.zeros((len(texts), self.dim), dtype=VECTOR_DTYPE)
+        for i, text in enumerate(texts):
+            counts = np.bincount(_feature_buckets(text, self.dim), minlength=self.dim)
+            vectors[i] = np.log1p(counts) * self.idf
+        return _normalize_rows(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """本地 sentence-transformers 模型的句向量（可选依赖）"""
+
+    backend = BACKEND_SENTENCE_TRANSFORMERS
+
+    def __init__(self, model_name: str = DEFAULT_SENTENCE_MODEL):
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            raise ValueError(
+                "本地模型向量需要安装 sentence-transformers: pip install sentence-transformers"
+            )
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dim), dtype=VECTOR_DTYPE)
+        vectors = self._model.encode(
+            texts, batch_size=64, normalize_embeddings=True, show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=VECTOR_DTYPE)
@@ -0,0 +1,135 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from src.database.database_manager import (
+    DatabaseManager,
+    create_db_engine,
+    get_engine_profile,
+)
+from src.models.data_models import Base
+
+
+@pytest.fixture
+def engines(tmp_path):
+    db_url = f"sqlite:///{tmp_path / 'test.db'}"
+    profile = get_engine_profile("wal")
+    write_engine = create_db_engine(db_url, profile)
+    read_engine = create_db_engine(db_url, profile, read_only=True)
+    with write_engine.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO items (name) VALUES ('a'), ('b')"))
+    yield write_engine, read_engine
+    write_engine.dispose()
+    read_engine.dispose()
+
+
+def _manager_for(engine) -> DatabaseManager:
+    """不经过单例初始化，只绑定给定引擎的 DatabaseManager"""
+    manager = object.__new__(DatabaseManager)
+    manager.engine = engine
+    return manager
+
+
+def _count_items(read_engine) -> int:
+    with read_engine.connect() as conn:
+        return conn.execute(text("SELECT count(*) FROM items")).scalar()
+
+
+def test_reads_succeed_while_write_transaction_is_open(engines):
+    write_engine, read_engine = engines
+    with write_engine.connect() as writer:
+        transaction = writer.begin()
+        writer.execute(text("INSERT INTO items (name) VALUES ('c')"))
+
+        # 写事务未提交时，多个线程的读取立即返回已提交的数据，不等待写锁
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(_count_items, read_engine) for _ in range(8)]
+            assert [f.result(timeout=5) for f in futures] == [2] * 8
+
+        transaction.commit()
+    assert _count_items(read_engine) == 3
+
+
+def test_write_waits_for_open_write_transaction(engines):
+    write_engine, _ = engines
+    with write_engine.connect() as writer:
+        transaction = writer.begin()
+        writer.execute(text("INSERT INTO items (name) VALUES ('c')"))
+
+        second_write_done = threading.Event()
+
+        def second_write():
+            with write_engine.begin() as conn:
+                conn.execute(text("INSERT INTO items (name) VALUES ('d')"))
+            second_write_done.set()
+
+        thread = threading.Thread(target=second_write)
+        thread.start()
+        assert not second_write_done.wait(0.3)
+        transaction.commit()
+        thread.join(timeout=5)
+        assert second_write_done.is_set()
+
+
+def test_read_engine_is_query_only(engines):
+    _, read_engine = engines
+    with read_engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("INSERT INTO items (name) VALUES ('x')"))
+
+
+def test_added_columns_fill_existing_rows_with_defaults(tmp_path):
+    engine = create_db_engine(
+        f"sqlite:///{tmp_path / 'old.db'}", get_engine_profile("wal")
+    )
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO api_configs (name, api_type, api_key_encrypted) "
+                "VALUES ('old', 'openai', 'key')"
+            )
+        )
+        conn.execute(
+            text(
+                "INSERT INTO dataset_stats (dataset_id, total_count, total_chars, "
+                "scenario_counts, turn_histogram) VALUES (1, 0, 0, '{}', '{}')"
+            )
+        )
+        # 模拟这些列加入模型之前创建的数据库
+        for table, column in [
+            ("api_configs", "top_p"),
+            ("api_configs", "rpm_limit"),
+            ("api_configs", "created_at"),
+            ("dataset_stats", "scenario_counts"),
+        ]:
+            conn.execute(text(f'ALTER TABLE "{table}" DROP COLUMN "{column}"'))
+
+    _manager_for(engine)._add_missing_columns()
+
+    with engine.begin() as conn:
+        top_p, rpm_limit, created_at = conn.execute(
+            text("SELECT top_p, rpm_limit, created_at FROM api_configs")
+        ).one()
+        assert (top_p, rpm_limit) == (1.0, 0)
+        assert created_at is not None
+        assert (
+            conn.execute(text("SELECT scenario_counts FROM dataset_stats")).scalar()
+            == "{}"
+        )
+
+        # 常量默认值写入了列定义，之后不经过 ORM 的插入也会使用
+        conn.execute(
+            text(
+                "INSERT INTO api_configs (name, api_type, api_key_encrypted) "
+                "VALUES ('new', 'openai', 'key')"
+            )
+        )
+        assert conn.execute(
+            text("SELECT top_p, rpm_limit FROM api_configs WHERE name = 'new'")
+        ).one() == (1.0, 0)
+    engine.dispose()
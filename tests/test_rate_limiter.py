@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from src.utils.rate_limiter import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    """可手动推进的时钟；sleep() 直接把时间推进相应的秒数"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.advance(seconds)
+
+
+def test_bucket_starts_full_and_refills_over_time():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=2, clock=clock)
+    assert bucket.available == 10
+
+    assert bucket.reserve(10) == 0
+    assert bucket.available == 0
+
+    clock.advance(1.5)
+    assert bucket.available == pytest.approx(3)
+
+
+def test_bucket_refill_is_capped_at_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=2, clock=clock)
+    bucket.reserve(4)
+
+    clock.advance(3600)
+    assert bucket.available == 10
+
+
+def test_bucket_reservation_beyond_balance_returns_wait():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=2, clock=clock)
+    bucket.reserve(10)
+
+    # 余额可以为负，等待时间为补足欠额所需的时间，先到者先放行
+    assert bucket.reserve(4) == pytest.approx(2)
+    assert bucket.reserve(2) == pytest.approx(3)
+
+    clock.advance(3)
+    assert bucket.available == pytest.approx(0)
+
+
+def test_bucket_single_reservation_is_capped_at_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+
+    assert bucket.reserve(50) == 0
+    assert bucket.available == 0
+
+
+def test_bucket_refund_does_not_exceed_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+    bucket.reserve(6)
+
+    bucket.refund(4)
+    assert bucket.available == 8
+    bucket.refund(100)
+    assert bucket.available == 10
+
+
+def test_clock_going_backwards_does_not_remove_tokens():
+    clock = FakeClock()
+    bucket = TokenBucket(capacity=10, refill_rate=1, clock=clock)
+    bucket.reserve(5)
+
+    clock.advance(-100)
+    assert bucket.available == 5
+
+
+def test_rpm_limit_spaces_requests_after_burst():
+    clock = FakeClock()
+    limiter = RateLimiter(rpm_limit=60, clock=clock, sleep=clock.sleep)
+
+    async def send(count):
+        for _ in range(count):
+            await limiter.acquire(100)
+
+    start = clock.now
+    asyncio.run(send(60))
+    assert clock.now == start
+    assert clock.sleeps == []
+
+    asyncio.run(send(3))
+    # 突发额度用尽后每秒放行一个请求
+    assert clock.sleeps == pytest.approx([1, 1, 1])
+    assert clock.now - start == pytest.approx(3)
+
+
+def test_tpm_limit_dominates_when_requests_are_large():
+    clock = FakeClock()
+    limiter = RateLimiter(rpm_limit=600, tpm_limit=6000, clock=clock)
+
+    assert limiter.reserve(6000) == 0
+    # RPM 还有余量，但 TPM 需要 30 秒才能补足 3000 个 token
+    assert limiter.reserve(3000) == pytest.approx(30)
+
+
+def test_rpm_limit_dominates_when_requests_are_small():
+    clock = FakeClock()
+    limiter = RateLimiter(rpm_limit=2, tpm_limit=100000, clock=clock)
+
+    assert limiter.reserve(10) == 0
+    assert limiter.reserve(10) == 0
+    assert limiter.reserve(10) == pytest.approx(30)
+
+
+def test_settle_refunds_unused_tokens():
+    clock = FakeClock()
+    limiter = RateLimiter(tpm_limit=1000, clock=clock)
+
+    reserved = asyncio.run(limiter.acquire(1000))
+    limiter.settle(reserved, actual_tokens=400)
+    assert limiter.reserve(600) == 0
+    assert limiter.reserve(60) == pytest.approx(3.6)
+
+
+def test_settle_without_usage_keeps_reservation():
+    clock = FakeClock()
+    limiter = RateLimiter(tpm_limit=1000, clock=clock)
+
+    limiter.settle(asyncio.run(limiter.acquire(1000)), actual_tokens=None)
+    assert limiter.reserve(100) == pytest.approx(6)
+
+
+def test_unlimited_limiter_never_waits():
+    clock = FakeClock()
+    limiter = RateLimiter(rpm_limit=0, tpm_limit=None, clock=clock)
+
+    assert all(limiter.reserve(10**6) == 0 for _ in range(1000))